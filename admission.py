@@ -0,0 +1,212 @@
+# admission.py
+"""
+Контроль допуску запитів до upstream-сервісів (API Gateway):
+  - ліміт одночасних запитів на сервіс з обмеженою чергою (переповнення -> 503 + Retry-After);
+  - token bucket на частоту запитів (перевищення -> 429 + Retry-After);
+  - адаптивний ліміт (AIMD за затримкою): ліміт росте, поки затримка близька до базової,
+    і зменшується мультиплікативно, коли затримка або помилки свідчать про перевантаження.
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Dict, Optional
+
+ADMISSION_DEFAULTS = {
+    "max_concurrency": 64,     # статичний ліміт або стеля адаптивного
+    "min_concurrency": 4,      # нижня межа адаптивного ліміту
+    "adaptive": True,
+    "max_queue": 128,          # скільки запитів може чекати на слот
+    "queue_timeout": 1.0,      # скільки чекати в черзі, с
+    "rate": None,              # запитів на секунду (None — без обмеження)
+    "burst": None,             # розмір бакета (за замовчуванням = rate)
+}
+LATENCY_TOLERANCE = 2.0        # затримка вище базової в стільки разів — ознака перевантаження
+BACKOFF_RATIO = 0.9            # мультиплікативне зменшення ліміту
+BASELINE_DECAY = 0.01          # як швидко базова затримка "забуває" старий мінімум
+RECENT_WEIGHT = 0.2            # вага нового виміру в короткостроковій EWMA затримки
+WARMUP_SAMPLES = 20            # перші виміри (холодні з'єднання) лише формують базу
+
+
+class Rejected(Exception):
+    """Запит відхилено контролем допуску."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def try_acquire(self) -> float:
+        """0 — токен видано, інакше через скільки секунд він з'явиться."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return 0.0
+        return (1.0 - self._tokens) / self.rate
+
+
+class AimdLimit:
+    """Адаптивний ліміт одночасних запитів: адитивне зростання, мультиплікативне зменшення."""
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.baseline: Optional[float] = None   # "мінімальна" затримка без черги
+        self.recent: Optional[float] = None     # короткострокова EWMA затримки
+        self._cooldown = WARMUP_SAMPLES         # після зменшення чекаємо "вікно" запитів
+
+    def on_sample(self, latency: float, ok: bool, in_flight: int):
+        if self.baseline is None:
+            self.baseline = self.recent = latency
+        elif latency < self.baseline:
+            self.baseline = latency
+        else:
+            # Повільно підтягуємо базу вгору, щоб зміна середовища не заморозила ліміт
+            self.baseline += (latency - self.baseline) * BASELINE_DECAY
+        self.recent += (latency - self.recent) * RECENT_WEIGHT
+        if self._cooldown > 0:
+            self._cooldown -= 1
+            return
+        if not ok or self.recent > self.baseline * LATENCY_TOLERANCE:
+            self.limit = max(self.min_limit, self.limit * BACKOFF_RATIO)
+            self._cooldown = int(self.limit)
+        elif in_flight >= self.value:
+            # Ліміт реально використовується — пробуємо трохи більше (+1 за "вікно" запитів)
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    @property
+    def value(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+
+class ServiceAdmission:
+    """Ліміт одночасних запитів, черга очікування та rate limit одного сервісу."""
+
+    def __init__(self, name: str, max_concurrency: int, min_concurrency: int, adaptive: bool,
+                 max_queue: int, queue_timeout: float, rate: Optional[float], burst: Optional[float]):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.adaptive = AimdLimit(max(min_concurrency, max_concurrency // 2), min_concurrency,
+                                  max_concurrency) if adaptive else None
+        self.bucket = TokenBucket(rate, burst or rate) if rate else None
+        self.in_flight = 0
+        self._waiters = deque()
+        self._avg_latency = 0.05
+        self._counters = {"admitted": 0, "queued": 0, "rejected_queue": 0, "rejected_rate": 0}
+
+    @property
+    def limit(self) -> int:
+        return self.adaptive.value if self.adaptive else self.max_concurrency
+
+    def _retry_after(self) -> float:
+        # Оцінка часу, за який черга розсмокчеться
+        return self._avg_latency * (len(self._waiters) + 1) / max(1, self.limit)
+
+    async def acquire(self) -> float:
+        """Повертає момент допуску (для виміру затримки) або кидає Rejected."""
+        if self.bucket is not None:
+            wait = self.bucket.try_acquire()
+            if wait:
+                self._counters["rejected_rate"] += 1
+                raise Rejected(429, f"Перевищено ліміт запитів до сервісу {self.name}", wait)
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+        else:
+            if len(self._waiters) >= self.max_queue:
+                self._counters["rejected_queue"] += 1
+                raise Rejected(503, f"Сервіс {self.name} перевантажений", self._retry_after())
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            self._counters["queued"] += 1
+            try:
+                # Слот передає release(): in_flight вже збільшено за нас
+                await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._abandon(future)
+                self._counters["rejected_queue"] += 1
+                raise Rejected(503, f"Сервіс {self.name} перевантажений", self._retry_after())
+            except asyncio.CancelledError:
+                self._abandon(future)
+                raise
+        self._counters["admitted"] += 1
+        return time.monotonic()
+
+    def _abandon(self, future: asyncio.Future):
+        if future.done() and not future.cancelled():
+            # Слот уже передано, але він не знадобився — повертаємо
+            self._release_slot()
+        else:
+            future.cancel()
+            try:
+                self._waiters.remove(future)
+            except ValueError:
+                pass
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < self.limit:
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def release(self, admitted_at: float, ok: bool = True, responded_at: Optional[float] = None):
+        """
+        responded_at — момент отримання заголовків відповіді (для потокових відповідей): AIMD бачить
+        лише затримку upstream, а не час, за який клієнт дочитує тіло. Слот звільняється зараз.
+        """
+        now = time.monotonic()
+        held = now - admitted_at
+        # Retry-After оцінює, як довго тримаються слоти, — тут потрібен повний час
+        self._avg_latency += (held - self._avg_latency) * 0.1
+        if self.adaptive is not None:
+            latency = held if responded_at is None else responded_at - admitted_at
+            self.adaptive.on_sample(latency, ok, self.in_flight)
+        self._release_slot()
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "in_flight": self.in_flight, "queued_now": len(self._waiters),
+                "avg_latency_ms": round(self._avg_latency * 1000, 3), **self._counters}
+
+
+class AdmissionController:
+    """Контроль допуску для кожного upstream-сервісу за його налаштуваннями."""
+
+    def __init__(self, settings: Dict[str, dict], defaults: dict = ADMISSION_DEFAULTS):
+        self._settings = settings
+        self._defaults = defaults
+        self._services: Dict[str, ServiceAdmission] = {}
+
+    def service(self, name: str) -> ServiceAdmission:
+        admission = self._services.get(name)
+        if admission is None:
+            cfg = {**self._defaults, **self._settings.get(name, {})}
+            admission = self._services[name] = ServiceAdmission(name, **cfg)
+        return admission
+
+    async def acquire(self, name: str) -> float:
+        return await self.service(name).acquire()
+
+    def release(self, name: str, admitted_at: float, ok: bool = True, responded_at: Optional[float] = None):
+        self.service(name).release(admitted_at, ok, responded_at)
+
+    def stats(self) -> dict:
+        return {name: a.stats() for name, a in self._services.items()}
@@ -1,80 +1,953 @@
 # api_gateway.py
 import httpx
 from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import Response, StreamingResponse
 from contextlib import asynccontextmanager
+from collections import OrderedDict
+from pydantic import BaseModel
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 import uvicorn
-import random
+import asyncio
+import fnmatch
+import json
+import time
 
-# Конфигурация инфраструктуры 
+from admission import AdmissionController, Rejected
+from discovery_client import RegistryWatcher
+from etag import etag_matches
+from load_balancer import LoadBalancer
+from resilience import BreakerRegistry, UpstreamCaller
+
+try:
+    import h2  # noqa: F401  (нужен httpx для HTTP/2)
+except ImportError:
+    h2 = None
+
+# Конфигурация инфраструктуры
 DISCOVERY_URL = "http://127.0.0.1:8000"
 
-async def get_service_url(service_name: str):
+# Режим проксирования:
+#   "stream" — тела запроса и ответа идут чанками, статус и заголовки upstream сохраняются;
+#   "json"   — старое поведение: ответ буферизуется и заворачивается в JSON (всегда 200).
+PROXY_MODE = "stream"
+
+# Hop-by-hop заголовки не пересылаются через прокси (RFC 7230, 6.1)
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "trailers", "transfer-encoding", "upgrade",
+}
+# Эти заголовки ответа uvicorn выставляет сам
+SERVER_HEADERS = {"date", "server"}
+
+# Тела запросов до этого размера читаются целиком: их можно повторить при редиректе
+# upstream (например, /loans/ -> /loans). Большие тела и тела без длины идут потоком.
+STREAM_BODY_THRESHOLD = 64 * 1024
+
+# --- Настройки пула соединений ---
+# Значения по умолчанию для любого upstream; переопределяются в UPSTREAM_SETTINGS
+POOL_DEFAULTS = {
+    "max_connections": 100,            # жёсткий предел соединений на upstream
+    "max_keepalive_connections": 20,   # сколько простаивающих соединений держать
+    "keepalive_expiry": 30.0,          # секунд жизни простаивающего соединения
+    "connect_timeout": 2.0,
+    "read_timeout": 10.0,
+    "http2": False,
+}
+
+UPSTREAM_SETTINGS: Dict[str, dict] = {
+    "catalog": {"max_connections": 200, "max_keepalive_connections": 50},
+    "readers": {"max_connections": 100},
+    "loans": {"max_connections": 100, "read_timeout": 15.0},
+}
+
+DISCOVERY_SETTINGS = {"max_connections": 20, "max_keepalive_connections": 10,
+                      "connect_timeout": 1.0, "read_timeout": 2.0}
+
+
+class UpstreamPool:
     """
-    Динамическое обнаружение адреса сервиса.
-    Реализует критерий 'Динамическая маршрутизация'.
+    Долгоживущие httpx-клиенты: по одному на каждый upstream и отдельный для Discovery.
+    Создаются и закрываются в lifespan шлюза, соединения переиспользуются между запросами.
     """
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(f"{DISCOVERY_URL}/services/{service_name}")
-            instances = resp.json()
-            if not instances:
-                raise HTTPException(status_code=503, detail=f"Сервис {service_name} не найден")
-            
-            # Балансировка нагрузки: выбираем случайный инстанс 
-            instance = random.choice(instances)
-            return f"http://{instance['host']}:{instance['port']}"
-        except Exception:
-            raise HTTPException(status_code=503, detail="Discovery Service недоступен")
+
+    def __init__(self, settings: Dict[str, dict], defaults: dict, discovery_settings: dict):
+        self._settings = settings
+        self._defaults = defaults
+        self._discovery_settings = discovery_settings
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._discovery: Optional[httpx.AsyncClient] = None
+        self._requests: Dict[str, int] = {}
+        self._in_flight: Dict[str, int] = {}
+
+    def _build_client(self, overrides: dict) -> httpx.AsyncClient:
+        cfg = {**self._defaults, **overrides}
+        limits = httpx.Limits(
+            max_connections=cfg["max_connections"],
+            max_keepalive_connections=cfg["max_keepalive_connections"],
+            keepalive_expiry=cfg["keepalive_expiry"],
+        )
+        timeout = httpx.Timeout(cfg["read_timeout"], connect=cfg["connect_timeout"])
+        # HTTP/2 включаем только если установлен пакет h2
+        http2 = bool(cfg["http2"]) and h2 is not None
+        return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2, follow_redirects=True)
+
+    def open(self):
+        self._discovery = self._build_client(self._discovery_settings)
+        for name, overrides in self._settings.items():
+            self._clients[name] = self._build_client(overrides)
+
+    async def aclose(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+        if self._discovery is not None:
+            await self._discovery.aclose()
+            self._discovery = None
+
+    @property
+    def discovery(self) -> httpx.AsyncClient:
+        if self._discovery is None:
+            raise HTTPException(status_code=503, detail="Gateway ещё не запущен")
+        return self._discovery
+
+    def client(self, service_name: str) -> httpx.AsyncClient:
+        """Клиент для upstream; для неописанного сервиса создаётся с настройками по умолчанию."""
+        client = self._clients.get(service_name)
+        if client is None:
+            if self._discovery is None:
+                raise HTTPException(status_code=503, detail="Gateway ещё не запущен")
+            client = self._clients[service_name] = self._build_client({})
+        return client
+
+    def acquire(self, service_name: str):
+        self._requests[service_name] = self._requests.get(service_name, 0) + 1
+        self._in_flight[service_name] = self._in_flight.get(service_name, 0) + 1
+
+    def release(self, service_name: str):
+        self._in_flight[service_name] -= 1
+
+    @staticmethod
+    def _connection_stats(client: httpx.AsyncClient) -> dict:
+        # httpx не даёт публичного API для пула — читаем состояние httpcore осторожно
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []) or [])
+        idle = sum(1 for c in connections if c.is_idle())
+        return {"open": len(connections), "idle": idle, "active": len(connections) - idle}
+
+    def stats(self) -> dict:
+        result = {}
+        for name, client in self._clients.items():
+            cfg = {**self._defaults, **self._settings.get(name, {})}
+            result[name] = {
+                "requests": self._requests.get(name, 0),
+                "in_flight": self._in_flight.get(name, 0),
+                "connections": self._connection_stats(client),
+                "limits": {k: cfg[k] for k in ("max_connections", "max_keepalive_connections", "keepalive_expiry")},
+                "http2": bool(cfg["http2"]) and h2 is not None,
+            }
+        if self._discovery is not None:
+            result["_discovery"] = {"connections": self._connection_stats(self._discovery)}
+        return result
+
+
+pool = UpstreamPool(UPSTREAM_SETTINGS, POOL_DEFAULTS, DISCOVERY_SETTINGS)
+
+# --- Локальный кэш Discovery ---
+RESOLVER_STALE_TTL = 60.0         # сколько отдавать устаревший список, если Discovery недоступен
+EVICTION_QUARANTINE = 15.0        # сколько не возвращать инстанс после ошибки соединения (TTL Discovery)
+
+
+class ServiceResolver:
+    """
+    Кэш списков инстансов в памяти шлюза.
+    Горячий путь не ходит в Discovery: списки поддерживает RegistryWatcher (long-poll /watch),
+    при недоступности Discovery ограниченное время отдаются устаревшие данные.
+    """
+
+    def __init__(self, watcher: RegistryWatcher, stale_ttl: float, quarantine: float):
+        self._watcher = watcher
+        self._stale_ttl = stale_ttl
+        self._quarantine = quarantine
+        # { "service_name": { "host:port": ejected_until } }
+        self._evicted: Dict[str, Dict[str, float]] = {}
+        # { "service_name": (исходный список watcher, список без карантина, действителен до) }
+        self._filtered: Dict[str, Tuple[list, list, float]] = {}
+        # Сервисы из конфигурации шлюза отслеживаются всегда; любые другие — пока есть инстансы
+        self._configured: set = set()
+        self._counters = {"hits": 0, "stale_hits": 0, "cold_fetches": 0, "refresh_errors": 0, "evictions": 0,
+                          "panics": 0}
+
+    @staticmethod
+    def instance_key(instance: dict) -> str:
+        return f"{instance['host']}:{instance['port']}"
+
+    def _instances(self, name: str, source: list) -> list:
+        now = time.time()
+        cached = self._filtered.get(name)
+        if cached is not None and cached[0] is source and now < cached[2]:
+            return cached[1]
+        evicted = self._evicted.get(name)
+        if not evicted:
+            return source
+        for key, until in list(evicted.items()):
+            if until <= now:
+                del evicted[key]
+        instances = [i for i in source if self.instance_key(i) not in evicted]
+        if not instances and source:
+            # Режим паники: в карантине все инстансы — лучше попытка к любому из них, чем 503 на весь карантин
+            instances = source
+            self._counters["panics"] += 1
+        self._filtered[name] = (source, instances, min(evicted.values(), default=float("inf")))
+        return instances
+
+    async def resolve(self, name: str) -> list:
+        watched = self._watcher.get(name)
+        if watched is None:
+            self._counters["cold_fetches"] += 1
+            try:
+                watched = await self._watcher.ensure(name, persistent=name in self._configured)
+            except Exception:
+                raise HTTPException(status_code=503, detail="Discovery Service недоступен")
+        elif not watched.connected:
+            if time.time() - watched.synced_at > self._stale_ttl:
+                raise HTTPException(status_code=503, detail="Discovery Service недоступен")
+            self._counters["stale_hits"] += 1
+        else:
+            self._counters["hits"] += 1
+        instances = self._instances(name, watched.instances)
+        if not instances:
+            raise HTTPException(status_code=503, detail=f"Сервис {name} не найден")
+        return instances
+
+    def evict(self, name: str, instance: dict):
+        """
+        Немедленно убирает инстанс из кэша после ошибки соединения.
+        Если в карантине окажутся все инстансы сервиса, resolve отдаёт полный список.
+        """
+        self._evicted.setdefault(name, {})[self.instance_key(instance)] = time.time() + self._quarantine
+        self._filtered.pop(name, None)
+        self._counters["evictions"] += 1
+
+    async def start(self, client: httpx.AsyncClient, names):
+        """Первичная загрузка известных сервисов и запуск watch-задач."""
+        self._watcher.open(client)
+        self._configured = set(names)
+        for name in names:
+            try:
+                await self._watcher.ensure(name)
+            except Exception:
+                self._counters["refresh_errors"] += 1
+
+    async def stop(self):
+        await self._watcher.aclose()
+
+    def stats(self) -> dict:
+        return {**self._watcher.stats(), **self._counters}
+
+
+resolver = ServiceResolver(RegistryWatcher(DISCOVERY_URL), RESOLVER_STALE_TTL, EVICTION_QUARANTINE)
+
+# --- Балансировка нагрузки ---
+# Политика на сервис: round_robin | least_outstanding | p2c | ewma
+BALANCING_POLICIES = {"catalog": "ewma", "readers": "p2c", "loans": "least_outstanding"}
+DEFAULT_BALANCING_POLICY = "p2c"
+
+balancer = LoadBalancer(BALANCING_POLICIES, default=DEFAULT_BALANCING_POLICY)
+
+# --- Устойчивость: circuit breaker, повторы, hedging ---
+# Перцентиль задержки, после которого GET дублируется на другую реплику (None — без hedging)
+HEDGE_PERCENTILES = {"catalog": 95, "readers": 95}
+IDEMPOTENT_METHODS = {"GET", "HEAD"}
+
+breakers = BreakerRegistry()
+upstream = UpstreamCaller(balancer, breakers, HEDGE_PERCENTILES)
+
+# --- Контроль допуска и сброс нагрузки ---
+# Лимит одновременных запросов (адаптивный — AIMD по задержке), очередь и rate limit на сервис.
+# Ответы из кэша и присоединившиеся к single-flight запросы лимит не расходуют.
+ADMISSION_SETTINGS = {
+    "catalog": {"max_concurrency": 64, "max_queue": 256, "rate": 1000, "burst": 2000},
+    "readers": {"max_concurrency": 32, "max_queue": 128, "rate": 500, "burst": 1000},
+    "loans": {"max_concurrency": 16, "max_queue": 64, "rate": 200, "burst": 400},
+}
+
+admission = AdmissionController(ADMISSION_SETTINGS)
+
+
+async def _admit(service_name: str) -> float:
+    """Слот у upstream или быстрый отказ 503/429 с Retry-After."""
+    try:
+        return await admission.acquire(service_name)
+    except Rejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail,
+                            headers={"Retry-After": e.retry_after_header})
+
+# --- Объединение одинаковых запросов (single-flight) ---
+# Маршруты (путь после имени сервиса, шаблоны fnmatch), для которых одновременные
+# одинаковые GET разделяют один запрос к upstream
+COALESCE_ROUTES = {
+    "catalog": ["books", "books/*", "search"],
+    "readers": ["", "*"],
+    "loans": ["active", "history/*"],
+}
+# Потоковые выгрузки (NDJSON) и long-poll ленты изменений: идут через прокси чанками,
+# не объединяются и не кэшируются
+STREAM_ROUTES = {
+    "catalog": ["books/export"],
+    "readers": ["export", "changes"],
+}
+# Заголовки, от которых зависит ответ и которые входят в ключ объединения
+COALESCE_HEADERS = ("accept", "accept-encoding", "authorization")
+# Объединяются и кэшируются только ответы до этого размера: большие (например, весь /catalog/books
+# без limit) идут потоком с постоянной памятью, как и остальные маршруты
+COALESCE_MAX_BYTES = 1024 * 1024
+LARGE_RESPONSE_TTL = 60.0         # сколько помнить, что запрос отдаёт большой ответ (с)
+LARGE_RESPONSE_KEYS = 1000        # сколько таких запросов помнить
+
+
+class UpstreamResult:
+    """Полностью прочитанный ответ upstream (тело — сырые байты, как пришли)."""
+    __slots__ = ("status_code", "headers", "content")
+
+    def __init__(self, status_code: int, headers: dict, content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def to_response(self) -> Response:
+        return Response(self.content, status_code=self.status_code, headers=self.headers)
+
+
+class ResponseTooLarge(Exception):
+    """Ответ upstream больше предела буферизации."""
+
+
+class LargeResponses:
+    """
+    Ключи объединения, ответ на которые оказался больше COALESCE_MAX_BYTES.
+    Повторные такие GET сразу идут потоком, без пробного запроса с буферизацией.
+    """
+
+    def __init__(self, ttl: float, max_keys: int):
+        self._ttl = ttl
+        self._max_keys = max_keys
+        self._keys: "OrderedDict[tuple, float]" = OrderedDict()
+        self._counters = {"marked": 0, "streamed": 0}
+
+    def seen(self, key: tuple) -> bool:
+        expires = self._keys.get(key)
+        if expires is None:
+            return False
+        if expires <= time.monotonic():
+            del self._keys[key]
+            return False
+        self._counters["streamed"] += 1
+        return True
+
+    def mark(self, key: tuple):
+        self._keys[key] = time.monotonic() + self._ttl
+        self._keys.move_to_end(key)
+        while len(self._keys) > self._max_keys:
+            self._keys.popitem(last=False)
+        self._counters["marked"] += 1
+
+    def stats(self) -> dict:
+        return {"keys": len(self._keys), **self._counters}
+
+
+large_responses = LargeResponses(LARGE_RESPONSE_TTL, LARGE_RESPONSE_KEYS)
+
+
+class SingleFlight:
+    """
+    Одновременные вызовы с одинаковым ключом ждут один и тот же запрос к upstream.
+    Запрос выполняется отдельной задачей: отключение первого клиента не отменяет его для остальных.
+    """
+
+    def __init__(self):
+        self._calls: Dict[tuple, asyncio.Task] = {}
+        self._counters = {"requests": 0, "upstream_calls": 0, "coalesced": 0}
+
+    async def do(self, key: tuple, fn: Callable[[], Awaitable[UpstreamResult]]) -> UpstreamResult:
+        self._counters["requests"] += 1
+        task = self._calls.get(key)
+        if task is None:
+            self._counters["upstream_calls"] += 1
+            task = self._calls[key] = asyncio.create_task(fn())
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self._counters["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: tuple, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # ошибку уже получили ожидающие; не даём asyncio ругаться
+
+    def stats(self) -> dict:
+        requests = self._counters["requests"]
+        ratio = self._counters["coalesced"] / requests if requests else 0.0
+        return {**self._counters, "in_flight": len(self._calls), "coalescing_ratio": round(ratio, 4)}
+
+
+single_flight = SingleFlight()
+
+
+def _coalescing_key(service_name: str, clean_path: str, method: str, params: list, headers) -> Optional[tuple]:
+    """Ключ объединения или None, если маршрут не участвует."""
+    if method != "GET":
+        return None
+    patterns = COALESCE_ROUTES.get(service_name, ())
+    if not any(fnmatch.fnmatchcase(clean_path, p) for p in patterns):
+        return None
+    if any(fnmatch.fnmatchcase(clean_path, p) for p in STREAM_ROUTES.get(service_name, ())):
+        return None
+    query = tuple(sorted(params))
+    header_values = tuple(headers.get(h, "") for h in COALESCE_HEADERS)
+    return method, service_name, clean_path, query, header_values
+
+# --- Кэш ответов (LRU + TTL, ETag, инвалидация при записи) ---
+# Маршруты, ответы которых кэшируются, и TTL свежести по сервисам
+CACHE_ROUTES = {
+    "catalog": ["books", "books/*", "search"],
+    "readers": ["", "*"],
+}
+CACHE_TTL = {"catalog": 30.0, "readers": 10.0}
+CACHE_MAX_ENTRIES = 1000
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+# Успешная запись (POST/PUT/DELETE) в сервис -> какие кэшированные пути она затрагивает.
+# Шаблоны fnmatch; {0}, {1}... — сегменты пути записи. Если правило не найдено,
+# сбрасываются все записи сервиса.
+CACHE_INVALIDATION: Dict[str, List[Tuple[str, List[str]]]] = {
+    "catalog": [
+        ("books", ["books", "books/search/*", "search"]),
+        ("books/batch-get", []),   # чтение через POST: кэш не трогает
+        ("books/status", ["books", "books/*", "search"]),
+        ("books/*/reserve", ["books", "books/{1}", "books/search/*", "search"]),
+        ("reservations/*/confirm", []),   # статус книг уже изменён резервацией
+        ("reservations", ["books", "books/*", "search"]),
+        ("reservations/*", ["books", "books/*", "search"]),
+        ("books/*/status", ["books", "books/{1}", "books/search/*", "search"]),
+    ],
+    "readers": [
+        ("", ["", "search*"]),
+        ("batch-get", []),   # чтение через POST: кэш не трогает
+        ("*/status", ["", "{0}", "search*"]),
+    ],
+}
+# Запись в сервис, которая меняет данные другого сервиса (выдача книги меняет её статус в каталоге)
+CACHE_DEPENDENCIES = {"loans": ["catalog"]}
+# Условные заголовки клиента обрабатывает сам шлюз; к upstream они не пересылаются
+CONDITIONAL_HEADERS = {"if-none-match", "if-modified-since"}
+
+
+class CacheEntry:
+    __slots__ = ("result", "etag", "expires", "size")
+
+    def __init__(self, result: UpstreamResult, ttl: float):
+        self.result = result
+        self.etag = result.headers.get("etag")
+        self.expires = time.monotonic() + ttl
+        self.size = len(result.content)
+
+
+class ResponseCache:
+    """
+    Кэш ответов upstream в памяти шлюза с ограничением по числу записей и байтам.
+    Устаревшая запись с ETag не удаляется сразу, а перепроверяется у upstream (If-None-Match).
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        # Поколение сервиса: запрос, начатый до записи, не кладёт устаревший ответ в кэш
+        self._generations: Dict[str, int] = {}
+        self._counters = {"hits": 0, "misses": 0, "revalidated": 0, "not_modified": 0,
+                          "evictions": 0, "invalidations": 0}
+
+    def generation(self, service_name: str) -> int:
+        return self._generations.get(service_name, 0)
+
+    def lookup(self, key: tuple) -> Tuple[Optional[CacheEntry], bool]:
+        """(запись, свежая ли она)."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self._counters["misses"] += 1
+            return None, False
+        self._entries.move_to_end(key)
+        if entry.expires > time.monotonic():
+            self._counters["hits"] += 1
+            return entry, True
+        return entry, False
+
+    def store(self, key: tuple, result: UpstreamResult, ttl: float, generation: int):
+        service_name = key[1]
+        if generation != self.generation(service_name) or result.status_code != 200:
+            return
+        if "no-store" in result.headers.get("cache-control", ""):
+            return
+        entry = CacheEntry(result, ttl)
+        if entry.size > self._max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._counters["evictions"] += 1
+
+    def refresh(self, key: tuple, ttl: float):
+        """Upstream ответил 304 на перепроверку — запись снова свежая."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.expires = time.monotonic() + ttl
+            self._counters["revalidated"] += 1
+
+    def _remove(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def invalidate(self, service_name: str, write_path: Optional[str]):
+        """Сбрасывает записи, затронутые записью по write_path (None — все записи сервиса)."""
+        self._generations[service_name] = self.generation(service_name) + 1
+        patterns = None
+        rules = CACHE_INVALIDATION.get(service_name, ()) if write_path is not None else ()
+        for route, affected in rules:
+            if fnmatch.fnmatchcase(write_path, route):
+                segments = write_path.split("/")
+                patterns = [p.format(*segments) for p in affected]
+                break
+        for key in [k for k in self._entries if k[1] == service_name]:
+            if patterns is None or any(fnmatch.fnmatchcase(key[2], p) for p in patterns):
+                self._remove(key)
+                self._counters["invalidations"] += 1
+
+    def count_not_modified(self):
+        self._counters["not_modified"] += 1
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "bytes": self._bytes, **self._counters}
+
+
+response_cache = ResponseCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES)
+
+
+def _is_cacheable(service_name: str, clean_path: str) -> bool:
+    return any(fnmatch.fnmatchcase(clean_path, p) for p in CACHE_ROUTES.get(service_name, ()))
+
+
+def _conditional_response(request: Request, result: UpstreamResult) -> Response:
+    """304 для клиента, чей If-None-Match совпадает с ETag ответа, иначе полный ответ."""
+    etag = result.headers.get("etag")
+    if etag and result.status_code == 200 and etag_matches(request.headers.get("if-none-match", ""), etag):
+        response_cache.count_not_modified()
+        return Response(status_code=304, headers={"ETag": etag})
+    return result.to_response()
+
+
+# --- Пакетные запросы (POST /batch) ---
+MAX_BATCH_SIZE = 20
+# Заголовки исходного запроса, которые передаются в под-запросы
+BATCH_FORWARD_HEADERS = ("authorization", "accept-language")
+# Заголовки ответа под-запроса, которые возвращаются клиенту (курсор следующей страницы)
+BATCH_RESPONSE_HEADERS = ("x-next-cursor",)
+
+
+class BatchItemDTO(BaseModel):
+    id: Optional[str] = None               # метка клиента, возвращается в ответе
+    method: str = "GET"
+    path: str                              # путь через шлюз, например "catalog/books" или "readers/12"
+    params: Dict[str, Any] = {}
+    body: Any = None
+
+
+class BatchRequestDTO(BaseModel):
+    requests: List[BatchItemDTO]
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Логика при запуске шлюза
+    pool.open()
+    await resolver.start(pool.discovery, UPSTREAM_SETTINGS)
     print("[Gateway] API Gateway запущен на порту 8080")
     yield
     # Логика при остановке
+    await resolver.stop()
+    await pool.aclose()
     print("[Gateway] API Gateway остановлен")
 
 app = FastAPI(title="API Gateway (Fixed)", lifespan=lifespan)
 
+@app.get("/gateway/stats")
+def gateway_stats():
+    """Статистика пулов соединений и кэша Discovery (для подбора лимитов)"""
+    return {"pools": pool.stats(), "resolver": resolver.stats(), "balancer": balancer.stats(),
+            "resilience": upstream.stats(), "coalescing": single_flight.stats(),
+            "cache": response_cache.stats(), "admission": admission.stats(),
+            "large_responses": large_responses.stats()}
+
+@app.put("/gateway/balancing/{service_name}")
+def set_balancing_policy(service_name: str, policy: str):
+    """Смена политики балансировки для сервиса на лету"""
+    try:
+        balancer.set_policy(service_name, policy)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"service": service_name, "policy": policy}
+
+@app.post("/batch")
+async def batch(dto: BatchRequestDTO, request: Request):
+    """
+    Пакетный запрос: под-запросы к разным сервисам выполняются параллельно,
+    клиент получает все результаты (со статусом каждого) за один round-trip.
+    """
+    if len(dto.requests) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Не больше {MAX_BATCH_SIZE} запросов в пакете")
+    headers = {h: request.headers[h] for h in BATCH_FORWARD_HEADERS if h in request.headers}
+    results = await asyncio.gather(*[_execute_batch_item(item, headers) for item in dto.requests])
+    return {"responses": results}
+
 @app.api_route("/{service_name}/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
 async def gateway_proxy(service_name: str, path: str, request: Request):
     """
-    Универсальный прокси. 
+    Универсальный прокси.
     Принимает запросы вида: 8080/readers/list -> перенаправляет на актуальный порт Reader Service.
     """
-    # 1. Получаем реальный адрес микросервиса по его имени 
-    base_url = await get_service_url(service_name)
-    
+    # 1. Получаем актуальные инстансы микросервиса по его имени (из локального кэша Discovery)
+    instances = await resolver.resolve(service_name)
+
     # 2. Формируем чистый путь (убираем лишние слеши)
     clean_path = path.lstrip("/")
+
+    # 3. Проксирование запроса через общий пул соединений (с обработкой редиректов)
+    client = pool.client(service_name)
+    params = request.query_params.multi_items()
+    key = None
+    if PROXY_MODE == "stream":
+        key = _coalescing_key(service_name, clean_path, request.method, params, request.headers)
+    if key is not None and not large_responses.seen(key):
+        # Одинаковые одновременные GET получают один общий ответ upstream (и кэш, если маршрут кэшируется)
+        try:
+            result = await _shared_result(client, service_name, instances, clean_path, params,
+                                          _request_headers(request), key)
+        except ResponseTooLarge:
+            large_responses.mark(key)
+        else:
+            return _conditional_response(request, result)
+    if PROXY_MODE == "json":
+        return await _proxy_buffered(client, service_name, instances, clean_path, request)
+    return await _proxy_stream(client, service_name, instances, clean_path, request)
+
+
+async def _shared_result(client: httpx.AsyncClient, service_name: str, instances: list, clean_path: str,
+                         params: list, headers: dict, key: tuple) -> UpstreamResult:
+    """GET через single-flight, а для кэшируемых маршрутов — через кэш ответов."""
+    if not _is_cacheable(service_name, clean_path):
+        return await single_flight.do(
+            key, lambda: _fetch_buffered(client, service_name, instances, clean_path, "GET", params, headers,
+                                         max_bytes=COALESCE_MAX_BYTES))
+    # Свежая запись, перепроверка устаревшей по ETag или общий запрос
+    entry, fresh = response_cache.lookup(key)
+    if fresh:
+        return entry.result
+    ttl = CACHE_TTL.get(service_name, 0.0)
+    generation = response_cache.generation(service_name)
+    stale_etag = entry.etag if entry is not None else None
+    result = await single_flight.do(
+        key + (stale_etag,),
+        lambda: _fetch_buffered(client, service_name, instances, clean_path, "GET", params, headers,
+                                etag=stale_etag, max_bytes=COALESCE_MAX_BYTES))
+    if result.status_code == 304 and entry is not None:
+        response_cache.refresh(key, ttl)
+        return entry.result
+    response_cache.store(key, result, ttl, generation)
+    return result
+
+
+def _invalidate_on_write(service_name: str, clean_path: str, method: str, status_code: int):
+    if method in ("POST", "PUT", "DELETE") and status_code < 400:
+        response_cache.invalidate(service_name, clean_path.rstrip("/"))
+        for dependent in CACHE_DEPENDENCIES.get(service_name, ()):
+            response_cache.invalidate(dependent, None)
+
+
+def _upstream_url(instance: dict, service_name: str, clean_path: str) -> str:
     # ВАЖНО: Большинство твоих микросервисов имеют префикс /catalog или /readers
     # Поэтому итоговый URL должен быть таким:
-    url = f"{base_url}/{service_name}/{clean_path}"
-    
-    # 3. Подготовка данных
+    return f"http://{instance['host']}:{instance['port']}/{service_name}/{clean_path}"
+
+
+async def _call_upstream(service_name: str, instances: list, send, method: str, replayable: bool = True):
+    """Выбор инстанса, circuit breaker, повторы и hedging; ошибки транспорта -> HTTP ошибки шлюза."""
+    try:
+        return await upstream.call(
+            service_name, instances, send,
+            idempotent=method in IDEMPOTENT_METHODS,
+            replayable=replayable,
+            # Инстанс не принимает соединения — сразу убираем его из кэша
+            on_connect_error=lambda instance: resolver.evict(service_name, instance),
+        )
+    except httpx.ConnectError as e:
+        raise HTTPException(status_code=503, detail=f"Gateway Error: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Gateway Error: {str(e)}")
+
+
+def _request_headers(request: Request) -> dict:
+    return {k: v for k, v in request.headers.items()
+            if k.lower() != "host" and k.lower() not in HOP_BY_HOP_HEADERS}
+
+
+def _response_headers(resp: httpx.Response) -> dict:
+    return {k: v for k, v in resp.headers.items()
+            if k.lower() not in HOP_BY_HOP_HEADERS and k.lower() not in SERVER_HEADERS}
+
+
+async def _request_content(request: Request):
+    length = request.headers.get("content-length")
+    if length is not None and int(length) <= STREAM_BODY_THRESHOLD:
+        return await request.body() if int(length) else None
+    if length is None and "transfer-encoding" not in request.headers:
+        return None
+    return request.stream()
+
+
+async def _read_body(resp: httpx.Response, max_bytes: Optional[int]) -> bytes:
+    """Тело ответа целиком; больше max_bytes — ResponseTooLarge (по Content-Length или по факту)."""
+    length = resp.headers.get("content-length", "")
+    if max_bytes is not None and length.isdigit() and int(length) > max_bytes:
+        raise ResponseTooLarge()
+    chunks, size = [], 0
+    async for chunk in resp.aiter_raw():
+        size += len(chunk)
+        if max_bytes is not None and size > max_bytes:
+            raise ResponseTooLarge()
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def _fetch_buffered(client: httpx.AsyncClient, service_name: str, instances: list, clean_path: str,
+                          method: str, params: list, headers: dict, content: Optional[bytes] = None,
+                          etag: Optional[str] = None, max_bytes: Optional[int] = None) -> UpstreamResult:
+    """
+    Запрос к upstream с чтением ответа целиком (сырые байты, заголовки как есть).
+    Результат может быть общим для нескольких клиентов, поэтому их условные заголовки
+    не пересылаются; etag — собственная перепроверка записи кэша.
+    Тело больше max_bytes не дочитывается: ResponseTooLarge, и вызывающий идёт потоком.
+    """
+    headers = {k: v for k, v in headers.items() if k.lower() not in CONDITIONAL_HEADERS}
+    if etag:
+        headers["if-none-match"] = etag
+
+    async def send(instance: dict) -> httpx.Response:
+        upstream_req = client.build_request(
+            method=method,
+            url=_upstream_url(instance, service_name, clean_path),
+            content=content,
+            params=params,
+            headers=headers,
+        )
+        return await client.send(upstream_req, stream=True)
+
+    admitted_at = await _admit(service_name)
+    pool.acquire(service_name)
+    ok = False
+    try:
+        proxy_resp = await _call_upstream(service_name, instances, send, method)
+        try:
+            body = await _read_body(proxy_resp, max_bytes)
+            ok = proxy_resp.status_code < 500
+        except ResponseTooLarge:
+            # Upstream ответил нормально — ответ просто не для буфера
+            ok = True
+            raise
+        except httpx.HTTPError as e:
+            # Обрыв посреди тела: заголовки уже получены, но ответа нет
+            raise HTTPException(status_code=502, detail=f"Gateway Error: ответ upstream оборван ({e!r})")
+        finally:
+            await proxy_resp.aclose()
+    finally:
+        pool.release(service_name)
+        admission.release(service_name, admitted_at, ok)
+    return UpstreamResult(proxy_resp.status_code, _response_headers(proxy_resp), body)
+
+
+class UpstreamStreamingResponse(StreamingResponse):
+    """
+    Потоковый ответ upstream, который владеет слотами пула и допуска.
+    Владение переходит к ответу, когда Starlette начинает его отправку: слоты освобождаются ровно раз —
+    по концу тела, при обрыве upstream, отключении клиента или если отправка прервалась до первого байта
+    (Starlette не вызывает background-задачу, если итератор тела упал).
+    """
+
+    def __init__(self, upstream: httpx.Response, release: Callable[[bool], None]):
+        self._upstream = upstream
+        self._release = release
+        self._ok = upstream.status_code < 500
+        self._finished = False
+        # aiter_raw отдаёт байты как есть (включая Content-Encoding), поэтому заголовки совпадают с телом
+        super().__init__(self._body(), status_code=upstream.status_code, headers=_response_headers(upstream))
+
+    async def _body(self):
+        try:
+            async for chunk in self._upstream.aiter_raw():
+                yield chunk
+        except httpx.HTTPError:
+            self._ok = False
+            raise
+        finally:
+            await self.finish()
+
+    async def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        self._release(self._ok)
+        await self._upstream.aclose()
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.finish()
+
+
+async def _proxy_stream(client: httpx.AsyncClient, service_name: str, instances: list, clean_path: str,
+                        request: Request):
+    """Потоковая передача: без буферизации тел и без JSON decode/encode."""
+    content = await _request_content(request)
+    params = request.query_params.multi_items()
+    headers = _request_headers(request)
+
+    async def send(instance: dict) -> httpx.Response:
+        upstream_req = client.build_request(
+            method=request.method,
+            url=_upstream_url(instance, service_name, clean_path),
+            content=content,
+            params=params,
+            headers=headers,
+        )
+        return await client.send(upstream_req, stream=True)
+
+    # Потоковое тело нельзя отправить повторно
+    replayable = content is None or isinstance(content, bytes)
+    admitted_at = await _admit(service_name)
+    pool.acquire(service_name)
+    try:
+        proxy_resp = await _call_upstream(service_name, instances, send, request.method, replayable=replayable)
+    except BaseException:
+        # Не только HTTPException: отмена (отключение клиента) здесь тоже не должна терять слоты
+        pool.release(service_name)
+        admission.release(service_name, admitted_at, ok=False)
+        raise
+    # Замер для адаптивного лимита — до заголовков: скачивание тела клиентом его не портит
+    responded_at = time.monotonic()
+
+    def release(ok: bool):
+        pool.release(service_name)
+        admission.release(service_name, admitted_at, ok, responded_at)
+
+    response = UpstreamStreamingResponse(proxy_resp, release)
+    try:
+        _invalidate_on_write(service_name, clean_path, request.method, proxy_resp.status_code)
+    except BaseException:
+        await response.finish()
+        raise
+    return response
+
+
+async def _proxy_buffered(client: httpx.AsyncClient, service_name: str, instances: list, clean_path: str,
+                          request: Request):
+    """Режим совместимости: ответ читается целиком и возвращается как JSON."""
     body = await request.body()
     params = dict(request.query_params)
-    
-    # 4. Проксирование запроса с обработкой редиректов 
-    async with httpx.AsyncClient(follow_redirects=True) as client:
-        try:
-            proxy_resp = await client.request(
-                method=request.method,
-                url=url,
-                content=body,
-                params=params,
-                headers={k: v for k, v in request.headers.items() if k.lower() != "host"}
-            )
-            
-            # Пытаемся вернуть JSON, если нет — возвращаем текст ошибки
+
+    async def send(instance: dict) -> httpx.Response:
+        return await client.request(
+            method=request.method,
+            url=_upstream_url(instance, service_name, clean_path),
+            content=body,
+            params=params,
+            headers={k: v for k, v in request.headers.items() if k.lower() != "host"}
+        )
+
+    admitted_at = await _admit(service_name)
+    pool.acquire(service_name)
+    ok = False
+    try:
+        proxy_resp = await _call_upstream(service_name, instances, send, request.method)
+        ok = proxy_resp.status_code < 500
+    finally:
+        pool.release(service_name)
+        admission.release(service_name, admitted_at, ok)
+    _invalidate_on_write(service_name, clean_path, request.method, proxy_resp.status_code)
+
+    # Пытаемся вернуть JSON, если нет — возвращаем текст ошибки
+    try:
+        return proxy_resp.json()
+    except Exception:
+        return {"detail": proxy_resp.text, "status_code": proxy_resp.status_code}
+
+
+def _query_value(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return "" if value is None else str(value)
+
+
+def _decode_body(result: UpstreamResult):
+    if not result.content:
+        return None
+    try:
+        return json.loads(result.content)
+    except ValueError:
+        return result.content.decode("utf-8", errors="replace")
+
+
+async def _execute_batch_item(item: BatchItemDTO, forward_headers: dict) -> dict:
+    """Один под-запрос пакета; ошибки не прерывают пакет, а становятся статусом элемента."""
+    service_name, _, clean_path = item.path.strip("/").partition("/")
+    method = item.method.upper()
+    params = [(k, _query_value(v)) for k, v in item.params.items()]
+    try:
+        if method not in ("GET", "POST", "PUT", "DELETE"):
+            raise HTTPException(status_code=405, detail=f"Метод {method} не поддерживается")
+        instances = await resolver.resolve(service_name)
+        client = pool.client(service_name)
+        # Сжатие не нужно: тело ответа разбирается шлюзом
+        headers = {**forward_headers, "accept-encoding": "identity"}
+        key = _coalescing_key(service_name, clean_path, method, params, headers)
+        if key is not None:
             try:
-                return proxy_resp.json()
-            except Exception:
-                return {"detail": proxy_resp.text, "status_code": proxy_resp.status_code}
-                
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Gateway Error: {str(e)}")
+                result = await _shared_result(client, service_name, instances, clean_path, params, headers, key)
+            except ResponseTooLarge:
+                # Тело под-запроса всё равно встраивается в ответ пакета: читаем без предела
+                result = await _fetch_buffered(client, service_name, instances, clean_path, method, params,
+                                               headers)
+        else:
+            content = None
+            if item.body is not None:
+                content = json.dumps(item.body).encode("utf-8")
+                headers["content-type"] = "application/json"
+            result = await _fetch_buffered(client, service_name, instances, clean_path, method, params,
+                                           headers, content=content)
+            _invalidate_on_write(service_name, clean_path, method, result.status_code)
+    except HTTPException as e:
+        return {"id": item.id, "status": e.status_code, "body": {"detail": e.detail}}
+    except httpx.HTTPError as e:
+        return {"id": item.id, "status": 502, "body": {"detail": f"Gateway Error: {e!r}"}}
+    response = {"id": item.id, "status": result.status_code, "body": _decode_body(result)}
+    headers = {k.lower(): v for k, v in result.headers.items() if k.lower() in BATCH_RESPONSE_HEADERS}
+    if headers:
+        response["headers"] = headers
+    return response
 
 if __name__ == "__main__":
-    # Единая точка входа для клиента 
-    uvicorn.run(app, host="127.0.0.1", port=8080)
\ No newline at end of file
+    # Единая точка входа для клиента
+    uvicorn.run(app, host="127.0.0.1", port=8080)
@@ -0,0 +1,156 @@
+# book_store.py
+"""
+Сховища записів книг для BookRepository (Catalog Service).
+Репозиторій тримає індекси пошуку, а сам запис живе в одному з бекендів:
+  - DictBookStore — список dict, як і раніше (запис змінюється на місці);
+  - ColumnarBookStore — компактні колонки: id у array, назва й опис у спільному UTF-8 буфері,
+    автори інтерновані (код у array), available та "опису немає" — бітові маски.
+    Dict книги створюється лише під час читання, тож на книгу йде в рази менше пам'яті;
+  - SqliteBookStore — таблиця SQLite у режимі WAL (record_store.SqliteStore): книги на диску.
+Позиція — порядковий номер книги в порядку додавання; за нею працюють курсори сторінок.
+"""
+import os
+from array import array
+from collections.abc import Sequence
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from record_store import MemoryStore, RowsView, SqliteStore
+
+BOOK_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog_data", "books.db")
+BOOK_COLUMNS = {"id": int, "title": str, "author": str, "description": str, "available": bool}
+
+
+class DictBookStore(MemoryStore):
+    def set_available(self, position: int, status: bool):
+        self._rows[position]["available"] = status
+
+    def set_available_many(self, updates: Iterable[Tuple[int, bool]]):
+        for position, status in updates:
+            self._rows[position]["available"] = status
+
+    def positions(self, available: Optional[bool], start: int = 0) -> Iterator[int]:
+        return super().positions(start) if available is None else super().positions(start, available=available)
+
+
+def _bit(bits: bytearray, i: int) -> bool:
+    return bool(bits[i >> 3] >> (i & 7) & 1)
+
+
+def _set_bit(bits: bytearray, i: int, value: bool):
+    byte = i >> 3
+    if byte >= len(bits):
+        bits.extend(bytes(byte - len(bits) + 1))
+    if value:
+        bits[byte] |= 1 << (i & 7)
+    else:
+        bits[byte] &= ~(1 << (i & 7)) & 0xFF
+
+
+class ColumnarBookStore:
+    def __init__(self):
+        self._ids = array("q")
+        self._pos: Dict[int, int] = {}
+        self._author_names: List[str] = []        # інтерновані автори
+        self._author_codes: Dict[str, int] = {}
+        self._authors = array("I")                # код автора кожної книги
+        self._text = bytearray()                  # назва + опис кожної книги підряд (UTF-8)
+        self._offsets = array("Q", [0])           # кінець назви, кінець опису — по два на книгу
+        self._available = bytearray()             # бітова маска available
+        self._no_description = bytearray()        # бітова маска description is None
+        self._rows = RowsView(self)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def append(self, book: dict) -> int:
+        position = len(self._ids)
+        self._pos[book["id"]] = position
+        self._ids.append(book["id"])
+        code = self._author_codes.get(book["author"])
+        if code is None:
+            code = self._author_codes[book["author"]] = len(self._author_names)
+            self._author_names.append(book["author"])
+        self._authors.append(code)
+        self._text += book["title"].encode("utf-8")
+        self._offsets.append(len(self._text))
+        description = book.get("description")
+        if description is not None:
+            self._text += description.encode("utf-8")
+        self._offsets.append(len(self._text))
+        _set_bit(self._no_description, position, description is None)
+        _set_bit(self._available, position, book.get("available", True))
+        return position
+
+    def append_many(self, books: Iterable[dict]) -> List[int]:
+        return [self.append(book) for book in books]
+
+    def position(self, b_id: int) -> Optional[int]:
+        return self._pos.get(b_id)
+
+    def get(self, position: int) -> dict:
+        start, title_end, end = self._offsets[2 * position:2 * position + 3]
+        return {
+            "id": self._ids[position],
+            "title": self._text[start:title_end].decode("utf-8"),
+            "author": self._author_names[self._authors[position]],
+            "description": None if _bit(self._no_description, position)
+            else self._text[title_end:end].decode("utf-8"),
+            "available": _bit(self._available, position),
+        }
+
+    def set_available(self, position: int, status: bool):
+        _set_bit(self._available, position, status)
+
+    def set_available_many(self, updates: Iterable[Tuple[int, bool]]):
+        for position, status in updates:
+            _set_bit(self._available, position, status)
+
+    def rows(self) -> Sequence:
+        return self._rows
+
+    def positions(self, available: Optional[bool], start: int = 0) -> Iterator[int]:
+        """Позиції з потрібним available: цілі байти без жодного збігу пропускаються."""
+        count = len(self._ids)
+        if available is None:
+            yield from range(start, count)
+            return
+        bits = self._available
+        skip = 0x00 if available else 0xFF
+        for byte in range(start >> 3, len(bits)):
+            value = bits[byte]
+            if value == skip:
+                continue
+            if not available:
+                value = ~value & 0xFF
+            base = byte << 3
+            if value == 0xFF and base >= start and base + 8 <= count:
+                yield from range(base, base + 8)
+                continue
+            while value:
+                low = value & -value
+                i = base + low.bit_length() - 1
+                if start <= i < count:
+                    yield i
+                value ^= low
+
+    def close(self):
+        pass
+
+
+class SqliteBookStore(SqliteStore):
+    """Книги в SQLite (WAL): каталог переживає перезапуск, фільтр available іде індексом."""
+
+    def __init__(self, path: str = BOOK_DB_PATH):
+        super().__init__(path, "books", BOOK_COLUMNS, indexes=[("available",)])
+
+    def set_available(self, position: int, status: bool):
+        self.update(position, {"available": status})
+
+    def set_available_many(self, updates: Iterable[Tuple[int, bool]]):
+        self.update_many((position, {"available": status}) for position, status in updates)
+
+    def positions(self, available: Optional[bool], start: int = 0) -> Iterator[int]:
+        return super().positions(start) if available is None else super().positions(start, available=available)
+
+
+BOOK_STORES = {"dict": DictBookStore, "columnar": ColumnarBookStore, "sqlite": SqliteBookStore}
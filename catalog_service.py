@@ -1,17 +1,35 @@
 # catalog_service.py
-import httpx
-import asyncio
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from contextlib import asynccontextmanager
+from array import array
+from bisect import bisect_left
+import asyncio
+import threading
+import time
+import uuid
 import uvicorn
 
+from book_store import BOOK_STORES
+from discovery_client import DiscoveryAgent
+from etag import content_etag, etag_matches, etag_response
+from ndjson import export_ndjson, import_ndjson
+from pagination import page_response, paginate, parse_fields
+from text_search import FullTextIndex, tokenize
+
 # --- КОНФІГУРАЦІЯ (PZ4 Requirement) ---
 SERVICE_NAME = "catalog"
 SERVICE_HOST = "127.0.0.1"
 SERVICE_PORT = 8001
 DISCOVERY_URL = "http://127.0.0.1:8000"
+# Сховище записів книг: "dict" — список dict у пам'яті; "columnar" — компактні колонки в пам'яті
+# (для мільйонів книг); "sqlite" — SQLite (WAL) на диску: книги переживають перезапуск, але індекси
+# пошуку живуть у пам'яті й при старті будуються переглядом усіх книг
+BOOK_STORE = "dict"
+MAX_RESERVATION_TTL = 300.0     # верхня межа TTL тимчасової резервації (с)
+RESERVATION_REAP_INTERVAL = 1.0 # як часто знімаються прострочені резервації (с)
+CONFIRMED_RETENTION = 600.0     # скільки пам'ятається підтверджена резервація: повторний confirm і відкат (с)
 
 # --- 1. ШАР DTO (Data Transfer Objects) ---
 class BookCreateDTO(BaseModel):
@@ -27,95 +45,490 @@ class BookReadDTO(BaseModel):
     description: Optional[str] = None
     available: bool
 
+BOOK_FIELDS = ("id", "title", "author", "description", "available")
+
+class BookSearchHitDTO(BookReadDTO):
+    score: float
+
+MAX_BATCH_IDS = 1000  # книг в одному пакетному запиті
+
+class BookBatchGetDTO(BaseModel):
+    ids: List[int]
+
+class BookBatchReadDTO(BaseModel):
+    books: Dict[int, BookReadDTO]
+    not_found: List[int]
+
+class BookStatusUpdateDTO(BaseModel):
+    id: int
+    available: bool
+
+class BookBulkStatusDTO(BaseModel):
+    updates: List[BookStatusUpdateDTO]
+
+class ReservationCreateDTO(BaseModel):
+    ids: List[int]
+    ttl: Optional[float] = None           # без TTL резервація одразу остаточна
+    if_match: Dict[int, str] = {}         # id -> ETag з GET /catalog/books/{id}
+
+class ReservationReadDTO(BaseModel):
+    reservation_id: Optional[str]
+    ids: List[int]
+    expires_in: Optional[float]
+
 # --- 2. ШАР REPOSITORY (Data Layer) ---
+NGRAM = 3  # довжина n-грам для пошуку підрядка в автора
+
+EMPTY_POSTINGS = array("I")
+
+def ngrams(text: str) -> Set[str]:
+    return {text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+def _append(index: Dict[str, array], key: str, value: int):
+    postings = index.get(key)
+    if postings is None:
+        postings = index[key] = array("I")
+    postings.append(value)
+
+def _contains(postings: array, value: int) -> bool:
+    # Списки входжень відсортовані: значення додаються лише за зростанням
+    i = bisect_left(postings, value)
+    return i < len(postings) and postings[i] == value
+
 class BookRepository:
-    def __init__(self):
-        self._db = [
-            {"id": 101, "title": "Python HPC", "author": "Boguslavsky Vlad", "description": "Variant 12", "available": True},
-            {"id": 102, "title": "Clean Code", "author": "Robert Martin", "description": "Architecture", "available": True}
-        ]
-
-    def get_all(self): return self._db
-    def get_by_id(self, b_id): return next((b for b in self._db if b["id"] == b_id), None)
-    def find_by_author(self, author): return [b for b in self._db if author.lower() in b["author"].lower()]
-    def save(self, data): self._db.append(data); return data
+    """
+    Книги в порядку додавання (у сховищі BOOK_STORE) + індекси, що оновлюються в save:
+      - id -> позиція книги в сховищі (hash у сховищі);
+      - слово -> позиції книг для author і title (інвертований індекс);
+      - автор (lower) -> позиції книг і триграма -> коди авторів: підрядок шукається серед кандидатів,
+        а не по всіх книгах;
+      - повнотекстовий індекс BM25 за назвою, автором та описом.
+    Списки входжень — array("I") за зростанням (4 байти на входження замість елемента dict чи set),
+    перетин слів — bisect по довших списках, триграм автора — set з найкоротшого.
+    Індекси живуть у пам'яті: при старті з непорожнім сховищем вони будуються одним переглядом.
+    Ендпоінти працюють у пулі потоків, тому запис в індекси і читання з них — під self.lock.
+    """
+    def __init__(self, store: str = BOOK_STORE):
+        self._db = BOOK_STORES[store]()
+        # Перевірка available і його зміна, а також індекси — під одним замком
+        self.lock = threading.RLock()
+        self._tokens: Dict[str, Dict[str, array]] = {"author": {}, "title": {}}
+        self._authors: Dict[str, int] = {}           # автор (lower) -> код
+        self._author_names: List[str] = []           # код -> автор (lower)
+        self._author_books: List[array] = []         # код -> позиції книг автора
+        self._author_ngrams: Dict[str, array] = {}   # триграма -> коди авторів
+        self._text = FullTextIndex()
+        for position, book in enumerate(self._db.rows()):
+            self._index(position, book)
+        if not len(self._db):
+            self.save_many([
+                {"id": 101, "title": "Python HPC", "author": "Boguslavsky Vlad", "description": "Variant 12", "available": True},
+                {"id": 102, "title": "Clean Code", "author": "Robert Martin", "description": "Architecture", "available": True}
+            ])
+
+    def get_all(self): return self._db.rows()
+
+    def get_by_id(self, b_id):
+        position = self._db.position(b_id)
+        return None if position is None else self._db.get(position)
+
+    def positions(self, available=None, start=0):
+        """Позиції книг (за бажанням — лише з потрібним available), починаючи зі start."""
+        return self._db.positions(available, start)
+
+    def _books(self, positions):
+        # Результати пошуку — у порядку додавання книг
+        return [self._db.get(p) for p in sorted(positions)]
+
+    def find_by_author(self, author):
+        """Підрядок без урахування регістру (як раніше), але лише серед авторів-кандидатів з n-грам."""
+        query = author.lower()
+        with self.lock:
+            if len(query) < NGRAM:
+                # Надто коротко для n-грам: перебираємо різних авторів, а не книги
+                codes = range(len(self._author_names))
+            else:
+                postings = sorted((self._author_ngrams.get(g, EMPTY_POSTINGS) for g in ngrams(query)), key=len)
+                codes = set(postings[0]).intersection(*postings[1:])
+            names, books = self._author_names, self._author_books
+            return self._books(p for c in codes if query in names[c] for p in books[c])
+
+    def find_by_words(self, field, text):
+        """Книги, у полі field (author/title) яких є всі слова з text."""
+        index = self._tokens[field]
+        with self.lock:
+            postings = sorted((index.get(t, EMPTY_POSTINGS) for t in set(tokenize(text))), key=len)
+            if not postings:
+                return []
+            return self._books(p for p in postings[0] if all(_contains(q, p) for q in postings[1:]))
+
+    def search(self, query, limit):
+        """Повнотекстовий пошук: [(книга, score)] за спаданням релевантності."""
+        with self.lock:
+            hits = self._text.search(query, limit)
+        return [(self._db.get(p), score) for p, score in hits]
+
+    def _index(self, position, data):
+        for field, index in self._tokens.items():
+            for token in set(tokenize(data[field])):
+                _append(index, token, position)
+        author = data["author"].lower()
+        code = self._authors.get(author)
+        if code is None:
+            code = self._authors[author] = len(self._author_names)
+            self._author_names.append(author)
+            self._author_books.append(array("I"))
+            for gram in ngrams(author):
+                _append(self._author_ngrams, gram, code)
+        self._author_books[code].append(position)
+        self._text.add(position, data)
+
+    def save(self, data):
+        with self.lock:
+            position = self._db.append(data)
+            self._index(position, data)
+        return data
+
+    def save_many(self, rows):
+        # Одна вставка (для SQLite — одна транзакція) на всю пачку
+        with self.lock:
+            positions = self._db.append_many(rows)
+            for position, data in zip(positions, rows):
+                self._index(position, data)
+        return rows
+
     def update_availability(self, b_id, status):
-        book = self.get_by_id(b_id)
-        if book: book["available"] = status; return book
-        return None
+        # Індекси не залежать від available: досить оновити запис у сховищі
+        position = self._db.position(b_id)
+        if position is None: return None
+        with self.lock:
+            self._db.set_available(position, status)
+            return self._db.get(position)
+
+    def get_many(self, ids):
+        """{id: книга} для знайдених id і список відсутніх."""
+        found, missing = {}, []
+        for b_id in dict.fromkeys(ids):
+            book = self.get_by_id(b_id)
+            if book is None:
+                missing.append(b_id)
+            else:
+                found[b_id] = book
+        return found, missing
+
+    def update_availability_many(self, updates):
+        """
+        Атомарна зміна статусів {id: available}: якщо хоч одного id немає — нічого не змінюється
+        і повертається список відсутніх.
+        """
+        positions = {b_id: self._db.position(b_id) for b_id in updates}
+        missing = [b_id for b_id, position in positions.items() if position is None]
+        if not missing:
+            with self.lock:
+                self._db.set_available_many((positions[b_id], status) for b_id, status in updates.items())
+        return missing
+
+    def close(self):
+        self._db.close()
 
 repo = BookRepository()
 
+class Reservations:
+    """
+    Тимчасові резервації: id -> (книги, термін). Книги резервації вже недоступні;
+    підтвердження робить це остаточним, скасування або прострочення — повертає їх у доступні.
+    Підтверджені пам'ятаються ще retention: повторний confirm (клієнт не дочекався відповіді)
+    повертає той самий результат, а скасування відкочує підтвердження — лише для книг, якими
+    резервація досі володіє. Будь-яка подальша зміна статусу книги (повернення, нова резервація)
+    забирає володіння і забуває підтвердження: скасування вже не звільнить чужу книгу.
+    Змінюється лише під repo.lock. Резервацій одночасно мало, тож прострочені шукаються переглядом.
+    """
+    def __init__(self, retention: float = CONFIRMED_RETENTION):
+        self._retention = retention
+        self._items: Dict[str, Tuple[List[int], float]] = {}
+        self._confirmed: Dict[str, Tuple[List[int], float]] = {}
+        self._owners: Dict[int, str] = {}   # книга -> підтверджена резервація, що її тримає
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, ids: List[int], ttl: float, now: float) -> str:
+        r_id = uuid.uuid4().hex
+        self._items[r_id] = (ids, now + ttl)
+        return r_id
+
+    def pop(self, r_id: str, now: float) -> Optional[List[int]]:
+        """Книги резервації або None, якщо її немає чи вона вже прострочена."""
+        item = self._items.pop(r_id, None)
+        if item is None or item[1] <= now:
+            return None
+        return item[0]
+
+    def confirm(self, r_id: str, now: float) -> Optional[List[int]]:
+        """Книги підтвердженої резервації (і при повторному виклику) або None, якщо її немає чи прострочено."""
+        item = self._confirmed.get(r_id)
+        if item is not None and item[1] > now:
+            return item[0]
+        ids = self.pop(r_id, now)
+        if ids is not None:
+            self._confirmed[r_id] = (ids, now + self._retention)
+            for b_id in ids:
+                self._owners[b_id] = r_id
+        return ids
+
+    def cancel(self, r_id: str, now: float) -> Optional[List[int]]:
+        """
+        Книги, які звільняє скасування: усі книги активної резервації або ті книги нещодавно
+        підтвердженої, якими вона досі володіє; None, якщо такої резервації немає.
+        """
+        if r_id in self._confirmed:
+            ids, forget_at = self._confirmed[r_id]
+            owned = [b_id for b_id in ids if self._owners.get(b_id) == r_id]
+            self._forget(r_id)
+            return owned if forget_at > now else None
+        return self.pop(r_id, now)
+
+    def _forget(self, r_id: str):
+        ids, _ = self._confirmed.pop(r_id)
+        for b_id in ids:
+            if self._owners.get(b_id) == r_id:
+                del self._owners[b_id]
+
+    def released(self, ids: Iterable[int]):
+        """Статус книг змінився поза резерваціями: підтвердження, що їх тримали, більше не відкочуються."""
+        for b_id in ids:
+            r_id = self._owners.get(b_id)
+            if r_id is not None:
+                self._forget(r_id)
+
+    def pop_expired(self, now: float) -> List[int]:
+        for r_id in [r_id for r_id, (_, forget_at) in self._confirmed.items() if forget_at <= now]:
+            self._forget(r_id)
+        expired = [r_id for r_id, (_, expires_at) in self._items.items() if expires_at <= now]
+        return [b_id for r_id in expired for b_id in self._items.pop(r_id)[0]]
+
+reservations = Reservations()
+
 # --- 3. ШАР SERVICE (Business Logic Layer) ---
 class CatalogBusinessLogic:
     @staticmethod
-    def list_books(): return [BookReadDTO(**b) for b in repo.get_all()]
+    def list_books(after: Optional[str], limit: Optional[int], available: Optional[bool]):
+        return paginate(repo.get_all(), after, limit,
+                        positions=lambda start: repo.positions(available, start))
     
     @staticmethod
     def add(dto: BookCreateDTO):
-        if repo.get_by_id(dto.id): 
-            raise HTTPException(status_code=400, detail="ID вже зайнятий")
-        new_book = dto.dict()
-        new_book["available"] = True
-        return BookReadDTO(**repo.save(new_book))
+        # Перевірка й вставка — одна критична секція: інакше два однакові id пройдуть перевірку разом
+        with repo.lock:
+            if repo.get_by_id(dto.id):
+                raise HTTPException(status_code=400, detail="ID вже зайнятий")
+            new_book = dto.dict()
+            new_book["available"] = True
+            return BookReadDTO(**repo.save(new_book))
+
+    @staticmethod
+    def import_batch(batch):
+        """Пачка рядків імпорту: зайняті id відхиляються, решта вставляється одним save_many."""
+        rejected, accepted, seen = [], [], set()
+        with repo.lock:
+            for line_no, book in batch:
+                if book["id"] in seen or repo.get_by_id(book["id"]):
+                    rejected.append((line_no, "ID вже зайнятий"))
+                    continue
+                seen.add(book["id"])
+                book["available"] = True
+                accepted.append(book)
+            repo.save_many(accepted)
+        return rejected
+
+    @staticmethod
+    def check_batch_size(size: int):
+        if size > MAX_BATCH_IDS:
+            raise HTTPException(status_code=400, detail=f"Не більше {MAX_BATCH_IDS} книг у пакеті")
+
+    @staticmethod
+    def get_many(dto: BookBatchGetDTO):
+        CatalogBusinessLogic.check_batch_size(len(dto.ids))
+        found, missing = repo.get_many(dto.ids)
+        return {"books": found, "not_found": missing}
+
+    @staticmethod
+    def reserve(dto: ReservationCreateDTO):
+        """
+        Compare-and-set: книги резервуються, лише якщо всі вони зараз доступні (і ETag збігається
+        з if_match); інакше не змінюється жодна. Перевірка й зміна — атомарно під repo.lock.
+        """
+        ids = list(dict.fromkeys(dto.ids))
+        CatalogBusinessLogic.check_batch_size(len(ids))
+        if dto.ttl is not None and not 0 < dto.ttl <= MAX_RESERVATION_TTL:
+            raise HTTPException(status_code=400, detail=f"ttl має бути від 0 до {MAX_RESERVATION_TTL:g} с")
+        with repo.lock:
+            books, missing = repo.get_many(ids)
+            if missing:
+                raise HTTPException(status_code=404, detail={"message": "Книги не знайдено", "not_found": missing})
+            stale = [b_id for b_id, tag in dto.if_match.items()
+                     if b_id in books and not etag_matches(tag, content_etag(BookReadDTO(**books[b_id])))]
+            if stale:
+                raise HTTPException(status_code=412, detail={"message": "Книги змінилися", "ids": stale})
+            unavailable = [b_id for b_id in ids if not books[b_id]["available"]]
+            if unavailable:
+                raise HTTPException(status_code=409, detail={"message": "Книги недоступні", "ids": unavailable})
+            repo.update_availability_many({b_id: False for b_id in ids})
+            reservations.released(ids)
+            r_id = None if dto.ttl is None else reservations.add(ids, dto.ttl, time.monotonic())
+        return {"reservation_id": r_id, "ids": ids, "expires_in": dto.ttl}
+
+    @staticmethod
+    def confirm_reservation(r_id: str):
+        with repo.lock:
+            ids = reservations.confirm(r_id, time.monotonic())
+            if ids is None:
+                raise HTTPException(status_code=404, detail="Резервацію не знайдено або вона прострочена")
+        return {"status": "confirmed", "ids": ids}
+
+    @staticmethod
+    def cancel_reservation(r_id: str):
+        with repo.lock:
+            ids = reservations.cancel(r_id, time.monotonic())
+            if ids is None:
+                raise HTTPException(status_code=404, detail="Резервацію не знайдено або вона прострочена")
+            repo.update_availability_many({b_id: True for b_id in ids})
+        return {"status": "cancelled", "ids": ids}
+
+    @staticmethod
+    def release_expired():
+        with repo.lock:
+            ids = reservations.pop_expired(time.monotonic())
+            if ids:
+                repo.update_availability_many({b_id: True for b_id in ids})
+        return ids
+
+    @staticmethod
+    def update_statuses(dto: BookBulkStatusDTO):
+        CatalogBusinessLogic.check_batch_size(len(dto.updates))
+        # Повтор id у пачці — діє останнє значення
+        updates = {u.id: u.available for u in dto.updates}
+        with repo.lock:
+            missing = repo.update_availability_many(updates)
+            if not missing:
+                reservations.released(updates)
+        if missing:
+            raise HTTPException(status_code=404, detail={"message": "Книги не знайдено", "not_found": missing})
+        return {"status": "success", "updated": len(updates)}
 
 # --- 4. ІНФРАСТРУКТУРНА ЛОГІКА (Discovery & Lifespan) ---
-async def send_heartbeat():
-    """Реалізація Heartbeat механізму для Discovery Service """
+# Реєстрація під lease; heartbeat пакетний, через спільний пул з'єднань і з джитером
+agent = DiscoveryAgent(DISCOVERY_URL)
+
+async def reservation_reaper():
+    """Прострочені резервації повертають книги в доступні."""
     while True:
-        async with httpx.AsyncClient() as client:
-            try:
-                await client.post(f"{DISCOVERY_URL}/heartbeat/{SERVICE_NAME}", 
-                                 params={"host": SERVICE_HOST, "port": SERVICE_PORT})
-            except Exception: pass
-        await asyncio.sleep(10)
+        await asyncio.sleep(RESERVATION_REAP_INTERVAL)
+        if len(reservations):
+            await asyncio.to_thread(CatalogBusinessLogic.release_expired)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Реєстрація при запуску 
-    async with httpx.AsyncClient() as client:
-        try:
-            await client.post(f"{DISCOVERY_URL}/register", 
-                             params={"name": SERVICE_NAME, "host": SERVICE_HOST, "port": SERVICE_PORT})
-            print(f"[{SERVICE_NAME}] Успішно зареєстровано в Discovery")
-        except Exception as e:
-            print(f"[{SERVICE_NAME}] Помилка реєстрації: {e}")
-    
-    # Запуск фонового завдання Heartbeat
-    heartbeat_task = asyncio.create_task(send_heartbeat())
+    # Реєстрація при запуску та фоновий Heartbeat
+    await agent.start([(SERVICE_NAME, SERVICE_HOST, SERVICE_PORT)])
+    reaper = asyncio.create_task(reservation_reaper())
     yield
-    # Зупинка Heartbeat при виключенні
-    heartbeat_task.cancel()
+    reaper.cancel()
+    # Зупинка Heartbeat і зняття з реєстрації при виключенні
+    await agent.stop()
+    repo.close()
 
 app = FastAPI(title="Catalog Microservice (PZ4)", lifespan=lifespan)
 
 # --- 5. ШАР CONTROLLER (API Endpoints) ---
 @app.get("/catalog/books", response_model=List[BookReadDTO])
-def get_all_books():
-    """1. [Catalog] Показати всі книги"""
-    return CatalogBusinessLogic.list_books()
+def get_all_books(request: Request, after: Optional[str] = None, limit: Optional[int] = None,
+                  fields: Optional[str] = None, available: Optional[bool] = None):
+    """1. [Catalog] Показати всі книги (сторінками: after + limit, курсор — у X-Next-Cursor)"""
+    selected = parse_fields(fields, BOOK_FIELDS)
+    page, next_cursor = CatalogBusinessLogic.list_books(after, limit, available)
+    return page_response(request, page, selected, next_cursor)
+
+@app.get("/catalog/search", response_model=List[BookSearchHitDTO])
+def search_books(request: Request, q: str, limit: int = Query(10, ge=1, le=100)):
+    """[Catalog] Повнотекстовий пошук за назвою, автором та описом (ранжування BM25)"""
+    hits = repo.search(q, limit)
+    return etag_response(request, [BookSearchHitDTO(**b, score=round(score, 4)) for b, score in hits])
+
+# Маршрути /export та /import оголошені до /catalog/books/{id}, щоб не збігатися з ним
+@app.get("/catalog/books/export")
+def export_books(fields: Optional[str] = None):
+    """[Catalog] Експорт усього каталогу потоком NDJSON"""
+    return export_ndjson(repo.get_all(), parse_fields(fields, BOOK_FIELDS))
+
+@app.post("/catalog/books/import")
+async def import_books(request: Request):
+    """[Catalog] Масовий імпорт книг з NDJSON (по рядку на книгу), звіт про помилки по рядках"""
+    return await import_ndjson(request, BookCreateDTO, CatalogBusinessLogic.import_batch)
+
+@app.post("/catalog/books/batch-get", response_model=BookBatchReadDTO)
+def batch_get_books(dto: BookBatchGetDTO):
+    """[Catalog] Кілька книг за одним запитом: {"ids": [...]} -> {"books": {id: книга}, "not_found": [...]}"""
+    return CatalogBusinessLogic.get_many(dto)
+
+# Оголошено окремо від /catalog/books/{id}/status: змінює статуси пачки книг атомарно
+@app.put("/catalog/books/status")
+def update_book_statuses(dto: BookBulkStatusDTO):
+    """Службовий метод: зміна статусу кількох книг разом (усі або жодної; викликається Loan Service)"""
+    return CatalogBusinessLogic.update_statuses(dto)
+
+@app.post("/catalog/reservations", response_model=ReservationReadDTO, status_code=201)
+def create_reservation(dto: ReservationCreateDTO):
+    """
+    [Catalog] Атомарна резервація книг: усі доступні -> усі стають недоступними, інакше 409 і без змін.
+    З ttl резервацію треба підтвердити (confirm) до закінчення терміну, інакше книги звільняться.
+    """
+    return CatalogBusinessLogic.reserve(dto)
+
+@app.post("/catalog/reservations/{reservation_id}/confirm")
+def confirm_reservation(reservation_id: str):
+    """[Catalog] Зробити тимчасову резервацію остаточною; повторний виклик повертає той самий результат"""
+    return CatalogBusinessLogic.confirm_reservation(reservation_id)
+
+@app.delete("/catalog/reservations/{reservation_id}")
+def cancel_reservation(reservation_id: str):
+    """[Catalog] Скасувати резервацію (і нещодавно підтверджену): книги знову доступні"""
+    return CatalogBusinessLogic.cancel_reservation(reservation_id)
 
 @app.get("/catalog/books/{id}", response_model=BookReadDTO)
-def get_book_by_id(id: int):
+def get_book_by_id(id: int, request: Request):
     """2. [Catalog] Пошук за ID книги"""
     data = repo.get_by_id(id)
     if not data: raise HTTPException(status_code=404, detail="Книгу не знайдено")
-    return BookReadDTO(**data)
+    return etag_response(request, BookReadDTO(**data))
 
 @app.get("/catalog/books/search/{author}", response_model=List[BookReadDTO])
-def find_books_by_author(author: str):
-    """3. [Catalog] Пошук за автором"""
-    return [BookReadDTO(**b) for b in repo.find_by_author(author)]
+def find_books_by_author(author: str, request: Request, title: Optional[str] = None):
+    """3. [Catalog] Пошук за автором (опційно — і за словами з назви)"""
+    books = repo.find_by_author(author)
+    if title:
+        matched = {b["id"] for b in repo.find_by_words("title", title)}
+        books = [b for b in books if b["id"] in matched]
+    return etag_response(request, [BookReadDTO(**b) for b in books])
 
 @app.post("/catalog/books", response_model=BookReadDTO)
 def add_book(dto: BookCreateDTO):
     """4. [Catalog] Додати нову книгу"""
     return CatalogBusinessLogic.add(dto)
 
+@app.post("/catalog/books/{id}/reserve", response_model=ReservationReadDTO, status_code=201)
+def reserve_book(id: int, ttl: Optional[float] = None, if_match: Optional[str] = Header(None)):
+    """[Catalog] Резервація однієї книги (If-Match — ETag з GET /catalog/books/{id})"""
+    return CatalogBusinessLogic.reserve(
+        ReservationCreateDTO(ids=[id], ttl=ttl, if_match={id: if_match} if if_match else {}))
+
 @app.put("/catalog/books/{id}/status")
 def update_book_status(id: int, available: bool):
     """Службовий метод для зміни статусу (викликається Loan Service)"""
-    updated = repo.update_availability(id, available)
+    with repo.lock:
+        updated = repo.update_availability(id, available)
+        if updated:
+            reservations.released([id])
     if not updated: raise HTTPException(status_code=404)
     return {"status": "success"}
 
@@ -4,6 +4,7 @@ import json
 
 # Єдина точка входу для всієї системи (Вимога ПЗ №4) 
 GATEWAY_URL = "http://127.0.0.1:8080"
+PAGE_SIZE = 20  # Скільки записів списку завантажувати за раз
 
 class LibraryClient:
     """
@@ -11,6 +12,15 @@ class LibraryClient:
     Маршрутизація до конкретних мікросервісів виконується шлюзом динамічно.
     """
 
+    # --- СПИСКИ ПОСТОРІНКОВО (after + limit, курсор у X-Next-Cursor) ---
+    @staticmethod
+    def get_page(path, after=None, limit=PAGE_SIZE, **params):
+        """Одна сторінка списку: (записи, курсор наступної сторінки або None)"""
+        resp = requests.get(f"{GATEWAY_URL}/{path}", params={"after": after, "limit": limit, **params})
+        if resp.status_code != 200:
+            raise Exception(resp.json().get("detail", resp.text))
+        return resp.json(), resp.headers.get("X-Next-Cursor")
+
     # --- 1-4. CATALOG SERVICE (Через Gateway) ---
     @staticmethod
     def get_all_books():
@@ -33,6 +43,33 @@ class LibraryClient:
         resp = requests.post(f"{GATEWAY_URL}/catalog/books", json=payload)
         return resp.json()
 
+    @staticmethod
+    def get_books_by_ids(book_ids):
+        """Кілька книг одним запитом: ({id: книга}, [відсутні id])"""
+        resp = requests.post(f"{GATEWAY_URL}/catalog/books/batch-get", json={"ids": book_ids})
+        data = resp.json()
+        return data["books"], data["not_found"]
+
+    @staticmethod
+    def import_books(file_path):
+        """Масовий імпорт з NDJSON-файлу: файл передається потоком, не читається в пам'ять"""
+        with open(file_path, "rb") as f:
+            resp = requests.post(f"{GATEWAY_URL}/catalog/books/import", data=f,
+                                 headers={"Content-Type": "application/x-ndjson"})
+        return resp.json()
+
+    @staticmethod
+    def export_books(file_path):
+        """Експорт каталогу в NDJSON-файл потоком; повертає кількість книг"""
+        count = 0
+        with requests.get(f"{GATEWAY_URL}/catalog/books/export", stream=True) as resp, open(file_path, "wb") as f:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if line:
+                    f.write(line + b"\n")
+                    count += 1
+        return count
+
     # --- 5-8. READER SERVICE (Через Gateway) ---
     @staticmethod
     def get_all_readers():
@@ -45,6 +82,11 @@ class LibraryClient:
         resp = requests.get(f"{GATEWAY_URL}/readers/{reader_id}")
         return resp.json() if resp.status_code == 200 else resp.json().get('detail', "Помилка")
 
+    @staticmethod
+    def search_readers(prefix):
+        """Пошук читачів за початком слів імені ("влад бог")"""
+        return requests.get(f"{GATEWAY_URL}/readers/search", params={"prefix": prefix}).json()
+
     @staticmethod
     def register_reader(reader_id, name):
         payload = {"id": reader_id, "name": name}
@@ -70,6 +112,20 @@ class LibraryClient:
         resp = requests.put(f"{GATEWAY_URL}/loans/{loan_id}/return")
         return resp.json().get("message", resp.text)
 
+    @staticmethod
+    def create_loans(reader_id, book_ids):
+        """Видача кількох книг читачу одним запитом (усі або жодної)"""
+        payload = {"loans": [{"bookId": b, "readerId": reader_id} for b in book_ids]}
+        resp = requests.post(f"{GATEWAY_URL}/loans/batch", json=payload)
+        if resp.status_code == 201:
+            return f"Успіх: {resp.json()}"
+        return f"Відмова: {resp.json().get('detail', resp.text)}"
+
+    @staticmethod
+    def return_books(loan_ids):
+        resp = requests.put(f"{GATEWAY_URL}/loans/return", json={"ids": loan_ids})
+        return resp.json().get("message") or resp.json().get("detail", resp.text)
+
     @staticmethod
     def get_reader_history(reader_id):
         return requests.get(f"{GATEWAY_URL}/loans/history/{reader_id}").json()
@@ -78,6 +134,38 @@ class LibraryClient:
     def get_active_loans():
         return requests.get(f"{GATEWAY_URL}/loans/active").json()
 
+    # --- ПАКЕТНІ ЗАПИТИ (POST /batch) ---
+    @staticmethod
+    def batch(requests_list):
+        """Кілька запитів до різних сервісів одним round-trip: [{"id", "method", "path", "params", "body"}]"""
+        resp = requests.post(f"{GATEWAY_URL}/batch", json={"requests": requests_list})
+        return {item["id"]: item for item in resp.json()["responses"]}
+
+    @staticmethod
+    def get_loans_overview():
+        """Читачі, книги та активні видачі за один запит"""
+        parts = LibraryClient.batch([
+            {"id": "readers", "path": "readers/"},
+            {"id": "books", "path": "catalog/books"},
+            {"id": "loans", "path": "loans/active"},
+        ])
+        return {k: v["body"] if v["status"] == 200 else f"Помилка {v['status']}: {v['body']}"
+                for k, v in parts.items()}
+
+def print_pages(client, path, **params):
+    """Виводить список сторінками, наступна — за Enter"""
+    after = None
+    while True:
+        items, after = client.get_page(path, after, **params)
+        for item in items:
+            print(item)
+        if not after or input("Enter — наступна сторінка, q — вихід: ").strip().lower() == "q":
+            break
+
+def read_ids(prompt):
+    """Список ID через кому або пробіл"""
+    return [int(x) for x in input(prompt).replace(",", " ").split()]
+
 def main():
     client = LibraryClient()
     while True:
@@ -99,17 +187,25 @@ def main():
         print("10. [Loan]   Повернути книгу")
         print("11. [Loan]   Історія запозичень читача")
         print("12. [Loan]   Список книг на руках (активні)")
+        print("13. [Loan]   Зведення: читачі, книги, активні видачі")
+        print("-" * 25)
+        print("14. [Catalog] Імпорт книг з NDJSON-файлу")
+        print("15. [Catalog] Експорт каталогу в NDJSON-файл")
+        print("16. [Catalog] Кілька книг за ID")
+        print("17. [Loan]   Видати кілька книг читачу")
+        print("18. [Loan]   Повернути кілька книг")
+        print("19. [Reader] Пошук читача за іменем")
         print("0. Вихід")
         
         choice = input("\nВаш вибір: ")
 
         try:
-            if choice == "1": print(client.get_all_books())
+            if choice == "1": print_pages(client, "catalog/books")
             elif choice == "2": print(client.get_book_by_id(int(input("ID книги: "))))
             elif choice == "3": print(client.search_by_author(input("Автор: ")))
             elif choice == "4": print(client.add_book(int(input("ID: ")), input("Назва: "), input("Автор: "), input("Опис: ")))
             
-            elif choice == "5": print(client.get_all_readers())
+            elif choice == "5": print_pages(client, "readers/")
             elif choice == "6": print(client.get_reader_by_id(int(input("ID читача: "))))
             elif choice == "7": print(client.register_reader(int(input("ID читача: ")), input("Ім'я: ")))
             elif choice == "8": print(client.update_reader_status(int(input("ID читача: ")), input("Статус (active/blocked): ")))
@@ -117,7 +213,22 @@ def main():
             elif choice == "9": print(client.create_loan(int(input("ID книги: ")), int(input("ID читача: "))))
             elif choice == "10": print(client.return_book(int(input("ID Loan ID: "))))
             elif choice == "11": print(client.get_reader_history(int(input("ID читача: "))))
-            elif choice == "12": print(client.get_active_loans())
+            elif choice == "12": print_pages(client, "loans/active")
+            elif choice == "13":
+                for section, data in client.get_loans_overview().items():
+                    print(f"{section}: {data}")
+            elif choice == "14": print(client.import_books(input("Шлях до файлу: ")))
+            elif choice == "15": print(f"Експортовано книг: {client.export_books(input('Шлях до файлу: '))}")
+            elif choice == "16":
+                books, missing = client.get_books_by_ids(read_ids("ID книг (через кому): "))
+                for book in books.values():
+                    print(book)
+                if missing: print(f"Не знайдено: {missing}")
+            elif choice == "17": print(client.create_loans(int(input("ID читача: ")), read_ids("ID книг (через кому): ")))
+            elif choice == "18": print(client.return_books(read_ids("ID видач (через кому): ")))
+            elif choice == "19":
+                for reader in client.search_readers(input("Початок імені: ")):
+                    print(reader)
             
             elif choice == "0": break
             else: print("Невідома команда!")
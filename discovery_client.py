@@ -0,0 +1,260 @@
+# discovery_client.py
+"""
+Клієнт Discovery Service:
+  - DiscoveryAgent — реєстрація інстансів процесу під lease та його продовження
+    пакетним heartbeat через один пул з'єднань (Catalog, Readers, Loans);
+  - RegistryWatcher — локальне дзеркало складу сервісів через long-poll GET /watch/{name}:
+    у спокої — один запит на сервіс раз на WATCH_TIMEOUT, зміни приходять одразу дельтами.
+"""
+import asyncio
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+WATCH_TIMEOUT = 30.0        # скільки Discovery тримає long-poll без змін (с)
+WATCH_READ_MARGIN = 5.0     # запас до read timeout HTTP-запиту понад WATCH_TIMEOUT
+WATCH_RETRY_DELAY = 1.0     # пауза перед повтором після помилки (з джитером)
+WATCH_EMPTY_TTL = 60.0      # скільки тримати watch сервісу, що лишається без інстансів (с)
+LEASE_TTL = 15.0            # TTL lease на Discovery (с)
+HEARTBEAT_FRACTION = 1 / 3  # heartbeat раз на третину TTL: два пропуски ще не знімають реєстрацію
+HEARTBEAT_JITTER = 0.2      # +-20% до інтервалу, щоб репліки не синхронізувались
+REGISTER_RETRY_DELAY = 2.0  # пауза між спробами реєстрації, поки Discovery недоступний
+
+
+def _jittered(interval: float, jitter: float = HEARTBEAT_JITTER) -> float:
+    return interval * random.uniform(1 - jitter, 1 + jitter)
+
+
+class DiscoveryAgent:
+    """
+    Реєстрація інстансів процесу в Discovery.
+    Інстанси з однаковим TTL ділять один lease; усі lease продовжуються одним
+    POST /heartbeat/batch. Якщо Discovery втратив lease (перезапуск), реєстрація повторюється.
+    """
+
+    def __init__(self, discovery_url: str, ttl: float = LEASE_TTL):
+        self._url = discovery_url
+        self._ttl = ttl
+        self._client: Optional[httpx.AsyncClient] = None
+        # { ttl: [(name, host, port), ...] } і { ttl: lease_id }
+        self._instances: Dict[float, List[Tuple[str, str, int]]] = {}
+        self._leases: Dict[float, str] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Спільний пул з'єднань до Discovery (ним може користуватися і RegistryWatcher)."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(2.0),
+                                             limits=httpx.Limits(max_keepalive_connections=4))
+        return self._client
+
+    async def start(self, instances: List[Tuple[str, str, int]], ttl: Optional[float] = None):
+        """Реєструє інстанси та запускає фоновий heartbeat."""
+        ttl = ttl or self._ttl
+        self._instances.setdefault(ttl, []).extend(instances)
+        try:
+            await self._register(ttl)
+        except httpx.HTTPError as e:
+            print(f"[Discovery] Помилка реєстрації: {e!r}; повтор у фоні")
+        if self._task is None:
+            self._task = asyncio.create_task(self._heartbeat_loop())
+
+    async def _register(self, ttl: float):
+        resp = await self.client.post(f"{self._url}/lease", params={"ttl": ttl})
+        resp.raise_for_status()
+        lease_id = resp.json()["lease_id"]
+        for name, host, port in self._instances[ttl]:
+            r = await self.client.post(f"{self._url}/register",
+                                       params={"name": name, "host": host, "port": port, "lease_id": lease_id})
+            r.raise_for_status()
+            print(f"[{name}] Успішно зареєстровано ({host}:{port}, lease {lease_id})")
+        self._leases[ttl] = lease_id
+
+    async def _heartbeat_loop(self):
+        while True:
+            registered = len(self._leases) == len(self._instances)
+            interval = min(self._instances) * HEARTBEAT_FRACTION if registered else REGISTER_RETRY_DELAY
+            await asyncio.sleep(_jittered(interval))
+            try:
+                if self._leases:
+                    resp = await self.client.post(f"{self._url}/heartbeat/batch",
+                                                  json={"leases": list(self._leases.values())})
+                    resp.raise_for_status()
+                    lost = set(resp.json()["not_found"])
+                    for ttl in [t for t, lease_id in self._leases.items() if lease_id in lost]:
+                        del self._leases[ttl]
+                for ttl in [t for t in self._instances if t not in self._leases]:
+                    await self._register(ttl)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass
+
+    async def stop(self):
+        """Зупиняє heartbeat і відкликає lease: інстанси зникають з реєстру одразу."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for lease_id in self._leases.values():
+            try:
+                await self.client.delete(f"{self._url}/lease/{lease_id}")
+            except httpx.HTTPError:
+                pass
+        self._leases.clear()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class WatchedService:
+    """Локальна копія складу одного сервісу."""
+    __slots__ = ("name", "instances", "epoch", "revision", "synced_at", "connected", "_by_key")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.instances: List[dict] = []   # новий список при кожній зміні, старі не мутуються
+        self.epoch: Optional[str] = None
+        self.revision: Optional[int] = None
+        self.synced_at = 0.0              # час останньої успішної відповіді Discovery
+        self.connected = False
+        self._by_key: Dict[Tuple[str, int], dict] = {}
+
+    def apply(self, data: dict) -> bool:
+        """Застосовує відповідь /watch; повертає True, якщо склад змінився."""
+        changed = False
+        if data["reset"]:
+            self._by_key = {(i["host"], i["port"]): i for i in data["instances"]}
+            changed = True
+        else:
+            for i in data["removed"]:
+                changed |= self._by_key.pop((i["host"], i["port"]), None) is not None
+            for i in data["added"]:
+                key = (i["host"], i["port"])
+                if key not in self._by_key:
+                    self._by_key[key] = i
+                    changed = True
+        if changed:
+            self.instances = list(self._by_key.values())
+        self.epoch = data["epoch"]
+        self.revision = data["revision"]
+        self.synced_at = time.time()
+        self.connected = True
+        return changed
+
+    def as_dict(self) -> dict:
+        return {"instances": len(self.instances), "revision": self.revision, "connected": self.connected,
+                "age": round(time.time() - self.synced_at, 3)}
+
+
+class RegistryWatcher:
+    """
+    Дзеркало реєстру: перший запит до сервісу отримує повний знімок,
+    далі фонова задача тримає long-poll і застосовує дельти.
+    Постійний watch (persistent) — для відомих сервісів; решта стежаться, лише поки мають
+    інстанси: порожній знімок не запускає watch, а спорожнілий сервіс через empty_ttl забувається.
+    """
+
+    def __init__(self, discovery_url: str, watch_timeout: float = WATCH_TIMEOUT,
+                 retry_delay: float = WATCH_RETRY_DELAY, empty_ttl: float = WATCH_EMPTY_TTL):
+        self._url = discovery_url
+        self._watch_timeout = watch_timeout
+        self._retry_delay = retry_delay
+        self._empty_ttl = empty_ttl
+        self._client: Optional[httpx.AsyncClient] = None
+        self._owns_client = False
+        self._services: Dict[str, WatchedService] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._counters = {"polls": 0, "changes": 0, "resets": 0, "errors": 0, "dropped": 0}
+
+    def open(self, client: Optional[httpx.AsyncClient] = None):
+        """Використовує переданий (спільний) клієнт або створює власний."""
+        self._owns_client = client is None
+        self._client = client if client is not None else httpx.AsyncClient()
+
+    async def aclose(self):
+        tasks = [*self._tasks.values(), *self._pending.values()]
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._owns_client and self._client is not None:
+            await self._client.aclose()
+        self._client = None
+
+    def get(self, name: str) -> Optional[WatchedService]:
+        return self._services.get(name)
+
+    async def ensure(self, name: str, persistent: bool = True) -> WatchedService:
+        """
+        Стан сервісу; для нового — повний знімок (конкурентні виклики чекають один запит) і запуск watch.
+        Непостійний сервіс без інстансів повертається порожнім, але не запам'ятовується.
+        """
+        watched = self._services.get(name)
+        if watched is not None:
+            return watched
+        task = self._pending.get(name)
+        if task is None:
+            # Окрема задача: скасування першого виклику не лишає решту без відповіді
+            task = self._pending[name] = asyncio.create_task(self._load(name, persistent))
+            task.add_done_callback(lambda t: self._loaded(name, t))
+        return await asyncio.shield(task)
+
+    async def _load(self, name: str, persistent: bool) -> WatchedService:
+        candidate = WatchedService(name)
+        await self._poll(candidate, wait=False)
+        if persistent or candidate.instances:
+            self._services[name] = candidate
+            self._tasks[name] = asyncio.create_task(self._watch_loop(candidate, persistent))
+        return candidate
+
+    def _loaded(self, name: str, task: asyncio.Task):
+        if self._pending.get(name) is task:
+            del self._pending[name]
+        if not task.cancelled():
+            task.exception()  # помилку вже отримали ті, хто чекав; не даємо asyncio сваритися
+
+    async def _poll(self, watched: WatchedService, wait: bool):
+        params = {"timeout": self._watch_timeout if wait else 0}
+        if watched.revision is not None:
+            params.update(epoch=watched.epoch, revision=watched.revision)
+        resp = await self._client.get(
+            f"{self._url}/watch/{watched.name}", params=params,
+            timeout=httpx.Timeout(5.0, read=self._watch_timeout + WATCH_READ_MARGIN))
+        resp.raise_for_status()
+        data = resp.json()
+        self._counters["polls"] += 1
+        if data["reset"]:
+            self._counters["resets"] += 1
+        if watched.apply(data):
+            self._counters["changes"] += 1
+
+    async def _watch_loop(self, watched: WatchedService, persistent: bool):
+        empty_since = None
+        while True:
+            try:
+                await self._poll(watched, wait=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Discovery недоступний: лишаємо останній відомий склад, позначаємо як застарілий
+                watched.connected = False
+                self._counters["errors"] += 1
+                await asyncio.sleep(self._retry_delay * random.uniform(0.5, 1.5))
+            if persistent or watched.instances:
+                empty_since = None
+            elif empty_since is None:
+                empty_since = time.monotonic()
+            elif time.monotonic() - empty_since >= self._empty_ttl:
+                # Сервіс зник: не тримаємо long-poll (і з'єднання пулу Discovery) заради нього
+                self._services.pop(watched.name, None)
+                self._tasks.pop(watched.name, None)
+                self._counters["dropped"] += 1
+                return
+
+    def stats(self) -> dict:
+        return {"services": {name: w.as_dict() for name, w in self._services.items()}, **self._counters}
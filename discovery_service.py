@@ -1,58 +1,525 @@
 # discovery_service.py
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Response
+from pydantic import BaseModel
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+import asyncio
+import itertools
+import json
+import os
 import time
+import uuid
 import uvicorn
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
-app = FastAPI(title="Discovery Service (PZ4)")
+TTL = 15  # Час життя сервісу без Heartbeat
+REAP_INTERVAL = 1.0  # Як часто фоновий процес прибирає прострочені інстанси (с)
+CHANGE_LOG_SIZE = 4096  # Скільки останніх змін пам'ятає реєстр для дельт watch
+MAX_WATCH_TIMEOUT = 60.0  # Верхня межа очікування одного long-poll запиту (с)
+MIN_LEASE_TTL, MAX_LEASE_TTL = 1.0, 300.0  # Допустимий TTL lease (с)
 
-# Сховище: { "service_name": [ {instance_info}, ... ] }
-registry: Dict[str, List[dict]] = {}
-TTL = 15  # Час життя сервісу без Heartbeat 
+# --- Збереження реєстру на диск ---
+REGISTRY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "discovery_data")
+FLUSH_INTERVAL = 0.2  # Групове записування журналу: зміни за цей час — один write + fsync (с)
+COMPACT_LOG_BYTES = 1024 * 1024  # Після такого розміру журнал згортається в знімок
+COMPACT_INTERVAL = 300.0  # ...або не рідше ніж раз на стільки секунд
+
+
+class HeartbeatBatchDTO(BaseModel):
+    leases: List[str]
+
+
+class Instance:
+    __slots__ = ("host", "port", "last_seen", "lease")
+
+    def __init__(self, host: str, port: int, last_seen: float, lease: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.last_seen = last_seen
+        self.lease = lease  # id lease, якщо інстанс живе разом з ним
+
+
+class Lease:
+    """Оренда з TTL: усі прив'язані інстанси живуть, поки її продовжують."""
+    __slots__ = ("id", "ttl", "expires_at", "instances")
+
+    def __init__(self, lease_id: str, ttl: float, expires_at: float):
+        self.id = lease_id
+        self.ttl = ttl
+        self.expires_at = expires_at  # абсолютний час (time.time()), переживає перезапуск
+        self.instances: Set[Tuple[str, str, int]] = set()
+
+    def renew(self, now: float):
+        self.expires_at = now + self.ttl
+
+
+class ServiceRegistry:
+    """
+    Реєстр інстансів з індексом за (name, host, port):
+      - register/heartbeat — O(1);
+      - інстанси можна прив'язати до lease: один пакетний heartbeat продовжує їх усі;
+      - читання віддає готовий JSON-знімок сервісу, який перебудовується лише при зміні складу;
+      - прострочені інстанси прибирає фоновий reaper;
+      - кожна зміна складу збільшує ревізію і потрапляє в обмежений журнал змін (для watch);
+      - кожна операція з часом виконання пишеться в RegistryStore: повтор операцій зі
+        збереженим часом на старті відтворює той самий стан з тими самими термінами життя.
+    """
+    EMPTY = b"[]"
+
+    def __init__(self, ttl: float, log_size: int = CHANGE_LOG_SIZE):
+        self.ttl = ttl
+        # epoch змінюється при кожному старті: ревізії різних запусків не порівнюються
+        self.epoch = uuid.uuid4().hex[:12]
+        self.revision = 0
+        # (revision, name, op, host, port), op: "add" | "remove"; ревізії йдуть підряд
+        self._log: deque = deque(maxlen=log_size)
+        self._waiters: Dict[str, asyncio.Event] = {}
+        self._index: Dict[Tuple[str, str, int], Instance] = {}
+        # Інстанси без lease у порядку останніх heartbeat, тож найстаріші завжди на початку
+        self._expiry: "OrderedDict[Tuple[str, str, int], None]" = OrderedDict()
+        self._leases: Dict[str, Lease] = {}
+        # { "service_name": { (host, port): Instance } }
+        self._by_name: Dict[str, Dict[Tuple[str, int], Instance]] = {}
+        self._snapshots: Dict[str, bytes] = {}
+        self.store: Optional["RegistryStore"] = None
+
+    def _journal(self, op: str, **fields):
+        if self.store is not None:
+            self.store.append({"op": op, **fields})
+
+    def grant_lease(self, ttl: float, lease_id: Optional[str] = None, now: Optional[float] = None) -> Lease:
+        now = now or time.time()
+        lease = self._leases.get(lease_id) if lease_id is not None else None
+        if lease is not None:
+            # Повтор журналу поверх знімка, де lease вже є: зберігаємо його разом з інстансами
+            return lease
+        lease = Lease(lease_id or uuid.uuid4().hex[:16], ttl, now + ttl)
+        self._leases[lease.id] = lease
+        self._journal("grant_lease", ttl=ttl, lease_id=lease.id, now=now)
+        return lease
+
+    def renew_leases(self, lease_ids: List[str], now: Optional[float] = None) -> Tuple[List[str], List[str]]:
+        now = now or time.time()
+        renewed, missing = [], []
+        for lease_id in lease_ids:
+            lease = self._leases.get(lease_id)
+            if lease is None:
+                missing.append(lease_id)
+            else:
+                lease.renew(now)
+                renewed.append(lease_id)
+        if renewed:
+            self._journal("renew_leases", lease_ids=renewed, now=now)
+        return renewed, missing
+
+    def revoke_lease(self, lease_id: str) -> bool:
+        lease = self._leases.pop(lease_id, None)
+        if lease is None:
+            return False
+        self._journal("revoke_lease", lease_id=lease_id)
+        self._remove_all(lease.instances, "відкликано lease")
+        return True
+
+    def register(self, name: str, host: str, port: int, lease_id: Optional[str] = None,
+                 now: Optional[float] = None) -> bool:
+        """
+        Повертає True, якщо інстанс новий (склад сервісу змінився).
+        KeyError — lease з таким id не існує.
+        """
+        now = now or time.time()
+        lease = self._leases[lease_id] if lease_id is not None else None
+        key = (name, host, port)
+        instance = self._index.get(key)
+        if instance is None:
+            instance = self._index[key] = Instance(host, port, now)
+            self._by_name.setdefault(name, {})[(host, port)] = instance
+            self._record(name, "add", host, port)
+            self._rebuild(name)
+            is_new = True
+        else:
+            instance.last_seen = now
+            is_new = False
+        self._attach(key, instance, lease, now)
+        self._journal("register", name=name, host=host, port=port, lease_id=lease_id, now=now)
+        return is_new
+
+    def _attach(self, key: Tuple[str, str, int], instance: Instance, lease: Optional[Lease], now: float):
+        if instance.lease is not None:
+            previous = self._leases.get(instance.lease)
+            if previous is not None:
+                previous.instances.discard(key)
+        if lease is not None:
+            instance.lease = lease.id
+            lease.instances.add(key)
+            lease.renew(now)
+            self._expiry.pop(key, None)
+        else:
+            instance.lease = None
+            self._expiry[key] = None
+            self._expiry.move_to_end(key)
+
+    def heartbeat(self, name: str, host: str, port: int, now: Optional[float] = None) -> bool:
+        now = now or time.time()
+        key = (name, host, port)
+        instance = self._index.get(key)
+        if instance is None:
+            return False
+        instance.last_seen = now
+        if instance.lease is not None:
+            self._leases[instance.lease].renew(now)
+        else:
+            self._expiry.move_to_end(key)
+        self._journal("heartbeat", name=name, host=host, port=port, now=now)
+        return True
+
+    def snapshot(self, name: str) -> bytes:
+        return self._snapshots.get(name, self.EMPTY)
+
+    def reap(self, now: Optional[float] = None) -> int:
+        """Видаляє інстанси без heartbeat довше за TTL і всі інстанси прострочених lease."""
+        now = now or time.time()
+        deadline = now - self.ttl
+        expired = []
+        # Без lease: перебираємо лише прострочену голову черги
+        while self._expiry:
+            key = next(iter(self._expiry))
+            if self._index[key].last_seen >= deadline:
+                break
+            del self._expiry[key]
+            expired.append(key)
+        removed = self._remove_all(expired, "TTL")
+        # Lease нечисленні (один на процес), тому їх достатньо просто переглянути
+        expired_leases = [l for l in self._leases.values() if l.expires_at <= now]
+        for lease in expired_leases:
+            del self._leases[lease.id]
+            removed += self._remove_all(lease.instances, "TTL lease")
+        if expired or expired_leases:
+            self._journal("reap", now=now)
+        return removed
+
+    def _remove_all(self, keys, reason: str) -> int:
+        changed = set()
+        removed = 0
+        for key in list(keys):
+            instance = self._index.pop(key, None)
+            if instance is None:
+                continue
+            removed += 1
+            self._expiry.pop(key, None)
+            name, host, port = key
+            del self._by_name[name][(host, port)]
+            self._record(name, "remove", host, port)
+            changed.add(name)
+            print(f"[Discovery] Видалено ({reason}): {name} ({host}:{port})")
+        for name in changed:
+            self._rebuild(name)
+        return removed
+
+    def _record(self, name: str, op: str, host: str, port: int):
+        self.revision += 1
+        self._log.append((self.revision, name, op, host, port))
+
+    def _rebuild(self, name: str):
+        instances = self._by_name.get(name)
+        if not instances:
+            self._by_name.pop(name, None)
+            self._snapshots.pop(name, None)
+        else:
+            self._snapshots[name] = json.dumps(
+                [{"host": i.host, "port": i.port} for i in instances.values()],
+                separators=(",", ":")).encode("utf-8")
+        # Будимо всіх, хто чекає на зміни цього сервісу
+        event = self._waiters.pop(name, None)
+        if event is not None:
+            event.set()
+
+    def changes_since(self, name: str, epoch: Optional[str], revision: Optional[int]) -> Optional[dict]:
+        """
+        Дельта складу сервісу після revision: {"added": [...], "removed": [...]}.
+        None — ревізія з іншого запуску або вже витіснена з журналу (потрібен повний знімок).
+        """
+        if epoch != self.epoch or revision is None or revision > self.revision:
+            return None
+        first = self._log[0][0] if self._log else self.revision + 1
+        if revision < first - 1:
+            return None
+        # Остання операція над інстансом перекриває попередні
+        ops: Dict[Tuple[str, int], str] = {}
+        for _, changed, op, host, port in itertools.islice(self._log, revision - first + 1, None):
+            if changed == name:
+                ops[(host, port)] = op
+        added = [{"host": h, "port": p} for (h, p), op in ops.items() if op == "add"]
+        removed = [{"host": h, "port": p} for (h, p), op in ops.items() if op == "remove"]
+        return {"added": added, "removed": removed}
+
+    async def wait_for_change(self, name: str, timeout: float) -> bool:
+        event = self._waiters.get(name)
+        if event is None:
+            event = self._waiters[name] = asyncio.Event()
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    REPLAY_OPS = {"grant_lease", "renew_leases", "revoke_lease", "register", "heartbeat", "reap"}
+
+    def dump(self) -> dict:
+        """Стан для знімка на диску: абсолютні терміни, інстанси без lease — у порядку heartbeat."""
+        leased = [k for k, i in self._index.items() if i.lease is not None]
+        return {
+            "leases": [{"id": l.id, "ttl": l.ttl, "expires_at": l.expires_at} for l in self._leases.values()],
+            "instances": [{"name": k[0], "host": k[1], "port": k[2], "last_seen": self._index[k].last_seen,
+                           "lease": self._index[k].lease} for k in itertools.chain(self._expiry, leased)],
+        }
+
+    def load(self, state: dict):
+        """Відновлення зі знімка (до старту: журнал змін і очікувачі watch ще порожні)."""
+        for l in state["leases"]:
+            self._leases[l["id"]] = Lease(l["id"], l["ttl"], l["expires_at"])
+        for i in state["instances"]:
+            key = (i["name"], i["host"], i["port"])
+            lease = self._leases.get(i["lease"]) if i["lease"] is not None else None
+            if i["lease"] is not None and lease is None:
+                continue
+            instance = self._index[key] = Instance(i["host"], i["port"], i["last_seen"], i["lease"])
+            self._by_name.setdefault(i["name"], {})[(i["host"], i["port"])] = instance
+            if lease is not None:
+                lease.instances.add(key)
+            else:
+                self._expiry[key] = None
+        for name in list(self._by_name):
+            self._rebuild(name)
+
+    def replay(self, records: List[dict]):
+        """Повтор операцій журналу з їхнім початковим часом."""
+        for record in records:
+            op = record.pop("op", None)
+            if op not in self.REPLAY_OPS:
+                continue
+            try:
+                getattr(self, op)(**record)
+            except KeyError:
+                pass  # lease уже відкликано або прострочено
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def as_dict(self) -> Dict[str, list]:
+        return {
+            name: [{"host": i.host, "port": i.port, "last_seen": self._last_seen(i)} for i in instances.values()]
+            for name, instances in self._by_name.items()
+        }
+
+    def _last_seen(self, instance: Instance) -> float:
+        if instance.lease is None:
+            return instance.last_seen
+        lease = self._leases[instance.lease]
+        return lease.expires_at - lease.ttl
+
+
+class RegistryStore:
+    """
+    Знімок реєстру + append-only журнал операцій (NDJSON).
+    Записи буферизуються і скидаються фоновою задачею пачками (write + fsync);
+    компактизація атомарно (os.replace) записує свіжий знімок і обнуляє журнал.
+    Кожен запис має порядковий номер seq, знімок — номер останнього врахованого запису:
+    якщо зупинка сталася між заміною знімка і обнуленням журналу, старі записи пропускаються.
+    Запис у файли йде в потоці; скасування задачі його не перериває, і наступна операція
+    з файлами спершу дочікується попередньої.
+    """
+
+    def __init__(self, directory: str):
+        self._directory = directory
+        self.snapshot_path = os.path.join(directory, "registry.snapshot.json")
+        self.log_path = os.path.join(directory, "registry.log")
+        self._buffer: List[str] = []
+        self.seq = 0
+        self.log_bytes = 0
+        self._compacted_at = time.monotonic()
+        self._writing: Optional[asyncio.Future] = None
+
+    def load(self) -> Tuple[Optional[dict], List[dict]]:
+        os.makedirs(self._directory, exist_ok=True)
+        snapshot = None
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            self.seq = snapshot.pop("seq", 0)
+        records = []
+        if os.path.exists(self.log_path):
+            with open(self.log_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # обірваний останній запис після аварійної зупинки
+                    seq = record.pop("seq", None)
+                    if seq is not None:
+                        if seq <= self.seq:
+                            continue  # уже врахований у знімку
+                        self.seq = seq
+                    records.append(record)
+            self.log_bytes = os.path.getsize(self.log_path)
+        return snapshot, records
+
+    def append(self, record: dict):
+        self.seq += 1
+        self._buffer.append(json.dumps({"seq": self.seq, **record}, separators=(",", ":")))
+
+    async def _in_thread(self, write: Callable[[bytes], None], data: bytes):
+        if self._writing is not None and not self._writing.done():
+            await asyncio.wait([self._writing])
+        self._writing = asyncio.ensure_future(asyncio.to_thread(write, data))
+        await asyncio.shield(self._writing)
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        data = ("\n".join(self._buffer) + "\n").encode("utf-8")
+        self._buffer = []
+        await self._in_thread(self._write_log, data)
+        self.log_bytes += len(data)
+
+    def _write_log(self, data: bytes):
+        with open(self.log_path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def needs_compaction(self) -> bool:
+        return self.log_bytes > COMPACT_LOG_BYTES or (
+            self.log_bytes > 0 and time.monotonic() - self._compacted_at > COMPACT_INTERVAL)
+
+    async def compact(self, state: dict):
+        # state знято синхронно перед викликом: буфер уже врахований у ньому,
+        # а записи, що з'являться під час запису знімка, підуть у новий журнал
+        self._buffer = []
+        data = json.dumps({**state, "seq": self.seq}, separators=(",", ":")).encode("utf-8")
+        await self._in_thread(self._write_snapshot, data)
+        self.log_bytes = 0
+        self._compacted_at = time.monotonic()
+
+    def _write_snapshot(self, data: bytes):
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        open(self.log_path, "wb").close()
+
+
+# Сховище: { "service_name": [ {instance_info}, ... ] } з індексом за (name, host, port)
+registry = ServiceRegistry(TTL)
+store = RegistryStore(REGISTRY_DIR)
+
+
+async def restore_registry():
+    """Знімок + журнал з диска: маршрутизація відновлюється одразу, без очікування heartbeat"""
+    snapshot, records = store.load()
+    if snapshot is not None:
+        registry.load(snapshot)
+    registry.replay(records)
+    registry.reap()  # усе, що прострочилося, поки Discovery не працював
+    registry.store = store
+    await store.compact(registry.dump())
+    print(f"[Discovery] Відновлено з диска: {len(registry)} інстансів")
+
+
+async def persist_registry():
+    """Фонове групове записування журналу та його компактизація"""
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        await store.flush()
+        if store.needs_compaction():
+            await store.compact(registry.dump())
+
+
+async def reap_expired():
+    """Фонове видалення сервісів, що перестали надсилати Heartbeat"""
+    while True:
+        await asyncio.sleep(REAP_INTERVAL)
+        registry.reap()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await restore_registry()
+    reaper_task = asyncio.create_task(reap_expired())
+    persist_task = asyncio.create_task(persist_registry())
+    yield
+    reaper_task.cancel()
+    persist_task.cancel()
+    await asyncio.gather(reaper_task, persist_task, return_exceptions=True)
+    await store.compact(registry.dump())
+
+
+app = FastAPI(title="Discovery Service (PZ4)", lifespan=lifespan)
+
+@app.post("/lease")
+async def grant_lease(ttl: float = TTL):
+    """Видача lease: інстанси, зареєстровані з його id, живуть, поки lease продовжують"""
+    lease = registry.grant_lease(min(max(ttl, MIN_LEASE_TTL), MAX_LEASE_TTL))
+    return {"lease_id": lease.id, "ttl": lease.ttl}
+
+@app.delete("/lease/{lease_id}")
+async def revoke_lease(lease_id: str):
+    """Відкликання lease (коректна зупинка): усі його інстанси видаляються одразу"""
+    if not registry.revoke_lease(lease_id):
+        raise HTTPException(status_code=404, detail="Lease не знайдено")
+    return {"status": "revoked"}
 
 @app.post("/register")
-def register(name: str, host: str, port: int):
+async def register(name: str, host: str, port: int, lease_id: Optional[str] = None):
     """Реєстрація сервісу в реєстрі [cite: 1047]"""
-    if name not in registry:
-        registry[name] = []
-    
-    # Видаляємо старі записи про цей же інстанс
-    registry[name] = [s for s in registry[name] if not (s['host'] == host and s['port'] == port)]
-    
-    registry[name].append({
-        "host": host,
-        "port": port,
-        "last_seen": time.time()
-    })
+    try:
+        registry.register(name, host, port, lease_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Lease не знайдено")
     print(f"[Discovery] Зареєстровано: {name} ({host}:{port})")
     return {"status": "registered"}
 
+@app.post("/heartbeat/batch")
+async def heartbeat_batch(dto: HeartbeatBatchDTO):
+    """Продовження багатьох lease одним запитом; невідомі повертаються в not_found"""
+    renewed, missing = registry.renew_leases(dto.leases)
+    return {"renewed": renewed, "not_found": missing}
+
 @app.post("/heartbeat/{name}")
-def heartbeat(name: str, host: str, port: int):
+async def heartbeat(name: str, host: str, port: int):
     """Оновлення статусу (Heartbeat) [cite: 1058]"""
-    if name in registry:
-        for instance in registry[name]:
-            if instance['host'] == host and instance['port'] == port:
-                instance['last_seen'] = time.time()
-                return {"status": "alive"}
+    if registry.heartbeat(name, host, port):
+        return {"status": "alive"}
     return {"status": "not found"}
 
 @app.get("/services/{name}")
-def get_service_instances(name: str):
+async def get_service_instances(name: str):
     """Отримання адрес за логічним іменем [cite: 1061, 1092]"""
-    now = time.time()
-    if name not in registry:
-        return []
-    
-    # Фільтруємо тільки "живі" сервіси
-    active = [s for s in registry[name] if now - s['last_seen'] < TTL]
-    registry[name] = active
-    return [{"host": s['host'], "port": s['port']} for s in active]
+    # Готовий знімок: без фільтрації та серіалізації на кожне читання
+    return Response(registry.snapshot(name), media_type="application/json")
+
+@app.get("/watch/{name}")
+async def watch_service(name: str, revision: Optional[int] = None, epoch: Optional[str] = None,
+                        timeout: float = 30.0):
+    """
+    Long-poll зміни складу сервісу.
+    Клієнт передає epoch і ревізію з попередньої відповіді; запит чекає до timeout секунд
+    і повертає лише дельту. Без ревізії (або якщо вона застаріла) — повний знімок з reset=true.
+    """
+    delta = registry.changes_since(name, epoch, revision)
+    if delta is not None and not delta["added"] and not delta["removed"]:
+        if timeout > 0 and await registry.wait_for_change(name, min(timeout, MAX_WATCH_TIMEOUT)):
+            delta = registry.changes_since(name, epoch, revision)
+    head = {"epoch": registry.epoch, "revision": registry.revision}
+    if delta is None:
+        return {**head, "reset": True, "instances": json.loads(registry.snapshot(name))}
+    return {**head, "reset": False, **delta}
 
 @app.get("/services")
-def list_all():
+async def list_all():
     """Моніторинг реєстру [cite: 1063]"""
-    return registry
+    return registry.as_dict()
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="127.0.0.1", port=8000)
@@ -0,0 +1,47 @@
+# etag.py
+"""
+ETag для JSON-відповідей мікросервісів.
+Тіло серіалізується так само, як у FastAPI JSONResponse, ETag — хеш цих байтів.
+Якщо клієнт (або Gateway) надіслав If-None-Match з тим самим тегом, повертається 304 без тіла.
+"""
+import hashlib
+import json
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Порівняння If-None-Match за слабким правилом (RFC 7232, 3.2)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith("W/") else tag) == bare:
+            return True
+    return False
+
+
+def encode_json(content) -> bytes:
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def content_etag(content) -> str:
+    """ETag, який etag_response видав би для content (для перевірки If-Match)."""
+    return make_etag(encode_json(content))
+
+
+def etag_response(request: Request, content) -> Response:
+    body = encode_json(content)
+    etag = make_etag(body)
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
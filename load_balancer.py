@@ -0,0 +1,160 @@
+# load_balancer.py
+"""
+Балансування навантаження між інстансами сервісу.
+Спільний модуль для API Gateway та Loan Service: облік запитів у польоті
+та затримки кожного інстансу, політика вибору задається окремо для кожного сервісу.
+"""
+import itertools
+import math
+import random
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+EWMA_DECAY = 10.0        # секунд: стала часу згасання EWMA затримки
+DEFAULT_LATENCY = 0.05   # початкова оцінка затримки для нового інстансу (с)
+
+
+def instance_key(instance: dict) -> str:
+    return f"{instance['host']}:{instance['port']}"
+
+
+class InstanceStats:
+    """Лічильники одного інстансу: запити в польоті та EWMA затримки."""
+    __slots__ = ("in_flight", "ewma", "requests", "failures", "_updated")
+
+    def __init__(self):
+        self.in_flight = 0
+        self.ewma = DEFAULT_LATENCY
+        self.requests = 0
+        self.failures = 0
+        self._updated = time.monotonic()
+
+    def observe(self, latency: float, ok: bool):
+        # EWMA з вагою, що залежить від часу між спостереженнями
+        now = time.monotonic()
+        weight = math.exp(-(now - self._updated) / EWMA_DECAY)
+        self.ewma = self.ewma * weight + latency * (1 - weight)
+        self._updated = now
+        self.requests += 1
+        if not ok:
+            self.failures += 1
+
+    def as_dict(self) -> dict:
+        return {"in_flight": self.in_flight, "ewma_ms": round(self.ewma * 1000, 3),
+                "requests": self.requests, "failures": self.failures}
+
+
+# --- ПОЛІТИКИ ВИБОРУ ІНСТАНСУ ---
+class RoundRobinPolicy:
+    def __init__(self):
+        self._counter = itertools.count()
+
+    def pick(self, instances: List[dict], stats: List[InstanceStats]) -> int:
+        return next(self._counter) % len(instances)
+
+
+class LeastOutstandingPolicy:
+    """Інстанс з найменшою кількістю запитів у польоті (нічия — випадково)."""
+    def pick(self, instances: List[dict], stats: List[InstanceStats]) -> int:
+        lowest = min(s.in_flight for s in stats)
+        return random.choice([i for i, s in enumerate(stats) if s.in_flight == lowest])
+
+
+class PowerOfTwoPolicy:
+    """Power of two choices: два випадкові інстанси, кращий за in-flight, далі за затримкою."""
+    def pick(self, instances: List[dict], stats: List[InstanceStats]) -> int:
+        if len(instances) == 1:
+            return 0
+        a, b = random.sample(range(len(instances)), 2)
+        return min((a, b), key=lambda i: (stats[i].in_flight, stats[i].ewma))
+
+
+class EwmaWeightedPolicy:
+    """Випадковий вибір з вагою 1 / (EWMA затримки * (in_flight + 1))."""
+    def pick(self, instances: List[dict], stats: List[InstanceStats]) -> int:
+        weights = [1.0 / (max(s.ewma, 1e-6) * (s.in_flight + 1)) for s in stats]
+        return random.choices(range(len(instances)), weights=weights)[0]
+
+
+POLICIES = {
+    "round_robin": RoundRobinPolicy,
+    "least_outstanding": LeastOutstandingPolicy,
+    "p2c": PowerOfTwoPolicy,
+    "ewma": EwmaWeightedPolicy,
+}
+
+
+class LoadBalancer:
+    """Вибір інстансу за політикою сервісу та облік результатів запитів."""
+
+    def __init__(self, policies: Optional[Dict[str, str]] = None, default: str = "p2c"):
+        if default not in POLICIES:
+            raise ValueError(f"Невідома політика балансування: {default}")
+        self._default = default
+        self._policy_names: Dict[str, str] = {}
+        self._policies: Dict[str, object] = {}
+        # { "service_name": { "host:port": InstanceStats } }
+        self._stats: Dict[str, Dict[str, InstanceStats]] = {}
+        for service, name in (policies or {}).items():
+            self.set_policy(service, name)
+
+    def set_policy(self, service: str, name: str):
+        if name not in POLICIES:
+            raise ValueError(f"Невідома політика балансування: {name}")
+        self._policy_names[service] = name
+        self._policies[service] = POLICIES[name]()
+
+    def policy_name(self, service: str) -> str:
+        return self._policy_names.get(service, self._default)
+
+    def _policy(self, service: str):
+        policy = self._policies.get(service)
+        if policy is None:
+            policy = self._policies[service] = POLICIES[self._default]()
+        return policy
+
+    def _instance_stats(self, service: str, instance: dict) -> InstanceStats:
+        by_key = self._stats.setdefault(service, {})
+        key = instance_key(instance)
+        stats = by_key.get(key)
+        if stats is None:
+            stats = by_key[key] = InstanceStats()
+        return stats
+
+    def pick(self, service: str, instances: List[dict]) -> dict:
+        if len(instances) == 1:
+            return instances[0]
+        stats = [self._instance_stats(service, i) for i in instances]
+        return instances[self._policy(service).pick(instances, stats)]
+
+    def begin(self, service: str, instance: dict) -> float:
+        self._instance_stats(service, instance).in_flight += 1
+        return time.monotonic()
+
+    def end(self, service: str, instance: dict, started: float, ok: bool = True):
+        stats = self._instance_stats(service, instance)
+        stats.in_flight -= 1
+        stats.observe(time.monotonic() - started, ok)
+
+    def abandon(self, service: str, instance: dict):
+        """Запит скасовано (наприклад, програв hedge) — затримку не враховуємо."""
+        self._instance_stats(service, instance).in_flight -= 1
+
+    @contextmanager
+    def track(self, service: str, instance: dict):
+        """Облік одного запиту: помилка (виняток) зараховується як невдача."""
+        started = self.begin(service, instance)
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.end(service, instance, started, ok)
+
+    def stats(self) -> dict:
+        return {
+            service: {"policy": self.policy_name(service),
+                      "instances": {k: s.as_dict() for k, s in by_key.items()}}
+            for service, by_key in self._stats.items()
+        }
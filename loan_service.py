@@ -1,19 +1,45 @@
 # loan_service.py
-import httpx
 import asyncio
-import requests
-from fastapi import FastAPI, HTTPException
+import itertools
+import os
+import random
+import time
+from collections import OrderedDict
+import httpx
+from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Awaitable, Callable, List, Optional
 from contextlib import asynccontextmanager
 import uvicorn
-import random
+
+from discovery_client import DiscoveryAgent, RegistryWatcher
+from load_balancer import LoadBalancer
+from pagination import page_response, paginate, parse_fields
+from record_store import MemoryStore, SqliteStore
+from resilience import BreakerRegistry, UpstreamCaller
 
 # --- ІНФРАСТРУКТУРНІ НАСТРОЙКИ (PZ4) ---
 SERVICE_NAME = "loans"
 SERVICE_HOST = "127.0.0.1"
 SERVICE_PORT = 8003
 DISCOVERY_URL = "http://127.0.0.1:8000"
+# Сховище видач: "memory" — список у пам'яті (як каталог і читачі за замовчуванням);
+# "sqlite" — SQLite (WAL) на диску. Видачі посилаються на стан книг у каталозі, тож "sqlite" має сенс
+# лише разом зі збережуваними каталогом і читачами, інакше після перезапуску "активні" видачі
+# вказуватимуть на книги, які свіжий каталог вважає доступними
+LOAN_STORE = "memory"
+LOAN_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loan_data", "loans.db")
+READER_CACHE_SIZE = 100_000   # статусів читачів у локальному кеші
+FEED_TIMEOUT = 30.0           # скільки Reader Service тримає long-poll /readers/changes без змін (с)
+FEED_READ_MARGIN = 5.0        # запас до read timeout понад FEED_TIMEOUT
+FEED_RETRY_DELAY = 1.0        # пауза перед повтором після помилки (з джитером)
+# Спільний пул з'єднань до Catalog і Readers та дедлайни оркестрації
+POOL_LIMITS = httpx.Limits(max_connections=200, max_keepalive_connections=50, keepalive_expiry=30.0)
+CONNECT_TIMEOUT = 1.0         # встановлення з'єднання (с)
+CALL_TIMEOUT = 2.0            # дедлайн однієї спроби виклику (с)
+REQUEST_DEADLINE = 5.0        # дедлайн усієї видачі/повернення, включно з повторами (с)
+DEADLINE_GRACE = 0.05         # запас спроби понад залишок deadline: першим спрацьовує загальний таймаут (с)
+RESERVATION_TTL = 15.0        # резервація книги в каталозі, якщо видачу не підтверджено (с)
 
 # --- 1. ШАР DTO ---
 class LoanCreateDTO(BaseModel):
@@ -24,102 +50,529 @@ class LoanReadDTO(BaseModel):
     id: int
     bookId: int
     readerId: int
-    status: str  # "active" або "returned"
+    status: str  # "active", "returned" або "cancelled" (резервацію книги не вдалося підтвердити)
+
+LOAN_FIELDS = ("id", "bookId", "readerId", "status")
+MAX_BATCH_LOANS = 100  # видач в одному пакетному запиті
+
+class LoanBatchCreateDTO(BaseModel):
+    loans: List[LoanCreateDTO]
+
+class LoanBatchReturnDTO(BaseModel):
+    ids: List[int]
 
 # --- 2. ШАР REPOSITORY ---
+# Індекси за id (ключ сховища), статусом (активні видачі), читачем і книгою — в обох бекендах
+LOAN_INDEXES = [("status", "readerId"), ("readerId",), ("bookId",)]
+LOAN_STORES = {
+    "memory": lambda: MemoryStore(indexes=LOAN_INDEXES),
+    "sqlite": lambda: SqliteStore(LOAN_DB_PATH, "loans", {"id": int, "bookId": int, "readerId": int, "status": str},
+                                  indexes=LOAN_INDEXES),
+}
+
 class LoanRepository:
-    def __init__(self):
-        self._db = []
+    """
+    Видачі в порядку оформлення (у сховищі LOAN_STORE).
+    Пошук за id, читачем, книгою і статусом іде індексами сховища, а не переглядом усіх видач.
+    Сховище відкривається в lifespan (open), а не при імпорті: імпорт модуля не створює файлів БД.
+    """
+    def __init__(self, store: str = LOAN_STORE):
+        self._store = store
+        self._db = None
+        self._ids = None
+
+    def open(self):
+        self._db = LOAN_STORES[self._store]()
+        # Монотонний лічильник id: next() атомарний, id не повторюються й не залежать від кількості записів
+        last_id = self._db.get(len(self._db) - 1)["id"] if len(self._db) else 0
+        self._ids = itertools.count(last_id + 1)
 
     def save(self, data: dict):
-        data["id"] = len(self._db) + 1
+        data["id"] = next(self._ids)
         data["status"] = "active"
         self._db.append(data)
         return data
 
+    def save_many(self, rows: list):
+        # Одна вставка (для SQLite — одна транзакція) на всю пачку
+        for data in rows:
+            data["id"] = next(self._ids)
+            data["status"] = "active"
+        self._db.append_many(rows)
+        return rows
+
     def get_by_id(self, lid: int):
-        return next((l for l in self._db if l["id"] == lid), None)
+        position = self._db.position(lid)
+        return None if position is None else self._db.get(position)
 
     def get_by_reader(self, rid: int):
-        return [l for l in self._db if l["readerId"] == rid]
+        return self._db.find(readerId=rid)
+
+    def get_all(self):
+        return self._db.rows()
 
     def get_all_active(self):
-        return [l for l in self._db if l["status"] == "active"]
+        return self._db.find(status="active")
+
+    def get_active_by_books(self, book_ids: list) -> list:
+        """Книги зі списку, які вже видані за нашими записами."""
+        return [b for b in book_ids if self._db.find(bookId=b, status="active")]
+
+    def positions(self, start: int = 0, status: Optional[str] = None, reader_id: Optional[int] = None):
+        """Позиції видач із потрібним статусом і читачем (None — без фільтра), починаючи зі start."""
+        equals = {"status": status, "readerId": reader_id}
+        return self._db.positions(start, **{c: v for c, v in equals.items() if v is not None})
+
+    def set_status(self, lid: int, status: str):
+        position = self._db.position(lid)
+        return None if position is None else self._db.update(position, {"status": status})
+
+    def set_status_many(self, lids: list, status: str):
+        self._db.update_many((self._db.position(lid), {"status": status}) for lid in lids)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
 
 repo = LoanRepository()
 
+# Політика балансування для кожного сервісу, який викликає оркестратор
+balancer = LoadBalancer({"catalog": "ewma", "readers": "p2c"})
+# Circuit breaker на кожен інстанс, повтори GET у межах бюджету, hedging після p95
+upstream = UpstreamCaller(balancer, BreakerRegistry(), hedge_percentiles={"catalog": 95, "readers": 95})
+# Локальне дзеркало реєстру: склад readers/catalog оновлюється через long-poll /watch
+watcher = RegistryWatcher(DISCOVERY_URL)
+
+class ReaderStatusCache:
+    """
+    Локальний кеш статусів читачів, що тримається актуальним через ленту /readers/changes.
+    Промах заповнюється віддаленим запитом (fetch) — далі статус змінюється лише подіями ленти.
+    Поки лента недоступна, кеш не відповідає: перевірка йде віддалено, як раніше.
+    Лента Reader Service — у пам'яті кожного процесу й бачить лише зміни через нього, тому кеш
+    працює тільки з одним записувачем: поки в реєстрі не рівно один інстанс Readers, кеш вимкнено.
+    """
+    def __init__(self, max_size: int = READER_CACHE_SIZE, feed_timeout: float = FEED_TIMEOUT):
+        self._max_size = max_size
+        self._feed_timeout = feed_timeout
+        self._status: "OrderedDict[int, str]" = OrderedDict()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._instance: Optional[dict] = None
+        self.epoch: Optional[str] = None
+        self.revision: Optional[int] = None
+        self.connected = False
+        # Збільшується при кожному скиданні: запит, розпочатий до скидання, не кладе в кеш старе значення
+        self._generation = 0
+        self._counters = {"hits": 0, "misses": 0, "changes": 0, "resets": 0, "errors": 0}
+
+    def start(self, client: httpx.AsyncClient):
+        """Лента читається через переданий (спільний) клієнт."""
+        self._client = client
+        self._task = asyncio.create_task(self._feed_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    @staticmethod
+    def _writer() -> Optional[dict]:
+        """Єдиний зареєстрований інстанс Reader Service; None, якщо їх нема або кілька."""
+        watched = watcher.get("readers")
+        if watched is None or len(watched.instances) != 1:
+            return None
+        return watched.instances[0]
+
+    def _valid(self) -> bool:
+        if not self.connected:
+            return False
+        if self._writer() == self._instance:
+            return True
+        # Склад Readers змінився: зміни через інші інстанси ця лента не покаже
+        self._disconnect()
+        return False
+
+    def get(self, r_id: int) -> Optional[str]:
+        if not self._valid():
+            return None
+        status = self._status.get(r_id)
+        if status is None:
+            self._counters["misses"] += 1
+            return None
+        self._status.move_to_end(r_id)
+        self._counters["hits"] += 1
+        return status
+
+    def _put(self, r_id: int, status: str):
+        self._status[r_id] = status
+        self._status.move_to_end(r_id)
+        while len(self._status) > self._max_size:
+            self._status.popitem(last=False)
+
+    async def lookup(self, r_id: int, fetch: Callable[[int], Awaitable[Optional[str]]]) -> Optional[str]:
+        """Статус з кешу або через fetch (None — читача немає); результат fetch кешується."""
+        status = self.get(r_id)
+        if status is not None:
+            return status
+        generation = self._generation
+        status = await fetch(r_id)
+        # Подія ленти, що прийшла під час запиту, новіша за відповідь fetch
+        if status is not None and self._valid() and generation == self._generation and r_id not in self._status:
+            self._put(r_id, status)
+        return status
+
+    def _reset(self):
+        self._status.clear()
+        self._generation += 1
+
+    def _disconnect(self):
+        if self.connected:
+            self._reset()
+        self.connected = False
+        self._instance = None
+        self.revision = None
+
+    def apply(self, data: dict):
+        if data["reset"]:
+            self._reset()
+            self._counters["resets"] += 1
+        for change in data["changes"]:
+            self._put(change["id"], change["status"])
+        self._counters["changes"] += len(data["changes"])
+        self.epoch, self.revision = data["epoch"], data["revision"]
+        self.connected = True
+
+    async def _poll(self):
+        await watcher.ensure("readers")
+        instance = self._writer()
+        if instance is None:
+            raise LookupError("Кеш статусів потребує рівно одного інстансу Reader Service")
+        if instance != self._instance:
+            self._disconnect()
+            self._instance = instance
+        params = {"timeout": self._feed_timeout}
+        if self.revision is not None:
+            params.update(epoch=self.epoch, since=self.revision)
+        resp = await self._client.get(
+            f"http://{instance['host']}:{instance['port']}/readers/changes", params=params,
+            timeout=httpx.Timeout(5.0, read=self._feed_timeout + FEED_READ_MARGIN))
+        resp.raise_for_status()
+        # За час long-poll склад міг змінитися: відповідь старого записувача не застосовується
+        if self._writer() != instance or self._instance != instance:
+            raise LookupError("Склад Reader Service змінився під час читання ленти")
+        self.apply(resp.json())
+
+    async def _feed_loop(self):
+        while True:
+            try:
+                await self._poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Пропущені події не відновити: кеш скидається, до відновлення ленти — віддалені перевірки
+                self._disconnect()
+                self._counters["errors"] += 1
+                await asyncio.sleep(FEED_RETRY_DELAY * random.uniform(0.5, 1.5))
+
+    def stats(self) -> dict:
+        return {"connected": self.connected, "epoch": self.epoch, "revision": self.revision,
+                "entries": len(self._status), **self._counters}
+
+reader_cache = ReaderStatusCache()
+
+class ServicePool:
+    """Довгоживучий httpx-клієнт до Catalog і Readers: відкривається й закривається в lifespan."""
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def open(self):
+        self._client = httpx.AsyncClient(limits=POOL_LIMITS,
+                                         timeout=httpx.Timeout(CALL_TIMEOUT, connect=CONNECT_TIMEOUT))
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise HTTPException(status_code=503, detail="Loan Service ще не запущено")
+        return self._client
+
+pool = ServicePool()
+
+class Deadline:
+    """Залишок часу на всю оркестрацію: жоден виклик не чекає довше, ніж лишилося запиту."""
+    def __init__(self, seconds: float = REQUEST_DEADLINE):
+        self._expires = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        left = self._expires - time.monotonic()
+        if left <= 0:
+            raise HTTPException(status_code=504, detail="Перевищено час обробки запиту")
+        return left
+
+    def call_timeout(self) -> httpx.Timeout:
+        """
+        Таймаут однієї спроби; не кидає 504 — спроба виконується всередині UpstreamCaller,
+        і вичерпаний deadline не повинен рахуватися збоєм інстансу. Коли межа — сам deadline,
+        спроба отримує трохи більше залишку, щоб її скасував загальний wait_for.
+        """
+        left = min(max(self._expires - time.monotonic(), 0.0) + DEADLINE_GRACE, CALL_TIMEOUT)
+        return httpx.Timeout(left, connect=min(left, CONNECT_TIMEOUT))
+
+async def gather_or_cancel(*aws):
+    """Як asyncio.gather, але перша помилка скасовує решту викликів."""
+    tasks = [asyncio.ensure_future(a) for a in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
 # --- 3. ШАР SERVICE (Динамічне виявлення та Логіка) ---
 class LoanBusinessService:
     @staticmethod
-    async def get_service_url(logic_name: str):
+    async def get_service_instances(logic_name: str) -> list:
         """
         Реалізація критерію 'Рефакторинг виклику': 
-        отримання адреси за логічним ім'ям через Discovery.
+        отримання адреси за логічним ім'ям через Discovery (з локального дзеркала реєстру).
         """
-        async with httpx.AsyncClient() as client:
-            try:
-                resp = await client.get(f"{DISCOVERY_URL}/services/{logic_name}")
-                instances = resp.json()
-                if not instances:
-                    raise HTTPException(status_code=503, detail=f"Сервіс {logic_name} не знайдено в реєстрі")
-                
-                # Балансування навантаження на стороні клієнта 
-                instance = random.choice(instances)
-                return f"http://{instance['host']}:{instance['port']}"
-            except Exception as e:
-                if isinstance(e, HTTPException): raise e
-                raise HTTPException(status_code=503, detail="Discovery Service недоступний")
+        try:
+            watched = await watcher.ensure(logic_name)
+        except Exception:
+            raise HTTPException(status_code=503, detail="Discovery Service недоступний")
+        if not watched.instances:
+            raise HTTPException(status_code=503, detail=f"Сервіс {logic_name} не знайдено в реєстрі")
+        # Вибір інстансу (балансування, circuit breaker) — у call_service
+        return watched.instances
+
+    @staticmethod
+    async def call_service(logic_name: str, method: str, path: str, deadline: Optional[Deadline] = None,
+                           idempotent: bool = False, **kwargs) -> httpx.Response:
+        """
+        Виклик сервісу за логічним ім'ям через спільний пул: балансування, circuit breaker,
+        повтори та hedging GET (і запитів, позначених idempotent). Кожна спроба і весь виклик
+        разом укладаються в deadline.
+        """
+        deadline = deadline or Deadline()
+        instances = await LoanBusinessService.get_service_instances(logic_name)
+        client = pool.client
+
+        async def send(instance: dict) -> httpx.Response:
+            return await client.request(method, f"http://{instance['host']}:{instance['port']}{path}",
+                                        timeout=deadline.call_timeout(), **kwargs)
+
+        # Deadline перевіряється до виклику: вичерпаний запит не доходить до breaker і балансувальника
+        remaining = deadline.remaining()
+        try:
+            return await asyncio.wait_for(upstream.call(logic_name, instances, send,
+                                                        idempotent=idempotent or method == "GET"),
+                                          remaining)
+        except (asyncio.TimeoutError, httpx.TimeoutException):
+            raise HTTPException(status_code=504, detail=f"Сервіс {logic_name} не відповів вчасно")
+        except httpx.HTTPError:
+            raise HTTPException(status_code=503, detail=f"Сервіс {logic_name} недоступний")
+
+    @staticmethod
+    async def fetch_reader_status(reader_id: int, deadline: Optional[Deadline] = None) -> Optional[str]:
+        r_resp = await LoanBusinessService.call_service("readers", "GET", f"/readers/{reader_id}", deadline)
+        return r_resp.json()["status"] if r_resp.status_code == 200 else None
+
+    @staticmethod
+    async def reserve_books(book_ids: List[int], deadline: Deadline) -> Optional[str]:
+        """
+        Атомарна резервація книг у каталозі (compare-and-set: лише якщо всі доступні) з TTL.
+        Повертає id резервації; недоступні книги -> 400, збій каталогу -> 503.
+        """
+        # Книги з активною видачею за нашими записами відхиляються індексом, без запиту до каталогу
+        loaned = repo.get_active_by_books(book_ids)
+        if loaned:
+            raise HTTPException(status_code=400, detail={"message": "Книги недоступні", "bookIds": loaned})
+        resp = await LoanBusinessService.call_service("catalog", "POST", "/catalog/reservations", deadline,
+                                                      json={"ids": book_ids, "ttl": RESERVATION_TTL})
+        if resp.status_code == 201:
+            return resp.json()["reservation_id"]
+        if resp.status_code in (404, 409):
+            detail = resp.json()["detail"]
+            raise HTTPException(status_code=400, detail={"message": "Книги недоступні",
+                                                         "bookIds": detail.get("ids") or detail.get("not_found")})
+        raise HTTPException(status_code=503, detail="Каталог не зарезервував книги")
+
+    @staticmethod
+    async def check_and_reserve(check: Awaitable, book_ids: List[int], deadline: Deadline):
+        """
+        Перевірка читачів і резервація книг одночасно: (результат check, id резервації).
+        Якщо перевірка впала вже після успішної резервації, резервація знімається одразу, а не через TTL.
+        """
+        reservation = asyncio.ensure_future(LoanBusinessService.reserve_books(book_ids, deadline))
+        try:
+            return await gather_or_cancel(check, reservation)
+        except BaseException:
+            if reservation.done() and not reservation.cancelled() and reservation.exception() is None:
+                await LoanBusinessService.release_reservation(reservation.result())
+            raise
+
+    @staticmethod
+    async def release_reservation(reservation_id: str):
+        """
+        Скасування резервації, зокрема вже підтвердженої (каталог відкочує підтвердження).
+        Якщо каталог недоступний, непідтверджені книги звільнить TTL.
+        """
+        try:
+            # Повтор безпечний: повторне скасування лише отримає 404
+            await LoanBusinessService.call_service("catalog", "DELETE", f"/catalog/reservations/{reservation_id}",
+                                                   idempotent=True)
+        except HTTPException:
+            pass
+
+    @staticmethod
+    async def commit_loans(rows: list, reservation_id: str, deadline: Deadline) -> list:
+        """
+        Видачі записуються, потім резервація підтверджується; якщо не вийшло — видачі скасовуються.
+        Confirm у каталозі ідемпотентний, тож після таймауту чи збою він повторюється в межах deadline.
+        Якщо відповіді так і немає, підтвердження могло відбутися: скасування резервації його відкотить.
+        """
+        try:
+            deadline.remaining()
+        except HTTPException:
+            await LoanBusinessService.release_reservation(reservation_id)
+            raise
+        loans = repo.save_many(rows)
+        try:
+            resp = await LoanBusinessService.call_service(
+                "catalog", "POST", f"/catalog/reservations/{reservation_id}/confirm", deadline, idempotent=True)
+            if resp.status_code == 200:
+                error = None
+            elif resp.status_code == 404:
+                error = HTTPException(status_code=409, detail="Резервацію книги прострочено, видачу скасовано")
+            else:
+                error = HTTPException(status_code=503, detail="Каталог не підтвердив резервацію, видачу скасовано")
+        except HTTPException as e:
+            error = e
+        if error is not None:
+            repo.set_status_many([l["id"] for l in loans], "cancelled")
+            await LoanBusinessService.release_reservation(reservation_id)
+            raise error
+        return loans
 
     @staticmethod
     async def issue_book(dto: LoanCreateDTO):
         """9. [Loan] Оформити видачу книги (Оркестрація)"""
-        
-        # 1. Знаходимо Reader Service динамічно
-        reader_api = await LoanBusinessService.get_service_url("readers")
-        r_resp = requests.get(f"{reader_api}/readers/{dto.readerId}")
-        
-        if r_resp.status_code != 200 or r_resp.json()["status"] != "active":
+        deadline = Deadline()
+
+        # 1-2. Перевірка читача (з локального кешу, при промаху — віддалено) і резервація книги — одночасно.
+        # Резервація — compare-and-set у каталозі: з двох одночасних видач однієї книги пройде лише одна
+        status, reservation_id = await LoanBusinessService.check_and_reserve(
+            reader_cache.lookup(dto.readerId, lambda r_id: LoanBusinessService.fetch_reader_status(r_id, deadline)),
+            [dto.bookId], deadline)
+
+        if status != "active":
+            await LoanBusinessService.release_reservation(reservation_id)
             raise HTTPException(status_code=400, detail="Читач заблокований або не існує")
 
-        # 2. Знаходимо Catalog Service динамічно
-        catalog_api = await LoanBusinessService.get_service_url("catalog")
-        b_resp = requests.get(f"{catalog_api}/catalog/books/{dto.bookId}")
-        
-        if b_resp.status_code != 200 or not b_resp.json()["available"]:
-            raise HTTPException(status_code=400, detail="Книга недоступна")
-
-        # 3. Реєстрація видачі
-        loan = repo.save(dto.dict())
-        
-        # 4. Оновлення статусу книги в каталозі
-        requests.put(f"{catalog_api}/catalog/books/{dto.bookId}/status", params={"available": False})
-        
-        return loan
+        # 3. Реєстрація видачі і 4. підтвердження резервації в каталозі
+        loans = await LoanBusinessService.commit_loans([dto.dict()], reservation_id, deadline)
+        return loans[0]
+
+    @staticmethod
+    async def free_books(book_ids: List[int], deadline: Deadline):
+        """
+        Книги знову доступні в каталозі (усі або жодної). Викликається до закриття видач:
+        якщо каталог не відповів, видачі лишаються активними і повернення можна повторити.
+        PUT ідемпотентний, тож після збою повторюється в межах deadline.
+        """
+        resp = await LoanBusinessService.call_service(
+            "catalog", "PUT", "/catalog/books/status", deadline, idempotent=True,
+            json={"updates": [{"id": b_id, "available": True} for b_id in book_ids]})
+        if resp.status_code != 200:
+            raise HTTPException(status_code=503, detail="Каталог не звільнив книги, видачу не закрито")
+
+    @staticmethod
+    async def return_book(loan_id: int):
+        """10. [Loan] Повернути книгу"""
+        loan = repo.get_by_id(loan_id)
+        if not loan or loan["status"] != "active":
+            raise HTTPException(status_code=404, detail="Активний запис не знайдено")
+
+        await LoanBusinessService.free_books([loan["bookId"]], Deadline())
+        repo.set_status(loan_id, "returned")
+        return {"message": "Книгу успішно повернуто"}
+
+    @staticmethod
+    def check_batch_size(size: int):
+        if not 1 <= size <= MAX_BATCH_LOANS:
+            raise HTTPException(status_code=400, detail=f"У пакеті має бути від 1 до {MAX_BATCH_LOANS} видач")
+
+    @staticmethod
+    async def issue_books(dto: LoanBatchCreateDTO):
+        """Пакетна видача: книги резервуються одним запитом і підтверджуються одним запитом (усі або жодної)"""
+        LoanBusinessService.check_batch_size(len(dto.loans))
+        book_ids = [l.bookId for l in dto.loans]
+        if len(set(book_ids)) != len(book_ids):
+            raise HTTPException(status_code=400, detail="Одна книга двічі в пакеті")
+
+        deadline = Deadline()
+
+        # 1. Читачі — з локального кешу; промахи — одним запитом до Reader Service
+        async def reader_statuses() -> dict:
+            statuses = {r: reader_cache.get(r) for r in dict.fromkeys(l.readerId for l in dto.loans)}
+            missing = [r for r, status in statuses.items() if status is None]
+            if missing:
+                r_resp = await LoanBusinessService.call_service("readers", "POST", "/readers/batch-get", deadline,
+                                                                json={"ids": missing})
+                if r_resp.status_code != 200:
+                    raise HTTPException(status_code=503, detail="Reader Service не повернув читачів")
+                readers = r_resp.json()["readers"]
+                statuses.update({r: readers.get(str(r), {}).get("status") for r in missing})
+            return statuses
+
+        # 2. Усі книги — однією атомарною резервацією, одночасно з перевіркою читачів
+        statuses, reservation_id = await LoanBusinessService.check_and_reserve(reader_statuses(), book_ids, deadline)
+        inactive = [r for r, status in statuses.items() if status != "active"]
+        if inactive:
+            await LoanBusinessService.release_reservation(reservation_id)
+            raise HTTPException(status_code=400, detail={"message": "Читачі заблоковані або не існують",
+                                                         "readerIds": inactive})
+
+        # 3. Реєстрація видач і 4. підтвердження резервації одним запитом
+        return await LoanBusinessService.commit_loans([l.dict() for l in dto.loans], reservation_id, deadline)
+
+    @staticmethod
+    async def return_books(dto: LoanBatchReturnDTO):
+        """Пакетне повернення: усі видачі мають бути активними; книги звільняються одним PUT"""
+        LoanBusinessService.check_batch_size(len(dto.ids))
+        ids = list(dict.fromkeys(dto.ids))
+        loans = [repo.get_by_id(lid) for lid in ids]
+        inactive = [lid for lid, loan in zip(ids, loans) if not loan or loan["status"] != "active"]
+        if inactive:
+            raise HTTPException(status_code=404, detail={"message": "Активні записи не знайдено", "ids": inactive})
+        await LoanBusinessService.free_books([l["bookId"] for l in loans], Deadline())
+        repo.set_status_many(ids, "returned")
+        return {"message": f"Повернуто книг: {len(ids)}"}
 
 # --- 4. ІНФРАСТРУКТУРНА ЛОГІКА (Discovery & Heartbeat) ---
-async def send_heartbeat():
-    while True:
-        async with httpx.AsyncClient() as client:
-            try:
-                await client.post(f"{DISCOVERY_URL}/heartbeat/{SERVICE_NAME}", 
-                                 params={"host": SERVICE_HOST, "port": SERVICE_PORT})
-            except Exception: pass
-        await asyncio.sleep(10)
+# Реєстрація під lease; heartbeat пакетний, через спільний пул з'єднань і з джитером
+agent = DiscoveryAgent(DISCOVERY_URL)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Реєстрація при запуску
-    async with httpx.AsyncClient() as client:
-        try:
-            await client.post(f"{DISCOVERY_URL}/register", 
-                             params={"name": SERVICE_NAME, "host": SERVICE_HOST, "port": SERVICE_PORT})
-            print(f"[{SERVICE_NAME}] Успішно зареєстровано")
-        except Exception as e:
-            print(f"[{SERVICE_NAME}] Помилка реєстрації: {e}")
-    
-    heartbeat_task = asyncio.create_task(send_heartbeat())
+    repo.open()
+    # Реєстрація при запуску; watcher ходить у Discovery через той самий пул
+    await agent.start([(SERVICE_NAME, SERVICE_HOST, SERVICE_PORT)])
+    watcher.open(agent.client)
+    pool.open()
+    reader_cache.start(pool.client)
     yield
-    heartbeat_task.cancel()
+    await reader_cache.stop()
+    await pool.aclose()
+    await watcher.aclose()
+    await agent.stop()
+    repo.close()
 
 app = FastAPI(title="Loan Microservice (PZ4 Orchestrator)", lifespan=lifespan)
 
@@ -128,17 +581,25 @@ app = FastAPI(title="Loan Microservice (PZ4 Orchestrator)", lifespan=lifespan)
 async def create_loan(dto: LoanCreateDTO):
     return await LoanBusinessService.issue_book(dto)
 
+@app.post("/loans/batch", status_code=201)
+async def create_loans(dto: LoanBatchCreateDTO):
+    """[Loan] Видати кілька книг разом"""
+    return await LoanBusinessService.issue_books(dto)
+
+@app.put("/loans/return")
+async def return_books(dto: LoanBatchReturnDTO):
+    """[Loan] Повернути кілька книг разом"""
+    return await LoanBusinessService.return_books(dto)
+
 @app.put("/loans/{id}/return")
 async def return_book(id: int):
     """10. [Loan] Повернути книгу"""
-    loan = repo.get_by_id(id)
-    if not loan or loan["status"] == "returned":
-        raise HTTPException(status_code=404, detail="Активний запис не знайдено")
-    
-    catalog_api = await LoanBusinessService.get_service_url("catalog")
-    loan["status"] = "returned"
-    requests.put(f"{catalog_api}/catalog/books/{loan['bookId']}/status", params={"available": True})
-    return {"message": "Книгу успішно повернуто"}
+    return await LoanBusinessService.return_book(id)
+
+@app.get("/loans/reader-cache")
+def reader_cache_stats():
+    """Стан локального кешу статусів читачів (лента змін Reader Service)"""
+    return reader_cache.stats()
 
 @app.get("/loans/history/{reader_id}")
 def get_history(reader_id: int):
@@ -146,9 +607,13 @@ def get_history(reader_id: int):
     return repo.get_by_reader(reader_id)
 
 @app.get("/loans/active")
-def get_active():
-    """12. [Loan] Список книг на руках"""
-    return repo.get_all_active()
+def get_active(request: Request, after: Optional[str] = None, limit: Optional[int] = None,
+               fields: Optional[str] = None, reader_id: Optional[int] = None):
+    """12. [Loan] Список книг на руках (сторінками: after + limit, курсор — у X-Next-Cursor)"""
+    selected = parse_fields(fields, LOAN_FIELDS)
+    page, next_cursor = paginate(repo.get_all(), after, limit,
+                                 positions=lambda start: repo.positions(start, "active", reader_id))
+    return page_response(request, page, selected, next_cursor)
 
 if __name__ == "__main__":
     uvicorn.run(app, host=SERVICE_HOST, port=SERVICE_PORT)
\ No newline at end of file
@@ -0,0 +1,93 @@
+# ndjson.py
+"""
+Потоковий масовий імпорт та експорт у форматі NDJSON (один JSON-об'єкт на рядок).
+Імпорт читає тіло запиту частинами, валідує кожен рядок DTO і вставляє пачками —
+пам'ять не залежить від розміру файлу. Експорт віддає записи генератором, без побудови списку.
+"""
+import json
+from typing import AsyncIterator, Callable, Iterable, List, Sequence, Tuple, Type
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+IMPORT_BATCH_SIZE = 1000    # рядків на одну вставку в репозиторій
+MAX_REPORTED_ERRORS = 100   # скільки помилок по рядках повертати (решта лише рахується)
+EXPORT_CHUNK_ROWS = 500     # рядків в одному chunk відповіді
+
+
+async def read_lines(request: Request) -> AsyncIterator[Tuple[int, bytes]]:
+    """(номер рядка, рядок) з тіла запиту; порожні рядки пропускаються."""
+    tail = b""
+    line_no = 0
+    async for chunk in request.stream():
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        for line in lines:
+            line_no += 1
+            if line.strip():
+                yield line_no, line
+    if tail.strip():
+        yield line_no + 1, tail
+
+
+def _describe(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors())
+    return str(error)
+
+
+async def import_ndjson(request: Request, dto_cls: Type[BaseModel],
+                        insert_batch: Callable[[List[Tuple[int, dict]]], List[Tuple[int, str]]]) -> dict:
+    """
+    insert_batch отримує пачку [(номер рядка, дані DTO)] і повертає відхилені [(номер рядка, причина)].
+    Вставка (індекси, коміт SQLite під repo.lock) іде в пулі потоків, як і синхронні ендпоінти:
+    великий імпорт не зупиняє цикл подій для інших запитів.
+    Результат: {"imported", "failed", "errors": [{"line", "error"}]}.
+    """
+    result = {"imported": 0, "failed": 0, "errors": []}
+
+    def fail(line_no: int, reason: str):
+        result["failed"] += 1
+        if len(result["errors"]) < MAX_REPORTED_ERRORS:
+            result["errors"].append({"line": line_no, "error": reason})
+
+    async def flush(batch: List[Tuple[int, dict]]):
+        rejected = await run_in_threadpool(insert_batch, batch)
+        for line_no, reason in rejected:
+            fail(line_no, reason)
+        result["imported"] += len(batch) - len(rejected)
+
+    batch: List[Tuple[int, dict]] = []
+    async for line_no, line in read_lines(request):
+        try:
+            data = json.loads(line)
+            if not isinstance(data, dict):
+                raise ValueError("очікується JSON-об'єкт")
+            batch.append((line_no, dto_cls(**data).dict()))
+        except ValueError as e:
+            fail(line_no, _describe(e))
+            continue
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    result["errors"].sort(key=lambda e: e["line"])
+    return result
+
+
+def export_ndjson(rows: Iterable[dict], fields: Sequence[str]) -> StreamingResponse:
+    def generate():
+        chunk = []
+        for row in rows:
+            chunk.append(json.dumps({f: row.get(f) for f in fields}, ensure_ascii=False, separators=(",", ":")))
+            if len(chunk) >= EXPORT_CHUNK_ROWS:
+                yield ("\n".join(chunk) + "\n").encode("utf-8")
+                chunk = []
+        if chunk:
+            yield ("\n".join(chunk) + "\n").encode("utf-8")
+
+    return StreamingResponse(generate(), media_type=NDJSON_MEDIA_TYPE)
@@ -0,0 +1,77 @@
+# pagination.py
+"""
+Курсорна пагінація, проєкція полів і фільтри для списків мікросервісів.
+Тіло відповіді — як і раніше, JSON-список; курсор наступної сторінки — у заголовку X-Next-Cursor.
+Курсор кодує позицію останнього запису та його id: записи лише додаються в кінець,
+тому продовження сторінки — O(1) без повторного перегляду початку списку.
+"""
+import base64
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Request, Response
+
+from etag import etag_response
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(position: int, item_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{position}:{item_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        position, item_id = raw.split(":")
+        return int(position), int(item_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Недійсний курсор")
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> Sequence[str]:
+    """fields=id,title -> ("id", "title"); без параметра — усі поля DTO."""
+    if not fields:
+        return allowed
+    selected = tuple(f.strip() for f in fields.split(",") if f.strip())
+    unknown = [f for f in selected if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Невідомі поля: {', '.join(unknown)}")
+    return selected
+
+
+def paginate(rows: Sequence[dict], after: Optional[str], limit: Optional[int],
+             predicate: Optional[Callable[[dict], bool]] = None,
+             positions: Optional[Callable[[int], Iterable[int]]] = None) -> Tuple[list, Optional[str]]:
+    """
+    Сторінка з rows після курсора after; limit=None — усі записи до кінця (стара поведінка).
+    positions(start) — альтернатива predicate: позиції, що проходять фільтр (наприклад, з індексу).
+    """
+    start = 0
+    if after:
+        position, item_id = decode_cursor(after)
+        if not 0 <= position < len(rows) or rows[position]["id"] != item_id:
+            raise HTTPException(status_code=400, detail="Недійсний курсор")
+        start = position + 1
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit має бути від 1 до {MAX_PAGE_SIZE}")
+    page, last = [], -1
+    for i in (positions(start) if positions is not None else range(start, len(rows))):
+        if limit is not None and len(page) >= limit:
+            break
+        row = rows[i]
+        if predicate is None or predicate(row):
+            page.append(row)
+            last = i
+    next_cursor = encode_cursor(last, page[-1]["id"]) if limit is not None and len(page) == limit \
+        and last < len(rows) - 1 else None
+    return page, next_cursor
+
+
+def page_response(request: Request, page: List[dict], fields: Sequence[str],
+                  next_cursor: Optional[str]) -> Response:
+    """Проєкція полів без створення DTO на кожен рядок + ETag і курсор наступної сторінки."""
+    response = etag_response(request, [{f: row.get(f) for f in fields} for row in page])
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response
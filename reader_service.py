@@ -1,17 +1,36 @@
 # reader_service.py
-import httpx
-import asyncio
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from contextlib import asynccontextmanager
+from collections import deque
+from bisect import bisect_left, bisect_right
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import uuid
 import uvicorn
 
+from discovery_client import DiscoveryAgent
+from etag import etag_response
+from ndjson import export_ndjson, import_ndjson
+from pagination import page_response, paginate, parse_fields
+from record_store import MemoryStore, SqliteStore
+from text_search import tokenize
+
 # --- ИНФРАСТРУКТУРНЫЕ НАСТРОЙКИ (PZ4) ---
 SERVICE_NAME = "readers"
 SERVICE_HOST = "127.0.0.1"
 SERVICE_PORT = 8002
 DISCOVERY_URL = "http://127.0.0.1:8000"
+# Хранилище читателей: "memory" — список в памяти; "sqlite" — SQLite (WAL) на диске: читатели переживают
+# перезапуск, но префиксный индекс имён живёт в памяти и при старте строится проходом по всем читателям
+READER_STORE = "memory"
+READER_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reader_data", "readers.db")
+CHANGE_LOG_SIZE = 4096     # сколько последних смен статуса помнит лента изменений
+MAX_FEED_TIMEOUT = 60.0    # верхняя граница ожидания одного long-poll запроса (с)
 
 # --- 1. ШАР DTO (Data Transfer Objects) ---
 #  Использование DTO для передачи данных
@@ -24,34 +43,225 @@ class ReaderReadDTO(BaseModel):
     name: str
     status: str  # "active" или "blocked"
 
+READER_FIELDS = ("id", "name", "status")
+MAX_BATCH_IDS = 1000  # читателей в одном пакетном запросе
+
+class ReaderBatchGetDTO(BaseModel):
+    ids: List[int]
+
+class ReaderBatchReadDTO(BaseModel):
+    readers: Dict[int, ReaderReadDTO]
+    not_found: List[int]
+
 # --- 2. ШАР REPOSITORY (Data Layer) ---
 #  Изолированная база данных микросервиса
-class ReaderRepository:
+READER_STORES = {
+    "memory": MemoryStore,
+    "sqlite": lambda: SqliteStore(READER_DB_PATH, "readers", {"id": int, "name": str, "status": str},
+                                  indexes=[("status",)]),
+}
+
+MAX_MERGED_RUNS = 256  # разных слов под префиксом, которые ещё выгодно сливать лениво
+
+class NamePrefixIndex:
+    """
+    Префиксный индекс по словам имени: отсортированный массив (слово, позиция читателя).
+    Не потокобезопасен: владелец (ReaderRepository) вызывает его под своим замком.
+    Поиск префикса — два bisect, т.е. O(log n) + размер ответа.
+    Одиночная вставка — bisect + insert; пачки копятся отдельно и вливаются одной сортировкой перед поиском.
+    """
     def __init__(self):
-        self._db = [
-            {"id": 12, "name": "Артемій Василенко", "status": "active"},
-            {"id": 13, "name": "Владислав Богуславский", "status": "active"}
-        ]
+        self._words: List[str] = []
+        self._positions: List[int] = []
+        self._pending: List[Tuple[str, int]] = []
+
+    def add(self, position: int, name: str):
+        self._merge()
+        for word in set(tokenize(name)):
+            # Позиции только растут: новая встаёт после всех таких же слов
+            i = bisect_right(self._words, word)
+            self._words.insert(i, word)
+            self._positions.insert(i, position)
+
+    def add_many(self, items: Iterable[Tuple[int, str]]):
+        self._pending.extend((word, position) for position, name in items for word in set(tokenize(name)))
+
+    def _merge(self):
+        if not self._pending:
+            return
+        # Две отсортированные серии: timsort сливает их за линейное время
+        merged = sorted([*zip(self._words, self._positions), *self._pending])
+        self._words = [w for w, _ in merged]
+        self._positions = [p for _, p in merged]
+        self._pending = []
+
+    def _range(self, prefix: str) -> Tuple[int, int]:
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return bisect_left(self._words, prefix), bisect_left(self._words, upper)
+
+    def candidates(self, prefixes: List[str]) -> Iterator[int]:
+        """
+        Позиции читателей, у которых есть слово с самым редким из префиксов, по возрастанию.
+        Внутри одного слова позиции уже отсортированы: серии сливаются лениво, без сортировки всего диапазона.
+        """
+        self._merge()
+        lo, hi = min((self._range(p) for p in prefixes), key=lambda r: r[1] - r[0])
+        words, positions, runs = self._words, self._positions, []
+        start = lo
+        while lo < hi:
+            if len(runs) >= MAX_MERGED_RUNS:
+                # Короткий префикс с множеством разных слов: дешевле отсортировать диапазон целиком
+                yield from sorted(set(positions[start:hi]))
+                return
+            end = bisect_right(words, words[lo], lo, hi)
+            runs.append(map(positions.__getitem__, range(lo, end)))
+            lo = end
+        last = None
+        for position in heapq.merge(*runs):
+            if position != last:
+                yield position
+                last = position
+
+class ReaderRepository:
+    """
+    Читатели в порядке добавления (в хранилище READER_STORE); поиск по id — через индекс хранилища.
+    Префиксный индекс имён живёт в памяти: при старте строится одним проходом по хранилищу.
+    Эндпоинты работают в пуле потоков, поэтому запись в индекс и поиск по нему — под self.lock.
+    """
+    def __init__(self, store: str = READER_STORE):
+        self._db = READER_STORES[store]()
+        self.lock = threading.RLock()
+        self._names = NamePrefixIndex()
+        self._names.add_many(enumerate(r["name"] for r in self._db.rows()))
+        if not len(self._db):
+            self.add_many([
+                {"id": 12, "name": "Артемій Василенко", "status": "active"},
+                {"id": 13, "name": "Владислав Богуславский", "status": "active"}
+            ])
 
     def get_all(self):
-        return self._db
+        return self._db.rows()
 
     def get_by_id(self, r_id: int):
-        return next((r for r in self._db if r["id"] == r_id), None)
+        position = self._db.position(r_id)
+        return None if position is None else self._db.get(position)
+
+    def positions(self, start: int = 0, status: Optional[str] = None):
+        """Позиции читателей (при необходимости — только с нужным статусом), начиная со start."""
+        return self._db.positions(start) if status is None else self._db.positions(start, status=status)
+
+    def get_many(self, ids):
+        """{id: читатель} для найденных id и список отсутствующих."""
+        found, missing = {}, []
+        for r_id in dict.fromkeys(ids):
+            reader = self.get_by_id(r_id)
+            if reader is None:
+                missing.append(r_id)
+            else:
+                found[r_id] = reader
+        return found, missing
+
+    def search_by_name(self, query: str, limit: int):
+        """Читатели, у которых каждое слово запроса — начало какого-то слова имени (в порядке регистрации)."""
+        prefixes = tokenize(query)
+        if not prefixes:
+            return []
+        result = []
+        # candidates читает массивы индекса лениво: весь перебор — под замком
+        with self.lock:
+            for position in self._names.candidates(prefixes):
+                reader = self._db.get(position)
+                words = tokenize(reader["name"])
+                if all(any(w.startswith(p) for w in words) for p in prefixes):
+                    result.append(reader)
+                    if len(result) >= limit:
+                        break
+        return result
 
     def add(self, data: dict):
-        self._db.append(data)
+        with self.lock:
+            position = self._db.append(data)
+            self._names.add(position, data["name"])
         return data
 
+    def add_many(self, rows: list):
+        # Одна вставка (для SQLite — одна транзакция) на всю пачку
+        with self.lock:
+            positions = self._db.append_many(rows)
+            self._names.add_many(zip(positions, (r["name"] for r in rows)))
+        return rows
+
     def update_status_in_db(self, r_id: int, new_status: str):
-        reader = self.get_by_id(r_id)
-        if reader:
-            reader["status"] = new_status
-            return reader
-        return None
+        position = self._db.position(r_id)
+        if position is None:
+            return None
+        return self._db.update(position, {"status": new_status})
+
+    def close(self):
+        self._db.close()
 
 repo = ReaderRepository()
 
+class StatusChangeFeed:
+    """
+    Лента смен статуса читателей: (ревизия, id, статус), ревизии идут подряд.
+    Потребитель (кэш в Loan Service) читает её long-poll'ом с последней ревизии.
+    epoch меняется при каждом старте: ревизии разных запусков не сравниваются.
+    Запись идёт из пула потоков FastAPI, ожидающие long-poll — в цикле событий.
+    Лента живёт в памяти процесса и видит только смены, прошедшие через этот экземпляр:
+    при нескольких репликах Reader Service полной ленты нет, и кэш Loan Service её не использует.
+    """
+    def __init__(self, log_size: int = CHANGE_LOG_SIZE):
+        self.epoch = uuid.uuid4().hex[:12]
+        self.revision = 0
+        self._log: deque = deque(maxlen=log_size)
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._event: Optional[asyncio.Event] = None
+
+    def open(self):
+        self._loop = asyncio.get_running_loop()
+
+    def record(self, r_id: int, status: str):
+        with self._lock:
+            self.revision += 1
+            self._log.append((self.revision, r_id, status))
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        event, self._event = self._event, None
+        if event is not None:
+            event.set()
+
+    def changes_since(self, epoch: Optional[str], since: Optional[int]) -> Tuple[int, Optional[List[dict]]]:
+        """
+        (текущая ревизия, смены после since — последняя по каждому читателю).
+        None вместо смен — ревизия другого запуска или уже вытеснена из журнала: кэш потребителя надо сбросить.
+        """
+        with self._lock:
+            revision = self.revision
+            if epoch != self.epoch or since is None or since > revision:
+                return revision, None
+            first = self._log[0][0] if self._log else revision + 1
+            if since < first - 1:
+                return revision, None
+            # Журнал упорядочен по ревизиям: нужный хвост — последние revision - since записей
+            tail = itertools.islice(self._log, len(self._log) - (revision - since), None)
+            latest = {r_id: status for _, r_id, status in tail}
+        return revision, [{"id": r_id, "status": status} for r_id, status in latest.items()]
+
+    async def wait_for_change(self, timeout: float) -> bool:
+        if self._event is None:
+            self._event = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+feed = StatusChangeFeed()
+
 # --- 3. ШАР SERVICE (Business Logic Layer) ---
 class ReaderBusinessService:
     @staticmethod
@@ -63,51 +273,121 @@ class ReaderBusinessService:
 
     @staticmethod
     def register(dto: ReaderCreateDTO) -> ReaderReadDTO:
-        if repo.get_by_id(dto.id):
-            raise HTTPException(status_code=400, detail="ID уже зарегистрирован")
-        new_data = dto.dict()
-        new_data["status"] = "active"
-        return ReaderReadDTO(**repo.add(new_data))
+        # Проверка и вставка — одна критическая секция: иначе два одинаковых id пройдут проверку вместе
+        with repo.lock:
+            if repo.get_by_id(dto.id):
+                raise HTTPException(status_code=400, detail="ID уже зарегистрирован")
+            new_data = dto.dict()
+            new_data["status"] = "active"
+            return ReaderReadDTO(**repo.add(new_data))
+
+    @staticmethod
+    def change_status(r_id: int, status: str) -> ReaderReadDTO:
+        if status not in ["active", "blocked"]:
+            raise HTTPException(status_code=400, detail="Неверный статус")
+        # Чтение, запись и событие ленты — под одной блокировкой: иначе две параллельные смены
+        # могут попасть в ленту не в том порядке, в каком легли в хранилище
+        with repo.lock:
+            current = repo.get_by_id(r_id)
+            if not current:
+                raise HTTPException(status_code=404, detail="Читатель не найден")
+            if current["status"] == status:
+                return ReaderReadDTO(**current)
+            updated = repo.update_status_in_db(r_id, status)
+            feed.record(r_id, status)
+        return ReaderReadDTO(**updated)
+
+    @staticmethod
+    def get_many(dto: ReaderBatchGetDTO) -> dict:
+        if len(dto.ids) > MAX_BATCH_IDS:
+            raise HTTPException(status_code=400, detail=f"Не больше {MAX_BATCH_IDS} читателей в пакете")
+        found, missing = repo.get_many(dto.ids)
+        return {"readers": found, "not_found": missing}
+
+    @staticmethod
+    def import_batch(batch: list) -> list:
+        """Пачка строк импорта: занятые id отклоняются, остальные добавляются одним add_many."""
+        rejected, accepted, seen = [], [], set()
+        with repo.lock:
+            for line_no, reader in batch:
+                if reader["id"] in seen or repo.get_by_id(reader["id"]):
+                    rejected.append((line_no, "ID уже зарегистрирован"))
+                    continue
+                seen.add(reader["id"])
+                reader["status"] = "active"
+                accepted.append(reader)
+            repo.add_many(accepted)
+        return rejected
 
 # --- 4. ИНФРАСТРУКТУРНАЯ ЛОГИКА (Discovery & Heartbeat) ---
 #  Автоматизация конфигурации и Heartbeat
-async def send_heartbeat():
-    while True:
-        async with httpx.AsyncClient() as client:
-            try:
-                await client.post(f"{DISCOVERY_URL}/heartbeat/{SERVICE_NAME}", 
-                                 params={"host": SERVICE_HOST, "port": SERVICE_PORT})
-            except Exception:
-                pass
-        await asyncio.sleep(10)
+# Регистрация под lease; heartbeat пакетный, через общий пул соединений и с джиттером
+agent = DiscoveryAgent(DISCOVERY_URL)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    #  Автоматическая регистрация при запуске
-    async with httpx.AsyncClient() as client:
-        try:
-            await client.post(f"{DISCOVERY_URL}/register", 
-                             params={"name": SERVICE_NAME, "host": SERVICE_HOST, "port": SERVICE_PORT})
-            print(f"[{SERVICE_NAME}] Сервис успешно зарегистрирован в Discovery")
-        except Exception as e:
-            print(f"[{SERVICE_NAME}] Ошибка регистрации: {e}")
-    
-    heartbeat_task = asyncio.create_task(send_heartbeat())
+    #  Автоматическая регистрация при запуске и фоновый Heartbeat
+    await agent.start([(SERVICE_NAME, SERVICE_HOST, SERVICE_PORT)])
+    feed.open()
     yield
-    heartbeat_task.cancel()
+    await agent.stop()
+    repo.close()
 
 app = FastAPI(title="Reader Microservice (PZ4)", lifespan=lifespan)
 
 # --- 5. ШАР CONTROLLER (API Endpoints) ---
 @app.get("/readers", response_model=List[ReaderReadDTO])
-def list_readers():
-    """5. [Reader] Список всех читателей"""
-    return [ReaderReadDTO(**r) for r in repo.get_all()]
+def list_readers(request: Request, after: Optional[str] = None, limit: Optional[int] = None,
+                 fields: Optional[str] = None, status: Optional[str] = None):
+    """5. [Reader] Список всех читателей (страницами: after + limit, курсор — в X-Next-Cursor)"""
+    selected = parse_fields(fields, READER_FIELDS)
+    page, next_cursor = paginate(repo.get_all(), after, limit,
+                                 positions=lambda start: repo.positions(start, status))
+    return page_response(request, page, selected, next_cursor)
+
+# Маршруты /export и /import объявлены до /readers/{id}, чтобы не совпадать с ним
+@app.get("/readers/export")
+def export_readers(fields: Optional[str] = None):
+    """[Reader] Экспорт всех читателей потоком NDJSON"""
+    return export_ndjson(repo.get_all(), parse_fields(fields, READER_FIELDS))
+
+@app.post("/readers/import")
+async def import_readers(request: Request):
+    """[Reader] Массовый импорт читателей из NDJSON (строка на читателя), отчёт об ошибках по строкам"""
+    return await import_ndjson(request, ReaderCreateDTO, ReaderBusinessService.import_batch)
+
+# /changes, /search и /batch-get тоже объявлены до /readers/{id}
+@app.get("/readers/changes")
+async def reader_changes(since: Optional[int] = None, epoch: Optional[str] = None, timeout: float = 30.0):
+    """
+    [Reader] Long-poll ленты смен статуса.
+    Клиент передаёт epoch и revision из прошлого ответа как epoch и since; запрос ждёт до timeout секунд
+    и возвращает только смены после since. Без since (или если он устарел) — reset=true:
+    всё, что клиент закэшировал, надо забыть и начать с текущей ревизии.
+    """
+    revision, changes = feed.changes_since(epoch, since)
+    if changes == [] and timeout > 0:
+        if await feed.wait_for_change(min(timeout, MAX_FEED_TIMEOUT)):
+            revision, changes = feed.changes_since(epoch, since)
+    head = {"epoch": feed.epoch, "revision": revision}
+    if changes is None:
+        return {**head, "reset": True, "changes": []}
+    return {**head, "reset": False, "changes": changes}
+
+@app.get("/readers/search", response_model=List[ReaderReadDTO])
+def search_readers(request: Request, prefix: str, limit: int = Query(20, ge=1, le=100)):
+    """[Reader] Поиск по началу слов имени ("влад бог" -> "Владислав Богуславский")"""
+    return etag_response(request, [ReaderReadDTO(**r) for r in repo.search_by_name(prefix, limit)])
+
+@app.post("/readers/batch-get", response_model=ReaderBatchReadDTO)
+def batch_get_readers(dto: ReaderBatchGetDTO):
+    """[Reader] Несколько читателей одним запросом: {"ids": [...]} -> {"readers": {id: читатель}, "not_found": [...]}"""
+    return ReaderBusinessService.get_many(dto)
 
 @app.get("/readers/{id}", response_model=ReaderReadDTO)
-def get_reader_by_id(id: int):
+def get_reader_by_id(id: int, request: Request):
     """6. [Reader] Данные читателя по ID"""
-    return ReaderBusinessService.get_reader(id)
+    return etag_response(request, ReaderBusinessService.get_reader(id))
 
 @app.post("/readers", response_model=ReaderReadDTO)
 def register_reader(dto: ReaderCreateDTO):
@@ -117,13 +397,7 @@ def register_reader(dto: ReaderCreateDTO):
 @app.put("/readers/{id}/status", response_model=ReaderReadDTO)
 def update_status(id: int, status: str):
     """8. [Reader] Изменить статус читателя"""
-    if status not in ["active", "blocked"]:
-        raise HTTPException(status_code=400, detail="Неверный статус")
-    
-    updated = repo.update_status_in_db(id, status)
-    if not updated:
-        raise HTTPException(status_code=404, detail="Читатель не найден")
-    return ReaderReadDTO(**updated)
+    return ReaderBusinessService.change_status(id, status)
 
 if __name__ == "__main__":
     uvicorn.run(app, host=SERVICE_HOST, port=SERVICE_PORT)
\ No newline at end of file
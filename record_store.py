@@ -0,0 +1,276 @@
+# record_store.py
+"""
+Сховища записів для репозиторіїв мікросервісів (Catalog, Reader, Loan).
+Запис має позицію — порядковий номер у порядку додавання; за нею працюють курсори сторінок.
+  - MemoryStore — список dict у процесі, як і раніше: після перезапуску дані втрачаються;
+  - SqliteStore — вбудована SQLite у режимі WAL: дані переживають перезапуск, старт не
+    потребує завантаження всього набору, а читання йдуть через сторінковий кеш —
+    тож даних може бути більше, ніж пам'яті. Це так лише для репозиторію без власних індексів
+    у пам'яті (Loan): Catalog і Reader будують свої індекси при старті переглядом усіх записів.
+"""
+import itertools
+import os
+import sqlite3
+import threading
+from bisect import bisect_left, insort
+from collections.abc import Sequence
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+SCAN_CHUNK_ROWS = 1000          # рядків за один SELECT під час перегляду по порядку
+SQL_TYPES = {int: "INTEGER", str: "TEXT", bool: "INTEGER", float: "REAL"}
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # читачі не блокують запис, коміт — дописування в журнал
+    "PRAGMA synchronous=NORMAL",    # у WAL коміт не чекає fsync (лише контрольна точка)
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",     # 64 MiB сторінкового кешу
+    "PRAGMA mmap_size=268435456",   # 256 MiB файлу читаються через mmap
+)
+
+
+class RowsView(Sequence):
+    """Список записів сховища: елемент — dict, прочитаний за позицією."""
+
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self._store.get(i) for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        return self._store.get(position)
+
+
+class MemoryStore:
+    """
+    Список dict + хеш-індекс ключ -> позиція.
+    indexes — як у SqliteStore; для кожної згаданої колонки ведеться хеш-індекс
+    значення -> відсортований список позицій, що оновлюється в append та update.
+    """
+    def __init__(self, key: str = "id", indexes: Iterable[Tuple[str, ...]] = ()):
+        self._key = key
+        self._rows: List[dict] = []
+        self._pos: Dict[int, int] = {}
+        self._indexes: Dict[str, Dict[object, List[int]]] = {c: {} for index in indexes for c in index}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def append(self, row: dict) -> int:
+        position = self._pos[row[self._key]] = len(self._rows)
+        self._rows.append(row)
+        for column, index in self._indexes.items():
+            # Позиції лише зростають: список лишається відсортованим
+            index.setdefault(row[column], []).append(position)
+        return position
+
+    def append_many(self, rows: Iterable[dict]) -> List[int]:
+        return [self.append(row) for row in rows]
+
+    def position(self, key: int) -> Optional[int]:
+        return self._pos.get(key)
+
+    def get(self, position: int) -> dict:
+        return self._rows[position]
+
+    def update(self, position: int, changes: dict) -> dict:
+        row = self._rows[position]
+        for column, value in changes.items():
+            index = self._indexes.get(column)
+            if index is None or row[column] == value:
+                continue
+            bucket = index[row[column]]
+            del bucket[bisect_left(bucket, position)]
+            if not bucket:
+                del index[row[column]]
+            insort(index.setdefault(value, []), position)
+        row.update(changes)
+        return row
+
+    def update_many(self, updates: Iterable[Tuple[int, dict]]):
+        for position, changes in updates:
+            self.update(position, changes)
+
+    def rows(self) -> Sequence:
+        return self._rows
+
+    def positions(self, start: int = 0, **equals) -> Iterator[int]:
+        """Позиції з колонками, рівними equals: кандидати — з найменшого відповідного індексу."""
+        rows, conditions = self._rows, tuple(equals.items())
+        buckets = [self._indexes[c].get(v, []) for c, v in conditions if c in self._indexes]
+        if buckets:
+            bucket = min(buckets, key=len)
+            candidates = itertools.islice(bucket, bisect_left(bucket, start), None)
+        else:
+            candidates = range(start, len(rows))
+        return (i for i in candidates if all(rows[i][c] == v for c, v in conditions))
+
+    def find(self, **equals) -> List[dict]:
+        return [self._rows[i] for i in self.positions(0, **equals)]
+
+    def close(self):
+        pass
+
+
+class _SqliteRows(RowsView):
+    def __iter__(self):
+        return self._store.scan()
+
+
+class SqliteStore:
+    """
+    Таблиця (pos INTEGER PRIMARY KEY, колонки...) з унікальним індексом за ключем і вторинними індексами.
+    pos — це rowid: запис за позицією та перегляд по порядку — пошук у B-дереві без сортування,
+    а вторинний індекс (колонка, rowid) одразу віддає позиції фільтра в порядку додавання.
+    Кожен виклик запису — одна транзакція; append_many пише всю пачку одним комітом.
+    Тексти запитів складаються один раз, тож sqlite3 бере підготовлені statement з кешу з'єднання.
+    """
+
+    def __init__(self, path: str, table: str, columns: Dict[str, type], key: str = "id",
+                 indexes: Iterable[Tuple[str, ...]] = ()):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._table = table
+        self._columns = tuple(columns)
+        self._bools = tuple(c for c, t in columns.items() if t is bool)
+        # Синхронні ендпоінти FastAPI виконуються в пулі потоків: одне з'єднання під замком
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        for pragma in PRAGMAS:
+            self._conn.execute(pragma)
+        definitions = ", ".join(f"{c} {SQL_TYPES[t]}" for c, t in columns.items())
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (pos INTEGER PRIMARY KEY, {definitions})")
+        self._conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_{key} ON {table} ({key})")
+        for index in indexes:
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_{'_'.join(index)} ON {table} ({', '.join(index)})")
+        selected = ", ".join(self._columns)
+        self._sql_insert = f"INSERT INTO {table} (pos, {selected}) VALUES (?{', ?' * len(self._columns)})"
+        self._sql_get = f"SELECT {selected} FROM {table} WHERE pos = ?"
+        self._sql_position = f"SELECT pos FROM {table} WHERE {key} = ?"
+        self._sql_scan = f"SELECT pos, {selected} FROM {table} WHERE pos >= ? ORDER BY pos LIMIT {SCAN_CHUNK_ROWS}"
+        self._sql_update: Dict[Tuple[str, ...], str] = {}
+        self._count = self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _row(self, values) -> dict:
+        row = dict(zip(self._columns, values))
+        for column in self._bools:
+            if row[column] is not None:
+                row[column] = bool(row[column])
+        return row
+
+    def _where(self, equals: dict) -> str:
+        unknown = [c for c in equals if c not in self._columns]
+        if unknown:
+            raise KeyError(f"Невідомі колонки: {', '.join(unknown)}")
+        return "".join(f" AND {c} = ?" for c in equals)
+
+    def _transaction(self, sql: str, params: List[tuple], *more: Tuple[str, List[tuple]]):
+        # Викликається під self._lock; кілька (sql, params) — одна транзакція
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany(sql, params)
+            for sql, params in more:
+                self._conn.executemany(sql, params)
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def append(self, row: dict) -> int:
+        return self.append_many([row])[0]
+
+    def append_many(self, rows: Iterable[dict]) -> List[int]:
+        rows = list(rows)
+        with self._lock:
+            start = self._count
+            self._transaction(self._sql_insert, [(start + i, *(row.get(c) for c in self._columns))
+                                                 for i, row in enumerate(rows)])
+            self._count += len(rows)
+        return list(range(start, start + len(rows)))
+
+    def position(self, key: int) -> Optional[int]:
+        with self._lock:
+            found = self._conn.execute(self._sql_position, (key,)).fetchone()
+        return None if found is None else found[0]
+
+    def get(self, position: int) -> dict:
+        with self._lock:
+            values = self._conn.execute(self._sql_get, (position,)).fetchone()
+        if values is None:
+            raise IndexError(position)
+        return self._row(values)
+
+    def _update_sql(self, columns: Tuple[str, ...]) -> str:
+        sql = self._sql_update.get(columns)
+        if sql is None:
+            self._where(dict.fromkeys(columns))
+            assignments = ", ".join(f"{c} = ?" for c in columns)
+            sql = self._sql_update[columns] = f"UPDATE {self._table} SET {assignments} WHERE pos = ?"
+        return sql
+
+    def update(self, position: int, changes: dict) -> dict:
+        self.update_many([(position, changes)])
+        return self.get(position)
+
+    def update_many(self, updates: Iterable[Tuple[int, dict]]):
+        """Усі зміни — однією транзакцією: або застосовано все, або нічого."""
+        grouped: Dict[Tuple[str, ...], List[tuple]] = {}
+        for position, changes in updates:
+            grouped.setdefault(tuple(changes), []).append((*changes.values(), position))
+        statements = [(self._update_sql(columns), params) for columns, params in grouped.items()]
+        if not statements:
+            return
+        with self._lock:
+            self._transaction(*statements[0], *statements[1:])
+
+    def rows(self) -> Sequence:
+        return _SqliteRows(self)
+
+    def scan(self) -> Iterator[dict]:
+        """Усі записи по порядку — пачками по SCAN_CHUNK_ROWS, без утримання курсора між пачками."""
+        start = 0
+        while True:
+            with self._lock:
+                chunk = self._conn.execute(self._sql_scan, (start,)).fetchall()
+            for values in chunk:
+                yield self._row(values[1:])
+            if len(chunk) < SCAN_CHUNK_ROWS:
+                return
+            start = chunk[-1][0] + 1
+
+    def positions(self, start: int = 0, **equals) -> Iterator[int]:
+        """Позиції записів з колонками, рівними equals, починаючи зі start (через вторинний індекс)."""
+        sql = (f"SELECT pos FROM {self._table} WHERE pos >= ?{self._where(equals)} "
+               f"ORDER BY pos LIMIT {SCAN_CHUNK_ROWS}")
+        values = tuple(equals.values())
+
+        def generate(start: int):
+            while True:
+                with self._lock:
+                    chunk = self._conn.execute(sql, (start, *values)).fetchall()
+                for (position,) in chunk:
+                    yield position
+                if len(chunk) < SCAN_CHUNK_ROWS:
+                    return
+                start = chunk[-1][0] + 1
+
+        return generate(start)
+
+    def find(self, **equals) -> List[dict]:
+        sql = f"SELECT {', '.join(self._columns)} FROM {self._table} WHERE 1{self._where(equals)} ORDER BY pos"
+        with self._lock:
+            return [self._row(values) for values in self._conn.execute(sql, tuple(equals.values())).fetchall()]
+
+    def close(self):
+        with self._lock:
+            self._conn.execute("PRAGMA optimize")
+            self._conn.close()
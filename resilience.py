@@ -0,0 +1,338 @@
+# resilience.py
+"""
+Стійкість викликів до upstream-сервісів (спільний модуль для API Gateway та Loan Service):
+  - circuit breaker на кожен інстанс (поспіль невдачі + частка помилок у вікні);
+  - тимчасове виключення (ejection) інстансу з експоненційним backoff;
+  - бюджет повторів для ідемпотентних GET;
+  - hedged-запити: якщо перша спроба довша за перцентиль затримки, друга йде на іншу репліку.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from load_balancer import LoadBalancer, instance_key
+
+# --- НАЛАШТУВАННЯ ЗА ЗАМОВЧУВАННЯМ ---
+BREAKER_DEFAULTS = {
+    "consecutive_failures": 5,   # поспіль невдач для розмикання
+    "error_rate": 0.5,           # частка невдач у вікні для розмикання
+    "window": 20,                # скільки останніх результатів враховувати
+    "min_volume": 10,            # мінімум запитів у вікні для оцінки частки помилок
+    "base_ejection": 5.0,        # перше виключення інстансу, с
+    "max_ejection": 60.0,        # верхня межа backoff, с
+}
+RETRY_BUDGET_RATIO = 0.2         # повтори не більше 20% від кількості запитів
+RETRY_BUDGET_MIN_PER_SEC = 1.0   # але хоча б один повтор на секунду
+RETRY_BUDGET_MAX_TOKENS = 10.0
+MAX_ATTEMPTS = 2                 # перша спроба + один повтор
+LATENCY_SAMPLES = 200            # скільки останніх затримок тримати для перцентилів
+MIN_HEDGE_SAMPLES = 20           # без достатньої статистики hedging не вмикається
+RESORT_EVERY = 20                # перцентилі перераховуються раз на стільки спостережень
+
+
+class CircuitBreaker:
+    """Стан одного інстансу: closed -> open (ejected) -> half_open (одна проба) -> closed."""
+
+    def __init__(self, consecutive_failures: int, error_rate: float, window: int, min_volume: int,
+                 base_ejection: float, max_ejection: float):
+        self.consecutive_failures = consecutive_failures
+        self.error_rate = error_rate
+        self.min_volume = min_volume
+        self.base_ejection = base_ejection
+        self.max_ejection = max_ejection
+        self.state = "closed"
+        self._outcomes = deque(maxlen=window)
+        self._failures_in_row = 0
+        self._ejections = 0
+        self._open_until = 0.0
+        self._probe_in_flight = False
+
+    def available(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return time.monotonic() >= self._open_until
+        return not self._probe_in_flight
+
+    def dispatch(self):
+        """Викликається перед відправкою запиту на інстанс."""
+        if self.state == "open" and time.monotonic() >= self._open_until:
+            self.state = "half_open"
+        if self.state == "half_open":
+            self._probe_in_flight = True
+
+    def record(self, ok: bool):
+        if self.state == "half_open":
+            self._probe_in_flight = False
+            if ok:
+                self._close()
+            else:
+                self._open()
+            return
+        self._outcomes.append(ok)
+        self._failures_in_row = 0 if ok else self._failures_in_row + 1
+        if self.state != "closed":
+            return
+        failures = self._outcomes.count(False)
+        if self._failures_in_row >= self.consecutive_failures or (
+                len(self._outcomes) >= self.min_volume and failures / len(self._outcomes) >= self.error_rate):
+            self._open()
+
+    def release(self):
+        """Спроба скасована (програла hedge) — результат не зараховується."""
+        self._probe_in_flight = False
+
+    def _open(self):
+        self.state = "open"
+        self._open_until = time.monotonic() + min(self.base_ejection * 2 ** self._ejections, self.max_ejection)
+        self._ejections += 1
+
+    def _close(self):
+        self.state = "closed"
+        self._outcomes.clear()
+        self._failures_in_row = 0
+        self._ejections = 0
+
+    def as_dict(self) -> dict:
+        return {"state": self.state, "failures_in_row": self._failures_in_row, "ejections": self._ejections,
+                "ejected_for": round(max(0.0, self._open_until - time.monotonic()), 3)}
+
+
+class BreakerRegistry:
+    """Circuit breaker на кожен (сервіс, інстанс)."""
+
+    def __init__(self, **settings):
+        self._settings = {**BREAKER_DEFAULTS, **settings}
+        self._breakers: Dict[str, Dict[str, CircuitBreaker]] = {}
+
+    def get(self, service: str, instance: dict) -> CircuitBreaker:
+        by_key = self._breakers.setdefault(service, {})
+        key = instance_key(instance)
+        breaker = by_key.get(key)
+        if breaker is None:
+            breaker = by_key[key] = CircuitBreaker(**self._settings)
+        return breaker
+
+    def filter(self, service: str, instances: List[dict]) -> List[dict]:
+        """Інстанси, не виключені breaker'ом. Якщо виключені всі — повертаємо всі (panic mode)."""
+        healthy = [i for i in instances if self.get(service, i).available()]
+        return healthy or instances
+
+    def stats(self) -> dict:
+        return {service: {k: b.as_dict() for k, b in by_key.items()} for service, by_key in self._breakers.items()}
+
+
+class RetryBudget:
+    """Токени на повтори: кожен запит додає RETRY_BUDGET_RATIO, кожен повтор/hedge витрачає 1."""
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, min_per_sec: float = RETRY_BUDGET_MIN_PER_SEC,
+                 max_tokens: float = RETRY_BUDGET_MAX_TOKENS):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated = time.monotonic()
+        self.retries = 0
+        self.rejected = 0
+
+    def _refill(self, amount: float):
+        now = time.monotonic()
+        amount += (now - self._updated) * self.min_per_sec
+        self._updated = now
+        self._tokens = min(self.max_tokens, self._tokens + amount)
+
+    def deposit(self):
+        self._refill(self.ratio)
+
+    def withdraw(self) -> bool:
+        self._refill(0.0)
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            self.retries += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def as_dict(self) -> dict:
+        return {"tokens": round(self._tokens, 2), "retries": self.retries, "rejected": self.rejected}
+
+
+class LatencyTracker:
+    """Останні затримки сервісу для обчислення перцентилів (поріг hedging)."""
+
+    def __init__(self, samples: int = LATENCY_SAMPLES):
+        self._samples = deque(maxlen=samples)
+        self._sorted: Optional[List[float]] = None
+        self._unsorted = 0
+
+    def observe(self, latency: float):
+        self._samples.append(latency)
+        self._unsorted += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        if len(self._samples) < MIN_HEDGE_SAMPLES:
+            return None
+        if self._sorted is None or self._unsorted >= RESORT_EVERY:
+            self._sorted = sorted(self._samples)
+            self._unsorted = 0
+        return self._sorted[min(len(self._sorted) - 1, int(len(self._sorted) * p / 100))]
+
+
+def _is_failure(resp: httpx.Response) -> bool:
+    return resp.status_code >= 500
+
+
+class UpstreamCaller:
+    """
+    Виклик сервісу з вибором інстансу балансувальником, circuit breaking,
+    повторами в межах бюджету та опційним hedging для ідемпотентних запитів.
+    """
+
+    def __init__(self, balancer: LoadBalancer, breakers: BreakerRegistry,
+                 hedge_percentiles: Optional[Dict[str, float]] = None, max_attempts: int = MAX_ATTEMPTS):
+        self.balancer = balancer
+        self.breakers = breakers
+        self.hedge_percentiles = hedge_percentiles or {}
+        self.max_attempts = max_attempts
+        self._budgets: Dict[str, RetryBudget] = {}
+        self._latencies: Dict[str, LatencyTracker] = {}
+        self._hedges: Dict[str, int] = {}
+
+    def _budget(self, service: str) -> RetryBudget:
+        budget = self._budgets.get(service)
+        if budget is None:
+            budget = self._budgets[service] = RetryBudget()
+        return budget
+
+    def _latency(self, service: str) -> LatencyTracker:
+        tracker = self._latencies.get(service)
+        if tracker is None:
+            tracker = self._latencies[service] = LatencyTracker()
+        return tracker
+
+    async def _attempt(self, service: str, instance: dict,
+                       send: Callable[[dict], Awaitable[httpx.Response]]) -> httpx.Response:
+        breaker = self.breakers.get(service, instance)
+        breaker.dispatch()
+        started = self.balancer.begin(service, instance)
+        try:
+            resp = await send(instance)
+        except asyncio.CancelledError:
+            self.balancer.abandon(service, instance)
+            breaker.release()
+            raise
+        except Exception:
+            self.balancer.end(service, instance, started, ok=False)
+            breaker.record(False)
+            raise
+        ok = not _is_failure(resp)
+        self.balancer.end(service, instance, started, ok=ok)
+        breaker.record(ok)
+        if ok:
+            self._latency(service).observe(time.monotonic() - started)
+        return resp
+
+    async def _hedged(self, service: str, first: dict, candidates: List[dict], tried: set,
+                      send: Callable[[dict], Awaitable[httpx.Response]], delay: float) -> httpx.Response:
+        tasks = {asyncio.create_task(self._attempt(service, first, send))}
+        result = error = None
+        failed = []
+        pending = tasks
+        completed = False
+        try:
+            # Очікування hedge-затримки теж у try: скасування ззовні не лишає першу спробу без власника
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            others = [i for i in candidates if instance_key(i) not in tried]
+            if not done and others and self._budget(service).withdraw():
+                second = self.balancer.pick(service, others)
+                tried.add(instance_key(second))
+                self._hedges[service] = self._hedges.get(service, 0) + 1
+                tasks.add(asyncio.create_task(self._attempt(service, second, send)))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif result is None and not _is_failure(task.result()):
+                        result = task.result()
+                    else:
+                        failed.append(task.result())
+                if result is not None:
+                    break
+            completed = True
+        finally:
+            # Той, хто програв, скасовується; якщо встиг відповісти — закриваємо відповідь
+            for task in pending:
+                task.cancel()
+            for task in pending:
+                try:
+                    failed.append(await task)
+                except BaseException:
+                    pass
+            if not completed:
+                # Виклик скасовано ззовні: не повертається жодна відповідь, закриваються всі
+                for resp in failed + ([result] if result is not None else []):
+                    await resp.aclose()
+        if result is None and failed:
+            result = failed.pop(0)
+        for resp in failed:
+            await resp.aclose()
+        if result is not None:
+            return result
+        raise error
+
+    async def call(self, service: str, instances: List[dict], send: Callable[[dict], Awaitable[httpx.Response]],
+                   idempotent: bool = False, replayable: bool = True,
+                   on_connect_error: Optional[Callable[[dict], None]] = None) -> httpx.Response:
+        """
+        idempotent — запит можна повторити після будь-якої невдачі (GET);
+        replayable — тіло можна надіслати повторно (повтор після ConnectError для будь-якого методу).
+        """
+        candidates = self.breakers.filter(service, instances)
+        budget = self._budget(service)
+        budget.deposit()
+        tried = set()
+        percentile = self.hedge_percentiles.get(service)
+        attempt = 0
+        while True:
+            attempt += 1
+            untried = [i for i in candidates if instance_key(i) not in tried] or candidates
+            instance = self.balancer.pick(service, untried)
+            tried.add(instance_key(instance))
+            delay = self._latency(service).percentile(percentile) if idempotent and percentile else None
+            try:
+                if delay is not None and len(candidates) > 1:
+                    resp = await self._hedged(service, instance, candidates, tried, send, delay)
+                else:
+                    resp = await self._attempt(service, instance, send)
+            except httpx.ConnectError:
+                if on_connect_error is not None:
+                    on_connect_error(instance)
+                if not replayable or attempt >= self.max_attempts or not budget.withdraw():
+                    raise
+                continue
+            except httpx.TransportError:
+                if not idempotent or attempt >= self.max_attempts or not budget.withdraw():
+                    raise
+                continue
+            if not _is_failure(resp) or not idempotent or attempt >= self.max_attempts or not budget.withdraw():
+                return resp
+            await resp.aclose()
+
+    def stats(self) -> dict:
+        services = set(self._budgets) | set(self._latencies)
+        result = {}
+        for service in services:
+            tracker = self._latencies.get(service)
+            p50 = tracker.percentile(50) if tracker else None
+            p95 = tracker.percentile(95) if tracker else None
+            result[service] = {
+                "retry_budget": self._budget(service).as_dict(),
+                "hedges": self._hedges.get(service, 0),
+                "p50_ms": round(p50 * 1000, 3) if p50 is not None else None,
+                "p95_ms": round(p95 * 1000, 3) if p95 is not None else None,
+            }
+        return {"breakers": self.breakers.stats(), "services": result}
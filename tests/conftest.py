@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Сервіси лежать у корені репозиторію як окремі модулі
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import catalog_service
+from catalog_service import BookCreateDTO, BookRepository, CatalogBusinessLogic
+
+
+@pytest.fixture
+def repo(monkeypatch):
+    repo = BookRepository("dict")
+    monkeypatch.setattr(catalog_service, "repo", repo)
+    return repo
+
+
+def book(b_id, title, author, description=None):
+    return {"id": b_id, "title": title, "author": author, "description": description, "available": True}
+
+
+def ids(books):
+    return [b["id"] for b in books]
+
+
+def test_author_substring_search_is_case_insensitive(repo):
+    repo.save_many([book(1, "Dune", "Frank Herbert"), book(2, "Emma", "Jane Austen"),
+                    book(3, "Dune Messiah", "Frank Herbert")])
+    assert ids(repo.find_by_author("HERB")) == [1, 3]
+    assert ids(repo.find_by_author("au")) == [2]    # коротше за n-граму
+    assert repo.find_by_author("tolkien") == []
+
+
+def test_words_must_all_match(repo):
+    repo.save_many([book(1, "Quiet Harbour", "Mary Shelley"), book(2, "Quiet Harbour Lights", "Mary Shelley")])
+    assert ids(repo.find_by_words("title", "lights harbour")) == [2]
+    assert ids(repo.find_by_words("author", "shelley mary")) == [1, 2]
+    assert repo.find_by_words("title", "") == []
+
+
+def test_full_text_search_ranks_matching_books(repo):
+    repo.save(book(1, "Gardening", "Ann Lee", "roses and tulips"))
+    repo.save(book(2, "Roses", "Bob Ray", "roses roses roses"))
+    hits = repo.search("roses", 10)
+    assert [b["id"] for b, _ in hits] == [2, 1]
+
+
+def test_concurrent_adds_of_same_id_accept_one(repo, monkeypatch):
+    get_by_id = repo.get_by_id
+
+    def slow_get_by_id(b_id):
+        found = get_by_id(b_id)
+        time.sleep(0.05)   # обидва потоки встигли б пройти перевірку до вставки
+        return found
+
+    monkeypatch.setattr(repo, "get_by_id", slow_get_by_id)
+    outcomes = []
+
+    def add():
+        try:
+            CatalogBusinessLogic.add(BookCreateDTO(id=500, title="T", author="A"))
+            outcomes.append("ok")
+        except HTTPException as e:
+            outcomes.append(e.status_code)
+
+    threads = [threading.Thread(target=add) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(outcomes, key=str) == [400, "ok"]
+    assert ids(repo.find_by_words("title", "t")) == [500]
@@ -0,0 +1,81 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import catalog_service
+from catalog_service import BookRepository, CatalogBusinessLogic, Reservations
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Свіжий каталог (книги 101 і 102) без lifespan: Discovery для тестів не потрібен
+    monkeypatch.setattr(catalog_service, "repo", BookRepository("dict"))
+    monkeypatch.setattr(catalog_service, "reservations", Reservations())
+    return TestClient(catalog_service.app)
+
+
+def available(client, b_id):
+    return client.get(f"/catalog/books/{b_id}").json()["available"]
+
+
+def reserve(client, *ids, **extra):
+    return client.post("/catalog/reservations", json={"ids": list(ids), "ttl": 10, **extra})
+
+
+def test_reservation_is_compare_and_set(client):
+    first = reserve(client, 101, 102)
+    assert first.status_code == 201
+    assert not available(client, 101) and not available(client, 102)
+
+    second = reserve(client, 102)
+    assert second.status_code == 409
+    assert second.json()["detail"]["ids"] == [102]
+
+
+def test_reservation_rejects_stale_etag(client):
+    client.put("/catalog/books/101/status", params={"available": False})
+    stale = client.get("/catalog/books/101").headers["etag"]
+    client.put("/catalog/books/101/status", params={"available": True})
+    fresh = client.get("/catalog/books/101").headers["etag"]
+
+    assert reserve(client, 101, if_match={"101": stale}).status_code == 412
+    assert available(client, 101)
+    assert reserve(client, 101, if_match={"101": fresh}).status_code == 201
+
+
+def test_confirm_is_idempotent(client):
+    r_id = reserve(client, 101).json()["reservation_id"]
+    first = client.post(f"/catalog/reservations/{r_id}/confirm")
+    again = client.post(f"/catalog/reservations/{r_id}/confirm")
+    assert first.status_code == again.status_code == 200
+    assert first.json() == again.json() == {"status": "confirmed", "ids": [101]}
+    assert not available(client, 101)
+
+
+def test_cancel_after_confirm_rolls_it_back(client):
+    r_id = reserve(client, 101).json()["reservation_id"]
+    client.post(f"/catalog/reservations/{r_id}/confirm")
+    assert client.delete(f"/catalog/reservations/{r_id}").status_code == 200
+    assert available(client, 101)
+    assert client.delete(f"/catalog/reservations/{r_id}").status_code == 404
+    assert client.post(f"/catalog/reservations/{r_id}/confirm").status_code == 404
+
+
+def test_cancel_of_confirmed_reservation_does_not_free_a_book_taken_since(client):
+    old = reserve(client, 101).json()["reservation_id"]
+    client.post(f"/catalog/reservations/{old}/confirm")
+    client.put("/catalog/books/status", json={"updates": [{"id": 101, "available": True}]})   # книгу повернули
+    new = reserve(client, 101).json()["reservation_id"]
+
+    assert client.delete(f"/catalog/reservations/{old}").status_code == 404
+    assert not available(client, 101)
+    assert client.post(f"/catalog/reservations/{new}/confirm").status_code == 200
+
+
+def test_expired_reservation_frees_books_and_cannot_be_confirmed(client):
+    r_id = client.post("/catalog/reservations", json={"ids": [101], "ttl": 0.05}).json()["reservation_id"]
+    time.sleep(0.1)
+    assert CatalogBusinessLogic.release_expired() == [101]
+    assert available(client, 101)
+    assert client.post(f"/catalog/reservations/{r_id}/confirm").status_code == 404
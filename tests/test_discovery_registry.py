@@ -0,0 +1,91 @@
+import asyncio
+import json
+import os
+import time
+
+from discovery_service import RegistryStore, ServiceRegistry
+
+
+def restored(directory):
+    """Реєстр, відновлений зі знімка та журналу так само, як на старті Discovery."""
+    store = RegistryStore(directory)
+    snapshot, records = store.load()
+    registry = ServiceRegistry(ttl=15)
+    if snapshot is not None:
+        registry.load(snapshot)
+    registry.replay(records)
+    return registry, store
+
+
+def populated(directory, now):
+    store = RegistryStore(directory)
+    store.load()
+    registry = ServiceRegistry(ttl=15)
+    registry.store = store
+    lease = registry.grant_lease(10, now=now)
+    registry.register("catalog", "127.0.0.1", 8001, lease.id, now=now)
+    registry.register("readers", "127.0.0.1", 8002, now=now)
+    return registry, store, lease
+
+
+def test_snapshot_and_log_replay_restore_state(tmp_path):
+    now = time.time()
+    registry, store, _ = populated(str(tmp_path), now)
+    asyncio.run(store.compact(registry.dump()))
+    registry.register("loans", "127.0.0.1", 8003, now=now)
+    asyncio.run(store.flush())
+
+    again, _ = restored(str(tmp_path))
+    assert again.as_dict() == registry.as_dict()
+
+
+def test_log_left_after_snapshot_replace_is_skipped(tmp_path):
+    """Зупинка між os.replace знімка і обнуленням журналу: старі записи не перезаписують знімок."""
+    now = time.time()
+    registry, store, lease = populated(str(tmp_path), now)
+    asyncio.run(store.flush())
+    # Знімок записано, журнал — ні (як після аварії посеред _write_snapshot)
+    with open(store.snapshot_path, "w", encoding="utf-8") as f:
+        json.dump({**registry.dump(), "seq": store.seq}, f)
+
+    again, again_store = restored(str(tmp_path))
+    assert again_store.seq == store.seq
+    assert again.as_dict() == registry.as_dict()
+    # Інстанс lease прострочується разом з ним, а не лишається «зомбі»
+    assert again.reap(now=now + 11) == 1
+    assert "catalog" not in again.as_dict()
+
+
+def test_replayed_grant_keeps_existing_lease_instances():
+    now = time.time()
+    registry = ServiceRegistry(ttl=15)
+    lease = registry.grant_lease(10, now=now)
+    registry.register("catalog", "127.0.0.1", 8001, lease.id, now=now)
+
+    assert registry.grant_lease(10, lease_id=lease.id, now=now) is lease
+    assert lease.instances == {("catalog", "127.0.0.1", 8001)}
+    assert registry.reap(now=now + 11) == 1
+
+
+def test_compaction_waits_for_cancelled_flush(tmp_path):
+    """Скасований flush дописує журнал у потоці; компактизація чекає його, а не обнуляє журнал під ним."""
+    registry, store, _ = populated(str(tmp_path), time.time())
+    write_log = store._write_log
+
+    def slow_write(data):
+        time.sleep(0.2)
+        write_log(data)
+
+    store._write_log = slow_write
+
+    async def scenario():
+        flush = asyncio.create_task(store.flush())
+        await asyncio.sleep(0.05)
+        flush.cancel()
+        await asyncio.gather(flush, return_exceptions=True)
+        await store.compact(registry.dump())
+
+    asyncio.run(scenario())
+    assert os.path.getsize(store.log_path) == 0
+    again, _ = restored(str(tmp_path))
+    assert again.as_dict() == registry.as_dict()
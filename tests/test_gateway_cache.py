@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+import api_gateway
+from api_gateway import ResponseCache, UpstreamResult, _conditional_response
+from etag import etag_matches, make_etag
+from starlette.requests import Request
+
+
+def key(service, path):
+    return "GET", service, path, (), ()
+
+
+def result(body=b"[]", status=200, **headers):
+    return UpstreamResult(status, {"etag": make_etag(body), **{k.replace("_", "-"): v for k, v in headers.items()}},
+                          body)
+
+
+def request(**headers):
+    scope = {"type": "http", "method": "GET", "path": "/", "query_string": b"",
+             "headers": [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()]}
+    return Request(scope)
+
+
+def test_etag_matches_weak_comparison():
+    assert etag_matches('"a"', '"a"')
+    assert etag_matches('W/"a"', '"a"')
+    assert etag_matches('"b", W/"a"', 'W/"a"')
+    assert etag_matches("*", '"a"')
+    assert not etag_matches("", '"a"')
+    assert not etag_matches('"b"', '"a"')
+
+
+def test_conditional_response_returns_304_for_matching_etag():
+    cached = result(b'{"id":1}')
+    etag = cached.headers["etag"]
+    assert _conditional_response(request(if_none_match=etag), cached).status_code == 304
+    full = _conditional_response(request(if_none_match='"other"'), cached)
+    assert full.status_code == 200 and full.body == b'{"id":1}'
+
+
+def test_lookup_fresh_then_stale_then_refreshed():
+    cache = ResponseCache(10, 1024)
+    cache.store(key("catalog", "books"), result(), ttl=30, generation=0)
+    entry, fresh = cache.lookup(key("catalog", "books"))
+    assert fresh and entry.etag == make_etag(b"[]")
+    entry.expires = time.monotonic() - 1
+    assert cache.lookup(key("catalog", "books")) == (entry, False)
+    cache.refresh(key("catalog", "books"), ttl=30)
+    assert cache.lookup(key("catalog", "books"))[1]
+
+
+def test_only_cacheable_results_are_stored():
+    cache = ResponseCache(10, 1024)
+    cache.store(key("catalog", "books/1"), result(status=404), ttl=30, generation=0)
+    cache.store(key("catalog", "books/2"), result(cache_control="no-store"), ttl=30, generation=0)
+    cache.store(key("catalog", "books/3"), result(b"x" * 2048), ttl=30, generation=0)
+    assert cache.stats()["entries"] == 0
+
+
+def test_response_started_before_write_is_not_stored():
+    cache = ResponseCache(10, 1024)
+    generation = cache.generation("catalog")
+    cache.invalidate("catalog", "books/1/status")
+    cache.store(key("catalog", "books/1"), result(), ttl=30, generation=generation)
+    assert cache.lookup(key("catalog", "books/1")) == (None, False)
+
+
+def test_write_invalidates_only_affected_paths():
+    cache = ResponseCache(10, 1024)
+    for path in ("books", "books/5", "books/6", "search"):
+        cache.store(key("catalog", path), result(), ttl=30, generation=0)
+    cache.store(key("readers", "12"), result(), ttl=30, generation=0)
+
+    cache.invalidate("catalog", "books/5/status")
+
+    assert cache.lookup(key("catalog", "books"))[0] is None
+    assert cache.lookup(key("catalog", "books/5"))[0] is None
+    assert cache.lookup(key("catalog", "search"))[0] is None
+    assert cache.lookup(key("catalog", "books/6"))[0] is not None
+    assert cache.lookup(key("readers", "12"))[0] is not None
+
+
+def test_write_without_rule_drops_whole_service():
+    cache = ResponseCache(10, 1024)
+    cache.store(key("catalog", "books/6"), result(), ttl=30, generation=0)
+    cache.invalidate("catalog", "unknown/route")
+    assert cache.lookup(key("catalog", "books/6"))[0] is None
+
+
+def test_stale_entry_is_revalidated_with_if_none_match(monkeypatch):
+    cache = ResponseCache(10, 1024)
+    monkeypatch.setattr(api_gateway, "response_cache", cache)
+    cached = result(b'[{"id":1}]')
+    k = key("catalog", "books")
+    cache.store(k, cached, ttl=30, generation=0)
+    cache.lookup(k)[0].expires = time.monotonic() - 1
+    sent = []
+
+    async def fetch(client, service_name, instances, clean_path, method, params, headers, etag=None,
+                    max_bytes=None):
+        sent.append(etag)
+        return UpstreamResult(304, {"etag": etag}, b"")
+
+    monkeypatch.setattr(api_gateway, "_fetch_buffered", fetch)
+    got = asyncio.run(api_gateway._shared_result(None, "catalog", [], "books", [], {}, k))
+
+    assert sent == [cached.headers["etag"]]
+    assert got is cached
+    assert cache.lookup(k)[1]
@@ -0,0 +1,78 @@
+import random
+from collections import Counter
+
+import pytest
+
+import load_balancer
+from load_balancer import LoadBalancer
+
+A, B, C = ({"host": "127.0.0.1", "port": port} for port in (9001, 9002, 9003))
+
+
+def busy(balancer, service, instance, requests):
+    for _ in range(requests):
+        balancer.begin(service, instance)
+
+
+def picks(balancer, service, instances, n=300):
+    return Counter(balancer.pick(service, instances)["port"] for _ in range(n))
+
+
+def test_round_robin_cycles_through_instances():
+    balancer = LoadBalancer({"s": "round_robin"})
+    assert [balancer.pick("s", [A, B, C])["port"] for _ in range(6)] == [9001, 9002, 9003] * 2
+
+
+def test_least_outstanding_avoids_busy_instances():
+    balancer = LoadBalancer({"s": "least_outstanding"})
+    busy(balancer, "s", A, 2)
+    busy(balancer, "s", B, 1)
+    assert set(picks(balancer, "s", [A, B, C])) == {9003}
+
+
+def test_p2c_never_picks_the_worse_of_two():
+    random.seed(1)
+    balancer = LoadBalancer({"s": "p2c"})
+    busy(balancer, "s", A, 5)
+    counts = picks(balancer, "s", [A, B, C])
+    assert counts[9001] == 0
+    assert counts[9002] > 0 and counts[9003] > 0
+
+
+class Clock:
+    """Керований time.monotonic: вага EWMA залежить від часу між спостереженнями."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_ewma_prefers_faster_instance(monkeypatch):
+    random.seed(1)
+    clock = Clock()
+    monkeypatch.setattr(load_balancer, "time", clock)
+    balancer = LoadBalancer({"s": "ewma"})
+    for instance, latency in ((A, 0.5), (B, 0.01)):
+        started = balancer.begin("s", instance)
+        clock.now += 30.0   # спостереження після кількох сталих часу майже замінює початкову оцінку
+        balancer.end("s", instance, started + 30.0 - latency)
+    counts = picks(balancer, "s", [A, B])
+    assert counts[9002] > counts[9001] * 3
+
+
+def test_abandoned_request_is_not_counted_as_latency():
+    balancer = LoadBalancer({"s": "round_robin"})
+    balancer.begin("s", A)
+    balancer.abandon("s", A)
+    stats = balancer.stats()["s"]["instances"]["127.0.0.1:9001"]
+    assert stats["in_flight"] == 0 and stats["requests"] == 0
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        LoadBalancer({"s": "fastest"})
+    balancer = LoadBalancer()
+    with pytest.raises(ValueError):
+        balancer.set_policy("s", "fastest")
+    assert balancer.policy_name("s") == "p2c"
@@ -0,0 +1,77 @@
+# text_search.py
+"""
+Повнотекстовий пошук з ранжуванням BM25 (Catalog Service).
+Інвертований індекс: терм -> (номери документів, зважені частоти терма) у двох компактних array —
+8 байт на входження терма замість елемента dict з float.
+Поля мають ваги (збіг у назві важить більше, ніж в описі), документи додаються інкрементально.
+"""
+import heapq
+import math
+import re
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+TOKEN_RE = re.compile(r"\w+")   # \w у Python 3 — Unicode: кирилиця, латиниця, цифри
+BM25_K1 = 1.2
+BM25_B = 0.75
+FIELD_WEIGHTS = {"title": 3.0, "author": 2.0, "description": 1.0}
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return TOKEN_RE.findall(text.casefold()) if text else []
+
+
+class FullTextIndex:
+    """
+    Номер документа — його позиція: документи додаються по порядку 0, 1, 2...
+    Не потокобезпечний: власник викликає add і search під своїм замком (BookRepository.lock).
+    """
+
+    def __init__(self, field_weights: Dict[str, float] = FIELD_WEIGHTS, k1: float = BM25_K1, b: float = BM25_B):
+        self._weights = field_weights
+        self._k1 = k1
+        self._b = b
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._lengths = array("f")   # зважена довжина документа за його номером
+        self._total_length = 0.0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, doc_id: int, doc: dict):
+        """Індексує новий документ (текстові поля книги після додавання не змінюються)."""
+        if doc_id != len(self._lengths):
+            raise ValueError(f"Очікувався документ {len(self._lengths)}, отримано {doc_id}")
+        freqs: Dict[str, float] = {}
+        for field, weight in self._weights.items():
+            for term in tokenize(doc.get(field)):
+                freqs[term] = freqs.get(term, 0.0) + weight
+        for term, tf in freqs.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array("I"), array("f"))
+            postings[0].append(doc_id)
+            postings[1].append(tf)
+        length = sum(freqs.values())
+        self._lengths.append(length)
+        self._total_length += length
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[int, float]]:
+        """Top-k (номер документа, score) за BM25; рахуються лише документи зі списків термів запиту."""
+        n = len(self._lengths)
+        if not n:
+            return []
+        avgdl = self._total_length / n
+        k1, b = self._k1, self._b
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            docs, tfs = postings
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            lengths = self._lengths
+            for doc_id, tf in zip(docs, tfs):
+                norm = k1 * (1 - b + b * lengths[doc_id] / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
@@ -6,6 +6,7 @@ import time
 # --- КОНФІГУРАЦІЯ ---
 # Клієнт звертається ТІЛЬКИ до Gateway
 GATEWAY_URL = "http://127.0.0.1:8080"
+PAGE_SIZE = 50  # Рядків таблиці на сторінку (дані вантажаться посторінково)
 
 # Налаштування сторінки
 st.set_page_config(
@@ -15,8 +16,8 @@ st.set_page_config(
 )
 
 # --- ДОПОМІЖНІ ФУНКЦІЇ ---
-def api_request(method, endpoint, json=None, params=None):
-    """Обгортка для запитів з обробкою помилок (UX)"""
+def api_request(method, endpoint, json=None, params=None, with_cursor=False):
+    """Обгортка для запитів з обробкою помилок (UX); with_cursor — ще й курсор наступної сторінки"""
     url = f"{GATEWAY_URL}/{endpoint}"
     try:
         if method == "GET":
@@ -33,12 +34,45 @@ def api_request(method, endpoint, json=None, params=None):
             except:
                 detail = resp.text
             st.error(f"❌ Помилка API ({resp.status_code}): {detail}")
-            return None
+            return (None, None) if with_cursor else None
         
+        if with_cursor:
+            return resp.json(), resp.headers.get("X-Next-Cursor")
         return resp.json()
     except Exception as e:
         st.error(f"⚠️ Не вдалося з'єднатися з Gateway: {e}")
-        return None
+        return (None, None) if with_cursor else None
+
+def paged_table(key, endpoint, params=None):
+    """Поточна сторінка списку з кнопками навігації; курсори відкритих сторінок — у session_state"""
+    cursors = st.session_state.setdefault(f"{key}_cursors", [None])
+    rows, next_cursor = api_request("GET", endpoint, params={**(params or {}), "after": cursors[-1],
+                                                             "limit": PAGE_SIZE}, with_cursor=True)
+    c1, c2, c3 = st.columns([1, 1, 6])
+    if c1.button("⬅️ Назад", key=f"{key}_prev", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    if c2.button("Далі ➡️", key=f"{key}_next", disabled=not next_cursor):
+        cursors.append(next_cursor)
+        st.rerun()
+    c3.caption(f"Сторінка {len(cursors)}")
+    return rows
+
+def batch_request(items):
+    """Кілька GET-запитів одним round-trip через Gateway (POST /batch): {мітка: шлях або (шлях, параметри)}"""
+    requests_list = [{"id": k, "path": p} if isinstance(p, str) else {"id": k, "path": p[0], "params": p[1]}
+                     for k, p in items.items()]
+    res = api_request("POST", "batch", json={"requests": requests_list})
+    results = {}
+    if res:
+        for item in res["responses"]:
+            if item["status"] >= 400:
+                detail = (item["body"] or {}).get("detail") if isinstance(item["body"], dict) else item["body"]
+                st.error(f"❌ Помилка API ({item['status']}): {detail}")
+                results[item["id"]] = None
+            else:
+                results[item["id"]] = item["body"]
+    return results
 
 # --- БІЧНА ПАНЕЛЬ (НАВІГАЦІЯ) ---
 st.sidebar.title("📚 Library System")
@@ -54,7 +88,7 @@ if page == "Каталог книг":
     if st.button("🔄 Оновити список"):
         st.rerun()
         
-    books = api_request("GET", "catalog/books")
+    books = paged_table("books", "catalog/books")
     if books:
         df = pd.DataFrame(books)
         # Прикрашаємо таблицю: Available -> ✅/❌
@@ -88,11 +122,20 @@ elif page == "Читачі":
     st.header("busts_in_silhouette: Управління Читачами")
 
     # 1. READ: Список читачів
-    readers = api_request("GET", "readers/") # Слеш важливий для Gateway
+    readers = paged_table("readers", "readers/") # Слеш важливий для Gateway
     if readers:
         df_r = pd.DataFrame(readers)
         st.dataframe(df_r, use_container_width=True)
 
+    # Пошук за початком слів імені (префіксний індекс на сервері)
+    name_query = st.text_input("🔍 Пошук читача за іменем", placeholder="напр. влад бог")
+    if name_query:
+        found = api_request("GET", "readers/search", params={"prefix": name_query})
+        if found:
+            st.dataframe(pd.DataFrame(found), use_container_width=True)
+        elif found is not None:
+            st.info("Нікого не знайдено.")
+
     col_l, col_r = st.columns(2)
     
     # 2. CREATE: Реєстрація
@@ -128,20 +171,24 @@ elif page == "Читачі":
 elif page == "Видача (Loans)":
     st.header("🔄 Оркестрація Видачі (Loans)")
     
-    # Складна агрегація: показуємо і книги, і читачів для зручності
+    # Складна агрегація: читачі, книги та активні позики одним пакетним запитом.
+    # Фільтри та потрібні колонки обчислює сервер; завантажується перша сторінка кожного списку
+    data = batch_request({
+        "readers": ("readers/", {"status": "active", "fields": "id,name,status", "limit": PAGE_SIZE}),
+        "books": ("catalog/books", {"available": "true", "fields": "id,title", "limit": PAGE_SIZE}),
+        "loans": ("loans/active", {"limit": PAGE_SIZE}),
+    })
     col1, col2 = st.columns(2)
     with col1:
         st.info("Активні читачі")
-        readers = api_request("GET", "readers/")
+        readers = data.get("readers")
         if readers: st.dataframe(pd.DataFrame(readers)[['id', 'name', 'status']], height=150)
     
     with col2:
         st.info("Доступні книги")
-        books = api_request("GET", "catalog/books")
+        books = data.get("books")
         if books: 
-            df_b = pd.DataFrame(books)
-            # Фільтруємо тільки доступні книги (Business Logic)
-            st.dataframe(df_b[df_b['available'] == True][['id', 'title']], height=150)
+            st.dataframe(pd.DataFrame(books), height=150)
 
     st.divider()
 
@@ -160,10 +207,22 @@ elif page == "Видача (Loans)":
                 time.sleep(2)
                 st.rerun()
 
+    # Пакетна видача: усі книги перевіряються й списуються в каталозі одним запитом
+    with st.form("batch_loan_form"):
+        batch_books = st.multiselect("Кілька доступних книг", [b["id"] for b in books or []])
+        batch_reader = st.number_input("ID Читача", min_value=1, key="batch_reader")
+        if st.form_submit_button("Видати вибрані книги") and batch_books:
+            res = api_request("POST", "loans/batch",
+                              json={"loans": [{"bookId": b, "readerId": batch_reader} for b in batch_books]})
+            if res:
+                st.success(f"Успіх! Створено видач: {len(res)}")
+                time.sleep(2)
+                st.rerun()
+
     # 2. READ: Активні позики
     st.divider()
     st.subheader("📂 Активні позики на руках")
-    loans = api_request("GET", "loans/active")
+    loans = data.get("loans")
     if loans:
         st.dataframe(pd.DataFrame(loans), use_container_width=True)
     else:
@@ -177,4 +236,12 @@ elif page == "Видача (Loans)":
         if res:
             st.success("Книгу повернуто! Каталог оновлено.")
             time.sleep(2)
+            st.rerun()
+
+    ret_ids = st.multiselect("Кілька записів видачі", [l["id"] for l in loans or []])
+    if st.button("Повернути вибрані") and ret_ids:
+        res = api_request("PUT", "loans/return", json={"ids": ret_ids})
+        if res:
+            st.success(f"{res['message']}. Каталог оновлено.")
+            time.sleep(2)
             st.rerun()
\ No newline at end of file